@@ -1,18 +1,58 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from config import Config
+from .sharding import ShardedSession, configure_binds
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': ShardedSession})
 
 
-def create_app():
+def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
+    configure_binds(app)
     
     db.init_app(app)
+
+    from .deadline import Deadlines
+    app.extensions['deadlines'] = Deadlines(app)
+
+    from .leasing import PrizeLeasePool
+    app.extensions['prize_leases'] = PrizeLeasePool(app)
+
+    from .invalidation import ChangeTracker
+    app.extensions['change_tracker'] = ChangeTracker(app)
+
+    from .cache import create_cache
+    app.extensions['cache'] = create_cache(app)
+
+    # Take the client address from the trusted proxies' X-Forwarded-For, for per-IP rate limits.
+    if app.config['RATE_LIMIT_TRUSTED_PROXIES']:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['RATE_LIMIT_TRUSTED_PROXIES'])
+
+    from .rate_limit import create_rate_limiter
+    app.extensions['rate_limiter'] = create_rate_limiter(app)
+
+    from .bulkhead import create_bulkheads
+    app.extensions['bulkheads'] = create_bulkheads(app)
+
+    from .coalescing import SingleFlight
+    app.extensions['single_flight'] = SingleFlight()
+
+    from .existence import UserExistence
+    app.extensions['user_existence'] = UserExistence(app)
+
+    from .timing_wheel import EligibilityNotifier
+    app.extensions['eligibility_notifier'] = EligibilityNotifier(app)
+
+    from .leaderboard import Leaderboard
+    app.extensions['leaderboard'] = Leaderboard(app)
+
+    if app.config['REQUEST_LOG_PATH']:
+        from .recording import RequestRecorder
+        app.extensions['request_recorder'] = RequestRecorder(app)
     
     from .routes import main
     app.register_blueprint(main)
     
     return app
-
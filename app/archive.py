@@ -0,0 +1,103 @@
+import time
+from datetime import datetime, timedelta
+from flask import current_app, g
+from sqlalchemy import delete, func, insert, select, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from . import db
+from .models import Adventure, ArchivedAdventure, ArchivedMaterialCount
+from .sharding import shard_count
+
+# Adventures in these states can never change again, so they are safe to archive.
+ARCHIVABLE_STATUSES = ("No Material", "Used Material")
+
+ARCHIVED_COLUMNS = ['id', 'timestamp', 'rng_score', 'material', 'status', 'user_id', 'change_seq']
+
+
+# Move adventures older than the retention window into the archive, shard by shard.
+def archive_adventures(retention_days=None):
+    config = current_app.config
+    retention_days = config['ARCHIVE_RETENTION_DAYS'] if retention_days is None else retention_days
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    archived = 0
+    for shard in range(shard_count()):
+        g.shard = shard
+        while True:
+            moved = _archive_chunk(cutoff, config['ARCHIVE_CHUNK_SIZE'])
+            if not moved:
+                break
+            archived += moved
+            time.sleep(config['ARCHIVE_PAUSE_SECONDS'])
+    return archived
+
+
+# Move one chunk of old adventures in a single short transaction.
+def _archive_chunk(cutoff, chunk_size):
+    ids = db.session.execute(
+        select(Adventure.id)
+        .where(Adventure.timestamp < cutoff, Adventure.status.in_(ARCHIVABLE_STATUSES))
+        .order_by(Adventure.id)
+        .limit(chunk_size)
+    ).scalars().all()
+    if not ids:
+        return 0
+
+    # Copy the rows, keeping their ids so clients' references stay valid.
+    columns = [getattr(Adventure, name) for name in ARCHIVED_COLUMNS]
+    db.session.execute(insert(ArchivedAdventure).from_select(ARCHIVED_COLUMNS, select(*columns).where(Adventure.id.in_(ids))))
+
+    # Fold the chunk into the per-user counts that the materials summary reads instead of the archive.
+    counts = db.session.execute(
+        select(Adventure.user_id, Adventure.material, Adventure.status, func.count(), func.max(Adventure.id))
+        .where(Adventure.id.in_(ids))
+        .group_by(Adventure.user_id, Adventure.material, Adventure.status)
+    ).all()
+    for user_id, material, status, count, newest_id in counts:
+        upsert = sqlite_insert(ArchivedMaterialCount).values(
+            user_id=user_id, material=material, status=status, count=count, newest_id=newest_id)
+        db.session.execute(upsert.on_conflict_do_update(
+            index_elements=['user_id', 'material', 'status'],
+            set_={
+                'count': ArchivedMaterialCount.count + upsert.excluded.count,
+                'newest_id': func.max(ArchivedMaterialCount.newest_id, upsert.excluded.newest_id),
+            },
+        ))
+
+    db.session.execute(delete(Adventure).where(Adventure.id.in_(ids)))
+    db.session.commit()
+    return len(ids)
+
+
+# Count a user's archived adventures per status and material.
+def archived_material_counts(user_id):
+    return db.session.execute(
+        select(ArchivedMaterialCount.status, ArchivedMaterialCount.material, ArchivedMaterialCount.count)
+        .where(ArchivedMaterialCount.user_id == user_id)
+    ).all()
+
+
+# A page of a user's adventures, newest first, after the (timestamp, id) position `before`.
+# The archive holds older rows but not only older ones (unused materials stay hot however old),
+# so both tables are read and merged; a full hot page bounds the archived rows that can matter.
+def adventure_history(user_id, before=None, limit=None):
+    adventures = _newest_first(Adventure, user_id, before).limit(limit).all()
+    floor = _position(adventures[-1]) if limit is not None and len(adventures) == limit else None
+    archived = _newest_first(ArchivedAdventure, user_id, before, floor).limit(limit).all()
+    if not archived:
+        return adventures
+    adventures = sorted(adventures + archived, key=_position, reverse=True)
+    return adventures[:limit]
+
+
+# A user's rows of an adventure table between two positions, newest first. Reads along the
+# (user_id, timestamp) index, whose entries end with the rowid id, so no page is sorted.
+def _newest_first(model, user_id, before=None, after=None):
+    query = model.query.filter(model.user_id == user_id)
+    if before is not None:
+        query = query.filter(tuple_(model.timestamp, model.id) < tuple_(*before))
+    if after is not None:
+        query = query.filter(tuple_(model.timestamp, model.id) > tuple_(*after))
+    return query.order_by(model.timestamp.desc(), model.id.desc())
+
+
+def _position(adventure):
+    return adventure.timestamp, adventure.id
@@ -0,0 +1,80 @@
+import threading
+import time
+from .metrics import metrics
+
+# Upper bounds in seconds of the queue wait counters kept per bulkhead.
+WAIT_BUCKETS = (0.001, 0.01, 0.1, 1.0)
+
+
+# One bulkhead per endpoint listed in BULKHEADS, by endpoint name.
+def create_bulkheads(app):
+    config = app.config
+    return {
+        endpoint: Bulkhead(endpoint, limit, queue_size, config['BULKHEAD_MAX_WAIT_SECONDS'])
+        for endpoint, (limit, queue_size) in config['BULKHEADS'].items()
+    }
+
+
+# A Bulkhead lets at most `limit` requests of one route run at a time in this worker, so a
+# storm on one route cannot take every thread and database connection from the others.
+#
+# Up to queue_size more wait their turn in arrival order, for at most max_wait seconds;
+# anything beyond is turned away at once, which is cheaper for everyone than queueing it.
+# Admissions, rejections and time spent queued are counted in the metrics under
+# bulkhead.<endpoint>.
+class Bulkhead:
+    def __init__(self, name, limit, queue_size, max_wait):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    # Take a slot, queueing for one if needed. False if the request should be shed.
+    def acquire(self):
+        started = time.monotonic()
+        with self._condition:
+            # Newcomers do not overtake queued requests.
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                self._count_wait(0)
+                return True
+            if self.waiting >= self.queue_size:
+                self._count('rejected')
+                return False
+
+            self._count('queued')
+            self.waiting += 1
+            try:
+                while self.active >= self.limit:
+                    remaining = started + self.max_wait - time.monotonic()
+                    if remaining <= 0:
+                        self._count('timed_out')
+                        return False
+                    self._condition.wait(remaining)
+                self.active += 1
+            finally:
+                self.waiting -= 1
+                # Pass a wake-up this request did not use on to the next in line.
+                if self.waiting and self.active < self.limit:
+                    self._condition.notify()
+        self._count_wait(time.monotonic() - started)
+        return True
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def _count_wait(self, seconds):
+        prefix = f"bulkhead.{self.name}"
+        metrics.increment(f"{prefix}.admitted")
+        metrics.increment(f"{prefix}.wait_seconds_total", seconds)
+        for bound in WAIT_BUCKETS:
+            if seconds <= bound:
+                metrics.increment(f"{prefix}.wait_seconds_le_{bound:g}")
+
+    def _count(self, event):
+        metrics.increment(f"bulkhead.{self.name}.{event}")
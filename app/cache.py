@@ -0,0 +1,352 @@
+import pickle
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from urllib.parse import urlparse
+from .metrics import metrics
+from .shared_memory import SharedSegment, stable_hash
+
+
+# Build the cache backend selected by CACHE_BACKEND.
+def create_cache(app):
+    config = app.config
+    backend = config['CACHE_BACKEND']
+    if backend == 'lru':
+        return LRUCache(config['CACHE_MAX_ENTRIES'], config['CACHE_MAX_BYTES'], config['CACHE_MAX_ENTRY_BYTES'],
+                        config['CACHE_DEFAULT_TTL'])
+    if backend == 'shared_memory':
+        return SharedMemoryCache(config['CACHE_SHARED_MEMORY_NAME'], config['CACHE_MAX_ENTRIES'],
+                                 config['CACHE_SLOT_SIZE'], config['CACHE_DEFAULT_TTL'])
+    if backend == 'redis':
+        return RedisCache(config['CACHE_REDIS_URL'], config['CACHE_DEFAULT_TTL'], config['CACHE_REDIS_TIMEOUT'])
+    raise ValueError(f"Unknown CACHE_BACKEND {backend!r}")
+
+
+# Common interface of the cache backends. Misses return None, so None cannot be cached.
+# Hits, misses and evictions are counted in the metrics under cache.<backend>.
+class Cache(ABC):
+    name = 'cache'
+
+    def __init__(self, default_ttl):
+        self.default_ttl = default_ttl
+
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def set(self, key, value, ttl=None):
+        pass
+
+    @abstractmethod
+    def delete(self, key):
+        pass
+
+    def _count(self, event):
+        metrics.increment(f"cache.{self.name}.{event}")
+
+
+# An in-process cache holding up to max_entries values and max_bytes of them, evicting the
+# least recently used. Values are mostly serialized response bodies, so an entry is sized as
+# its key and value objects; values over max_entry_bytes are not cached.
+class LRUCache(Cache):
+    name = 'lru'
+
+    def __init__(self, max_entries, max_bytes, max_entry_bytes, default_ttl):
+        super().__init__(default_ttl)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self._count('misses')
+                return None
+            self._entries.move_to_end(key)
+            self._count('hits')
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_entry_bytes:
+            self._count('oversized')
+            self.delete(key)
+            return
+        expires_at = time.monotonic() + (ttl or self.default_ttl)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expires_at, value, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._count('evictions')
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+
+# A cache shared by every worker process on the host, kept in a fixed-size
+# multiprocessing.shared_memory segment and guarded by a lock file.
+#
+# The segment is an open-addressed table of fixed-size slots. A key may live in any of
+# PROBE_LENGTH slots after its hash; when all are taken the least recently used is evicted.
+# Each slot holds the key's hash, expiry, last use and the pickled (key, value).
+class SharedMemoryCache(Cache):
+    name = 'shared_memory'
+    HEADER = struct.Struct('<QddI')
+    PROBE_LENGTH = 8
+
+    def __init__(self, segment_name, slots, slot_size, default_ttl):
+        super().__init__(default_ttl)
+        self.slots = slots
+        self.slot_size = slot_size
+        self._segment = SharedSegment(segment_name, slots * slot_size)
+
+    def get(self, key):
+        key_hash = stable_hash(key)
+        now = time.time()
+        with self._locked():
+            for slot in self._probe(key_hash):
+                slot_hash, expires_at, _, length = self._header(slot)
+                if slot_hash != key_hash or expires_at < now:
+                    continue
+                offset = slot * self.slot_size + self.HEADER.size
+                stored_key, value = pickle.loads(self._segment.buf[offset:offset + length])
+                if stored_key == key:
+                    self.HEADER.pack_into(self._segment.buf, slot * self.slot_size, slot_hash, expires_at, now, length)
+                    self._count('hits')
+                    return value
+        self._count('misses')
+        return None
+
+    def set(self, key, value, ttl=None):
+        payload = pickle.dumps((key, value), protocol=pickle.HIGHEST_PROTOCOL)
+        # Values that do not fit in a slot are simply not cached.
+        if len(payload) > self.slot_size - self.HEADER.size:
+            self._count('oversized')
+            return
+        key_hash = stable_hash(key)
+        now = time.time()
+        with self._locked():
+            slot = self._choose_slot(key_hash, now)
+            offset = slot * self.slot_size
+            self.HEADER.pack_into(self._segment.buf, offset, key_hash, now + (ttl or self.default_ttl), now, len(payload))
+            self._segment.buf[offset + self.HEADER.size:offset + self.HEADER.size + len(payload)] = payload
+
+    def delete(self, key):
+        key_hash = stable_hash(key)
+        with self._locked():
+            for slot in self._probe(key_hash):
+                if self._header(slot)[0] == key_hash:
+                    self.HEADER.pack_into(self._segment.buf, slot * self.slot_size, 0, 0.0, 0.0, 0)
+
+    # Detach from the segment, removing it from the host if unlink is set.
+    def close(self, unlink=False):
+        self._segment.close(unlink)
+
+    # Reuse the key's own slot or a free or expired one, otherwise evict the least recently used.
+    def _choose_slot(self, key_hash, now):
+        oldest_slot, oldest_use = None, None
+        for slot in self._probe(key_hash):
+            slot_hash, expires_at, last_used, _ = self._header(slot)
+            if slot_hash == key_hash or slot_hash == 0 or expires_at < now:
+                return slot
+            if oldest_use is None or last_used < oldest_use:
+                oldest_slot, oldest_use = slot, last_used
+        self._count('evictions')
+        return oldest_slot
+
+    def _probe(self, key_hash):
+        start = key_hash % self.slots
+        return [(start + step) % self.slots for step in range(min(self.PROBE_LENGTH, self.slots))]
+
+    def _header(self, slot):
+        return self.HEADER.unpack_from(self._segment.buf, slot * self.slot_size)
+
+    def _locked(self):
+        return self._segment.locked()
+
+
+# A cache kept in a Redis-compatible server, spoken to over RESP with one connection per thread.
+# Evictions happen on the server, so only hits and misses are counted here. While the server
+# cannot be reached, reads miss and writes are dropped, counted as errors, so requests fall
+# through to the database instead of failing.
+class RedisCache(Cache):
+    name = 'redis'
+
+    def __init__(self, url, default_ttl, timeout=None):
+        super().__init__(default_ttl)
+        self.timeout = timeout
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or 'localhost', parsed.port or 6379)
+        self.database = int(parsed.path.lstrip('/') or 0)
+        self._local = threading.local()
+
+    def get(self, key):
+        try:
+            payload = self.command('GET', key)
+        except OSError:
+            self._count('errors')
+            payload = None
+        if payload is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return pickle.loads(payload)
+
+    def set(self, key, value, ttl=None):
+        milliseconds = int((ttl or self.default_ttl) * 1000)
+        try:
+            self.command('SET', key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 'PX', milliseconds)
+        except OSError:
+            self._count('errors')
+
+    def delete(self, key):
+        try:
+            self.command('DEL', key)
+        except OSError:
+            self._count('errors')
+
+    # Send one command and read its reply; a broken connection is dropped and the error raised.
+    def command(self, *args):
+        connection = self._connection()
+        try:
+            connection.sendall(_encode_command(args))
+            return _read_reply(self._local.reader)
+        except OSError:
+            self._local.connection = None
+            raise
+
+    def _connection(self):
+        if getattr(self._local, 'connection', None) is None:
+            connection = socket.create_connection(self.address, self.timeout)
+            self._local.connection = connection
+            self._local.reader = connection.makefile('rb')
+            if self.database:
+                self.command('SELECT', self.database)
+        return self._local.connection
+
+
+class RedisError(Exception):
+    pass
+
+
+# Encode a command as a RESP array of bulk strings.
+def _encode_command(args):
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+# Read one RESP reply.
+def _read_reply(reader):
+    line = reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'+':
+        return rest.decode()
+    if kind == b'-':
+        raise RedisError(rest.decode())
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        length = int(rest)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        return data[:-2]
+    if kind == b'*':
+        count = int(rest)
+        return None if count < 0 else [_read_reply(reader) for _ in range(count)]
+    raise RedisError(f"Unexpected reply {line!r}")
+
+
+# A small in-process server speaking the subset of RESP used by RedisCache
+# (PING, SELECT, GET, SET with EX/PX, DEL, FLUSHDB), for tests and local development.
+class RespServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0)):
+        super().__init__(address, _RespHandler)
+        self.data = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"redis://{host}:{port}/0"
+
+    # Serve from a daemon thread.
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def execute(self, name, args):
+        with self.lock:
+            if name == 'PING':
+                return '+PONG'
+            if name in ('SELECT', 'FLUSHDB'):
+                if name == 'FLUSHDB':
+                    self.data.clear()
+                return '+OK'
+            if name == 'GET':
+                value, expires_at = self.data.get(args[0], (None, None))
+                if expires_at is not None and expires_at < time.monotonic():
+                    del self.data[args[0]]
+                    value = None
+                return value
+            if name == 'SET':
+                expires_at = None
+                options = [arg.decode().upper() for arg in args[2::2]]
+                for option, amount in zip(options, args[3::2]):
+                    scale = 1000 if option == 'EX' else 1
+                    expires_at = time.monotonic() + int(amount) * scale / 1000
+                self.data[args[0]] = (args[1], expires_at)
+                return '+OK'
+            if name == 'DEL':
+                return sum(self.data.pop(key, None) is not None for key in args)
+            return f"-ERR unknown command '{name}'"
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                command = _read_reply(self.rfile)
+            except (ConnectionError, OSError):
+                return
+            reply = self.server.execute(command[0].decode().upper(), command[1:])
+            self.wfile.write(_encode_reply(reply))
+
+
+def _encode_reply(reply):
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, int):
+        return b':%d\r\n' % reply
+    if isinstance(reply, bytes):
+        return b'$%d\r\n%s\r\n' % (len(reply), reply)
+    return reply.encode() + b'\r\n'
@@ -0,0 +1,76 @@
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from flask import g, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from . import db
+from .metrics import metrics
+
+# The running request's [deadline, expired] on the time.monotonic() clock, None without a deadline.
+_deadline = ContextVar('request_deadline', default=None)
+
+
+# Called by SQLite every DEADLINE_CHECK_INSTRUCTIONS virtual machine instructions of a statement.
+# A non-zero return interrupts the statement, which raises OperationalError("interrupted").
+def _check_deadline():
+    deadline = _deadline.get()
+    if deadline is None or time.monotonic() < deadline[0]:
+        return 0
+    deadline[1] = True
+    return 1
+
+
+# Deadlines bound the time a request can spend in SQLite.
+#
+# Every request gets REQUEST_DEADLINE_SECONDS from when it arrives, or its endpoint's entry
+# in ROUTE_DEADLINE_SECONDS (None for no deadline). Each database connection has a progress
+# handler checking the running request's deadline, so a statement still running past it is
+# interrupted mid-scan instead of holding its connection and the write lock. The request
+# then gets a 504, and the cancelled statement is logged, counted in the metrics under
+# deadline.cancelled.<endpoint> and kept among the last CANCELLED_QUERY_LOG_SIZE cancellations.
+class Deadlines:
+    def __init__(self, app):
+        self.app = app
+        self.cancelled = deque(maxlen=app.config['CANCELLED_QUERY_LOG_SIZE'])
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'connect', self._install)
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+        app.register_error_handler(OperationalError, self._handle_interrupted)
+
+    def _install(self, dbapi_connection, connection_record):
+        dbapi_connection.set_progress_handler(_check_deadline, self.app.config['DEADLINE_CHECK_INSTRUCTIONS'])
+
+    def _start(self):
+        config = self.app.config
+        endpoint = (request.endpoint or '').rpartition('.')[2]
+        seconds = config['ROUTE_DEADLINE_SECONDS'].get(endpoint, config['REQUEST_DEADLINE_SECONDS'])
+        if seconds is not None:
+            g.deadline_token = _deadline.set([time.monotonic() + seconds, False])
+            g.deadline_seconds = seconds
+
+    def _finish(self, exception):
+        token = g.pop('deadline_token', None)
+        if token is not None:
+            _deadline.reset(token)
+
+    # Answer a statement interrupted by the deadline with a timeout; any other error goes on as before.
+    def _handle_interrupted(self, error):
+        deadline = _deadline.get()
+        if deadline is None or not deadline[1]:
+            raise error
+        endpoint = (request.endpoint or '').rpartition('.')[2]
+        self.cancelled.append({
+            'at': datetime.utcnow().isoformat(),
+            'endpoint': endpoint,
+            'path': request.full_path.rstrip('?'),
+            'deadline_seconds': g.deadline_seconds,
+            'statement': error.statement,
+        })
+        metrics.increment(f"deadline.cancelled.{endpoint}")
+        self.app.logger.warning("Cancelled a statement of %s past its %ss deadline: %s",
+                                endpoint, g.deadline_seconds, error.statement)
+        return jsonify({'message': 'Request timed out'}), 504
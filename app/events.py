@@ -0,0 +1,59 @@
+import json
+from flask import g
+from sqlalchemy import insert, select
+from . import db
+from .models import Event
+from .sharding import shard_count
+
+# Types of the events written by the managers.
+EVENT_TYPES = ('adventure_rolled', 'threshold_changed', 'lootbox_forged', 'prize_claimed')
+
+
+# Append an event in the current transaction, so it commits together with the change it describes.
+def record_event(event_type, user_id, **data):
+    db.session.execute(insert(Event).values(type=event_type, user_id=user_id, payload=json.dumps(data)))
+
+
+# Unpack a feed cursor: the last sequence number read on each shard, comma separated.
+# With a single shard it is just the sequence number. Raises ValueError for a malformed cursor.
+def parse_cursor(cursor):
+    if not cursor:
+        return [0] * shard_count()
+    positions = [int(part) for part in cursor.split(',')]
+    if len(positions) != shard_count() or min(positions) < 0:
+        raise ValueError("Invalid event cursor")
+    return positions
+
+
+def format_cursor(positions):
+    return ','.join(str(position) for position in positions)
+
+
+# Up to `limit` events after the positions, in sequence order within each shard, with the
+# positions reached. Sequence numbers are handed out in commit order, so a consumer resuming
+# from its last positions never misses an event.
+def events_after(positions, limit):
+    positions = list(positions)
+    events = []
+    for shard in range(shard_count()):
+        if len(events) >= limit:
+            break
+        g.shard = shard
+        rows = db.session.execute(
+            select(Event).where(Event.id > positions[shard]).order_by(Event.id).limit(limit - len(events))
+        ).scalars().all()
+        for event in rows:
+            events.append((shard, event))
+            positions[shard] = event.id
+    return events, positions
+
+
+def event_payload(shard, event):
+    return {
+        'seq': event.id,
+        'shard': shard,
+        'type': event.type,
+        'user_id': event.user_id,
+        'timestamp': event.timestamp.isoformat(),
+        'data': json.loads(event.payload),
+    }
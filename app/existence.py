@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import g
+from sqlalchemy import select
+from . import db
+from .metrics import metrics
+from .models import User
+
+
+# A growable bitmap of non-negative integers, one bit per possible id.
+class IdBitmap:
+    def __init__(self):
+        self.bits = bytearray()
+
+    def add(self, value):
+        index = value >> 3
+        if index >= len(self.bits):
+            # Grow at least geometrically so loading ids in order stays linear.
+            self.bits.extend(bytes(max(index + 1 - len(self.bits), len(self.bits))))
+        self.bits[index] |= 1 << (value & 7)
+
+    def __contains__(self, value):
+        index = value >> 3
+        return value >= 0 and index < len(self.bits) and bool(self.bits[index] & (1 << (value & 7)))
+
+
+# The user ids known to exist on one shard.
+class _ShardUsers:
+    def __init__(self):
+        self.ids = IdBitmap()
+        self.max_id = 0
+        self.refreshed_at = None
+
+
+# The UserExistence answers "could this user id exist?" from memory, so requests for
+# unknown ids can be rejected before touching the database.
+#
+# User ids are dense integers, so each shard keeps a bitmap of its ids, topped up with the
+# ids above the highest one loaded at most every EXISTENCE_REFRESH_SECONDS. The bitmap only
+# ever saves work: an id it does not have (created since the last refresh, or committed out
+# of order below the highest id) is looked up in the database once, and set if found.
+# Ids the database does not have are remembered in a bounded negative cache, so repeats
+# are rejected without a query; that covers both ids the bitmap lacks and false positives
+# (ids it has whose rows were deleted out of band).
+class UserExistence:
+    def __init__(self, app):
+        self.app = app
+        self._shards = {}
+        self._negative = OrderedDict()
+        self._lock = threading.Lock()
+
+    # False when the user id certainly does not exist on the request's shard.
+    def might_exist(self, user_id):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            metrics.increment('existence.rejected')
+            return False
+
+        shard = g.get('shard', 0)
+        users = self._refresh(shard)
+        expires_at = self._negative.get((shard, user_id))
+        if expires_at is not None:
+            if expires_at > time.monotonic():
+                metrics.increment('existence.negative_hits')
+                return False
+            with self._lock:
+                self._negative.pop((shard, user_id), None)
+
+        if user_id not in users.ids:
+            metrics.increment('existence.lookups')
+            if db.session.execute(select(User.id).where(User.id == user_id)).first() is None:
+                metrics.increment('existence.rejected')
+                self._remember_missing(shard, user_id)
+                return False
+            if user_id >= 0:
+                with self._lock:
+                    users.ids.add(user_id)
+
+        metrics.increment('existence.passed')
+        return True
+
+    # Remember that the database had no user for an id the bitmap let through.
+    def record_missing(self, user_id):
+        metrics.increment('existence.false_positives')
+        self._remember_missing(g.get('shard', 0), int(user_id))
+
+    def _remember_missing(self, shard, user_id):
+        with self._lock:
+            key = (shard, user_id)
+            self._negative[key] = time.monotonic() + self.app.config['NEGATIVE_CACHE_TTL']
+            self._negative.move_to_end(key)
+            while len(self._negative) > self.app.config['NEGATIVE_CACHE_SIZE']:
+                self._negative.popitem(last=False)
+
+    # Share of the ids let through by the bitmap that turned out not to exist.
+    def false_positive_rate(self):
+        counters = metrics.snapshot()
+        passed = counters.get('existence.passed', 0)
+        return counters.get('existence.false_positives', 0) / passed if passed else 0.0
+
+    # Load the ids added to the shard since the last refresh, if it is due.
+    def _refresh(self, shard):
+        interval = self.app.config['EXISTENCE_REFRESH_SECONDS']
+        now = time.monotonic()
+        users = self._shards.get(shard)
+        if users is not None and users.refreshed_at is not None and now - users.refreshed_at < interval:
+            return users
+
+        with self._lock:
+            users = self._shards.setdefault(shard, _ShardUsers())
+            if users.refreshed_at is not None and now - users.refreshed_at < interval:
+                return users
+            new_ids = db.session.execute(
+                select(User.id).where(User.id > users.max_id).order_by(User.id).execution_options(yield_per=10000)
+            ).scalars()
+            for user_id in new_ids:
+                users.ids.add(user_id)
+                users.max_id = user_id
+                # An id probed before its user was created is no longer missing.
+                self._negative.pop((shard, user_id), None)
+            users.refreshed_at = now
+        return users
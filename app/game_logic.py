@@ -1,6 +1,16 @@
+import hashlib
+import hmac
 from random import randint
-from .models import User, Adventure, LootBox, PrizeType, Prize
+from flask import current_app, g
+from sqlalchemy import delete, insert, select
+from .models import User, Adventure, LootBox, Prize, PreRolledAdventure
 from . import db
+from .invalidation import bump_user_version, bump_version
+from .leaderboard import LOOTBOX_POINTS, MATERIAL_POINTS, add_points
+from .rollups import record_drop
+from .events import record_event
+from .retry import run_transaction
+from .sharding import shard_count, use_shard
 from datetime import datetime, timedelta
 
 # The AdventureManager manages the logic for user adventures.
@@ -8,24 +18,48 @@ class AdventureManager:
     # The constructor initializes the manager with a user.
     def __init__(self, user):
         self.user = user
+        use_shard(user.id)
 
     # Static method to check if a user is eligible for an adventure.
     @staticmethod
     def is_eligible(user):
+        use_shard(user.id)
         # Fetch the last adventure of the user.
-        last_adventure = Adventure.query.filter_by(user_id=user.id).order_by(Adventure.timestamp.desc()).first()
+        last_adventure = AdventureManager.last_adventure(user)
+        next_eligible_time = AdventureManager.next_eligible_time(last_adventure)
         # If there's a last adventure, check if it's been more than a day since the last adventure.
-        if last_adventure:
-            now = datetime.utcnow()
-            time_since_last_adventure = now - last_adventure.timestamp
-            return time_since_last_adventure > timedelta(days=1)
+        if next_eligible_time:
+            return datetime.utcnow() > next_eligible_time
         # If no previous adventure, the user is eligible.
         return True
 
-    # Create a new adventure for the user.
-    def create(self):
-        rng_score = self._generate_random_number()
+    # Static method fetching the user's most recent adventure, or None if they have never been on one.
+    @staticmethod
+    def last_adventure(user):
+        use_shard(user.id)
+        return Adventure.query.filter_by(user_id=user.id).order_by(Adventure.timestamp.desc()).first()
+
+    # Static method returning when a user can go on their next adventure, given their last one.
+    # None means they have never been on one and are eligible.
+    @staticmethod
+    def next_eligible_time(last_adventure):
+        if last_adventure:
+            return last_adventure.timestamp + timedelta(days=1)
+        return None
+
+    # Create a new adventure for the user. before_commit, if given, is called with the new
+    # adventure just before committing, to write more in the same transaction.
+    # The whole transaction is re-run if it hits a lock conflict.
+    def create(self, before_commit=None):
+        return run_transaction('adventure', self._create, before_commit)
+
+    def _create(self, before_commit):
+        # Use the user's pre-rolled outcome if one is waiting, otherwise roll now.
+        rng_score = self._claim_pre_roll()
+        if rng_score is None:
+            rng_score = self._generate_random_number()
         material = self._determine_material(rng_score)
+        old_threshold = self.user.current_threshold
         self._update_user_threshold(material)
         
         # Create a new adventure record and add it to the session.
@@ -38,10 +72,49 @@ class AdventureManager:
         else:
             new_adventure.status = "Unused Material"
 
+        # Let caches in every worker know the user's data changed,
+        # and stamp the adventure with its change sequence for delta sync.
+        bump_user_version(self.user.id)
+        new_adventure.change_seq = bump_version('adventure')
+
+        # Legendary and Elite finds count towards the leaderboard.
+        add_points(self.user.id, MATERIAL_POINTS.get(material, 0))
+
+        # Count the drop for the drop-rate analytics, in the bucket of the adventure's timestamp.
+        record_drop('material', material, new_adventure.timestamp)
+
+        # Append the roll, and the threshold change it caused, to the event log.
+        record_event('adventure_rolled', self.user.id, adventure_id=new_adventure.id, material=material, rng_score=rng_score)
+        if self.user.current_threshold != old_threshold:
+            record_event('threshold_changed', self.user.id, old_threshold=old_threshold,
+                         current_threshold=self.user.current_threshold, reset_threshold=self.user.reset_threshold)
+
+        if before_commit:
+            before_commit(new_adventure)
+
         # Commit the changes to the database.
         db.session.commit()
         return new_adventure
 
+    # Claim the user's pre-rolled score, or return None if there is no usable one.
+    def _claim_pre_roll(self):
+        pre_roll = PreRolledAdventure.query.filter_by(user_id=self.user.id).first()
+        if not pre_roll:
+            return None
+
+        # Deleting the row is the claim, so two racing requests cannot both use it.
+        result = db.session.execute(delete(PreRolledAdventure).where(PreRolledAdventure.id == pre_roll.id))
+        if result.rowcount != 1:
+            return None
+
+        # A pre-roll drawn against an old threshold or with a broken seal is discarded.
+        if pre_roll.threshold != self.user.current_threshold:
+            return None
+        expected_seal = PreRollManager.seal(pre_roll.user_id, pre_roll.threshold, pre_roll.rng_score)
+        if not hmac.compare_digest(pre_roll.seal, expected_seal):
+            return None
+        return pre_roll.rng_score
+
     # Generate a random number between 1 and the user's current threshold.
     def _generate_random_number(self):
         return randint(1, self.user.current_threshold)
@@ -77,9 +150,15 @@ class LootBoxManager:
     def __init__(self, user, material_ids):
         self.user = user
         self.material_ids = material_ids
+        use_shard(user.id)
 
-    # Create a lootbox.
-    def create(self):
+    # Create a lootbox and its prize. before_commit, if given, is called with both just
+    # before committing, to write more in the same transaction.
+    # The whole transaction is re-run if it hits a lock conflict.
+    def create(self, before_commit=None):
+        return run_transaction('lootbox', self._create, before_commit)
+
+    def _create(self, before_commit):
         # Fetch the adventures corresponding to the material IDs.
         adventures = Adventure.query.filter(Adventure.id.in_(self.material_ids)).all()
         sum_rng_scores = 0
@@ -101,9 +180,32 @@ class LootBoxManager:
         db.session.add(new_lootbox)
 
         # Create a new prize for the user based on the lootbox's rarity.
+        # Prize stock is leased on a separate connection, so this must run before the
+        # session writes anything and takes the database's write lock.
         prize_manager = PrizeManager(self.user, new_lootbox)
         new_prize = prize_manager.create()
 
+        # Let caches in every worker know the user's data changed,
+        # and stamp the changed rows with their change sequence for delta sync.
+        bump_user_version(self.user.id)
+        adventure_seq = bump_version('adventure')
+        for adventure in adventures:
+            adventure.change_seq = adventure_seq
+        new_lootbox.change_seq = bump_version('loot_box')
+
+        # Every lootbox counts towards the leaderboard, more the rarer it is.
+        add_points(self.user.id, LOOTBOX_POINTS[rarity])
+
+        # Count the drop for the drop-rate analytics, in the bucket of the lootbox's timestamp.
+        record_drop('lootbox', rarity, new_lootbox.timestamp)
+
+        # Append the forge to the event log.
+        record_event('lootbox_forged', self.user.id, lootbox_id=new_lootbox.id, rarity=rarity,
+                     material_ids=[adventure.id for adventure in adventures])
+
+        if before_commit:
+            before_commit(new_lootbox, new_prize)
+
         # Commit the changes to the database.
         db.session.commit()
 
@@ -129,20 +231,83 @@ class PrizeManager:
     def __init__(self, user, lootbox):
         self.user = user
         self.lootbox = lootbox
+        use_shard(user.id)
 
     # Create a prize for the user.
     def create(self):
-        # Fetch a prize type based on the lootbox's rarity that hasn't been fully claimed yet.
-        prize_type = PrizeType.query.filter_by(rarity=self.lootbox.rarity).filter(PrizeType.number_claimed < PrizeType.quanity).first()
+        # Take a unit of a prize type of the lootbox's rarity from this worker's leased stock.
+        lease = current_app.extensions['prize_leases'].take(self.lootbox.rarity)
 
-        if not prize_type:
+        if not lease:
             return "Error: No available prize for this rarity"
 
         # Create a new prize record for the user and add it to the session.
-        new_prize = Prize(user_id=self.user.id, prize_type_id=prize_type.id)
+        # The prize type's number_claimed was already counted when the lease was reserved.
+        new_prize = Prize(user_id=self.user.id, prize_type_id=lease.prize_type_id, lease_id=lease.id)
         db.session.add(new_prize)
+        new_prize.change_seq = bump_version('prize')
 
-        # Increment the number_claimed counter for the prize type.
-        prize_type.number_claimed += 1
+        # Append the claim to the event log.
+        record_event('prize_claimed', self.user.id, prize_id=new_prize.id, prize_type_id=lease.prize_type_id,
+                     lootbox_id=self.lootbox.id)
 
         return new_prize
+
+
+# The PreRollManager rolls the next adventure of every user ahead of time, off the request path.
+class PreRollManager:
+    # Sign a pre-rolled outcome so rows edited in the database are not honoured.
+    @staticmethod
+    def seal(user_id, threshold, rng_score):
+        message = f"{user_id}:{threshold}:{rng_score}".encode()
+        return hmac.new(current_app.config['SECRET_KEY'].encode(), message, hashlib.sha256).hexdigest()
+
+    # Pre-roll for every user without a usable pre-roll, one shard at a time.
+    @staticmethod
+    def generate(chunk_size=None):
+        chunk_size = chunk_size or current_app.config['PREROLL_CHUNK_SIZE']
+        created = 0
+        for shard in range(shard_count()):
+            g.shard = shard
+            created += PreRollManager._generate_shard(chunk_size)
+        return created
+
+    # Pre-roll the users of the selected shard, one chunk of users at a time.
+    @staticmethod
+    def _generate_shard(chunk_size):
+        # Drop pre-rolls drawn against a threshold that has since changed.
+        stale_ids = select(PreRolledAdventure.id).join(User, User.id == PreRolledAdventure.user_id).where(
+            PreRolledAdventure.threshold != User.current_threshold)
+        db.session.execute(delete(PreRolledAdventure).where(PreRolledAdventure.id.in_(stale_ids)))
+        db.session.commit()
+
+        created = 0
+        last_id = 0
+        while True:
+            # Walk users by id so each chunk is a cheap index range scan.
+            users = db.session.execute(
+                select(User.id, User.current_threshold)
+                .outerjoin(PreRolledAdventure, PreRolledAdventure.user_id == User.id)
+                .where(User.id > last_id, PreRolledAdventure.id.is_(None))
+                .order_by(User.id)
+                .limit(chunk_size)
+            ).all()
+            if not users:
+                break
+
+            # Roll the whole chunk at once and insert it with a single executemany.
+            rows = []
+            for user_id, threshold in users:
+                rng_score = randint(1, threshold)
+                rows.append({
+                    'user_id': user_id,
+                    'threshold': threshold,
+                    'rng_score': rng_score,
+                    'seal': PreRollManager.seal(user_id, threshold, rng_score),
+                })
+            db.session.execute(insert(PreRolledAdventure), rows)
+            db.session.commit()
+
+            created += len(rows)
+            last_id = users[-1].id
+        return created
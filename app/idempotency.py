@@ -0,0 +1,56 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+from flask import current_app, g
+from sqlalchemy import delete, insert, select
+from . import db
+from .models import IdempotencyKey
+from .sharding import shard_count
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def valid_key(key):
+    return 0 < len(key) <= MAX_KEY_LENGTH
+
+
+# Fingerprint of a request, so a key reused for a different request is caught.
+def request_hash(endpoint, data):
+    return hashlib.sha256(f"{endpoint}:{json.dumps(data, sort_keys=True)}".encode()).hexdigest()
+
+
+# The (request_hash, status, body) stored for a user's key, or None. Stored responses never
+# change, so they are cached once read and a burst of retries costs one primary key lookup.
+def stored_response(user_id, key):
+    cache = current_app.extensions['cache']
+    cache_key = f"idempotency:{g.shard}:{user_id}:{key}"
+    stored = cache.get(cache_key)
+    if stored is None:
+        row = db.session.execute(
+            select(IdempotencyKey.request_hash, IdempotencyKey.status, IdempotencyKey.body)
+            .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+        ).first()
+        if row is None:
+            return None
+        stored = tuple(row)
+        cache.set(cache_key, stored)
+    return stored
+
+
+# Store a write's response in the current transaction. If a concurrent retry stored one
+# for the key first, this raises IntegrityError and the write must be rolled back.
+def remember_response(user_id, key, request_hash, status, body):
+    db.session.execute(insert(IdempotencyKey).values(
+        user_id=user_id, key=key, request_hash=request_hash, status=status, body=body))
+
+
+# Delete stored responses older than IDEMPOTENCY_KEY_TTL_HOURS, shard by shard.
+def prune_idempotency_keys():
+    cutoff = datetime.utcnow() - timedelta(hours=current_app.config['IDEMPOTENCY_KEY_TTL_HOURS'])
+    pruned = 0
+    for shard in range(shard_count()):
+        g.shard = shard
+        pruned += db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff)).rowcount
+        db.session.commit()
+    return pruned
@@ -0,0 +1,145 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import g, has_request_context
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from . import db
+from .models import ChangeCounter, UserVersion
+from .sharding import shard_engine
+
+
+# Bump the change counter of a table in the current transaction and return its new version.
+# Runs on the session unless a connection is given.
+def bump_version(table_name, connection=None):
+    upsert = sqlite_insert(ChangeCounter).values(table_name=table_name, version=1)
+    upsert = upsert.on_conflict_do_update(index_elements=['table_name'], set_={'version': ChangeCounter.version + 1})
+    return (connection or db.session).execute(upsert.returning(ChangeCounter.version)).scalar()
+
+
+# Mark a user's data as changed in the current transaction: bump the shard's 'user' counter
+# and record the new version as the user's own.
+def bump_user_version(user_id, connection=None):
+    version = bump_version('user', connection)
+    upsert = sqlite_insert(UserVersion).values(user_id=user_id, version=version)
+    upsert = upsert.on_conflict_do_update(index_elements=['user_id'], set_={'version': upsert.excluded.version})
+    (connection or db.session).execute(upsert)
+    return version
+
+
+# Watches one database file for commits made by any connection, in this process or another.
+#
+# PRAGMA data_version on a connection that never writes changes whenever anyone else
+# commits, so the change counters only need re-reading after it moves. The versions of the
+# users changed since the last read come with them, read along the user_version index.
+# Up to max_users of them are kept; users not kept all share users_floor, a version at or
+# after their latest change.
+class DatabaseWatcher:
+    def __init__(self, engine, max_users):
+        self.engine = engine
+        self.max_users = max_users
+        self.data_version = None
+        self.versions = {}
+        self.user_versions = OrderedDict()
+        self.users_floor = None
+        self.users_seen = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+        database = engine.url.database
+        # An in-memory database is private to one connection, so there is nothing to watch.
+        if database and database != ':memory:':
+            self._connection = sqlite3.connect(database, check_same_thread=False)
+        else:
+            self._connection = None
+
+    # Refresh the change counters if the database changed since the last check.
+    def check(self):
+        with self._lock:
+            if self._connection is None:
+                with self.engine.connect() as conn:
+                    self._load(lambda sql, *params: conn.exec_driver_sql(sql, params).all())
+                return self.versions
+
+            data_version = self._connection.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self.data_version:
+                try:
+                    self._load(lambda sql, *params: self._connection.execute(sql, params).fetchall())
+                except sqlite3.OperationalError:
+                    # The tables do not exist until create_all.
+                    self.versions = {}
+                self.data_version = data_version
+            self.checked_at = time.monotonic()
+            return self.versions
+
+    # The version of a user's data: the 'user' counter at their latest write, or users_floor.
+    def user_version(self, user_id):
+        return self.user_versions.get(user_id, self.users_floor)
+
+    def _load(self, query):
+        self.versions = dict(query("SELECT table_name, version FROM change_counter"))
+        version = self.versions.get('user', 0)
+        if self.users_seen is None:
+            # Writes from before the first look need not be told apart: nothing was cached
+            # here before them, and a shared cache's older keys carry versions at or below this.
+            self.users_floor = self.users_seen = version
+            return
+        if version <= self.users_seen:
+            return
+        changed = query("SELECT user_id, version FROM user_version WHERE version > ? ORDER BY version", self.users_seen)
+        for user_id, user_version in changed:
+            self.user_versions.pop(user_id, None)
+            self.user_versions[user_id] = user_version
+        self.users_seen = version
+        # Forget the users changed longest ago, raising the floor they fall back to.
+        while len(self.user_versions) > self.max_users:
+            _, forgotten = self.user_versions.popitem(last=False)
+            self.users_floor = max(self.users_floor, forgotten)
+
+
+# The ChangeTracker tells in-process caches whether the tables they were filled from changed,
+# including writes made by other worker processes.
+#
+# Each shard is checked at most once per request and at most once every
+# INVALIDATION_POLL_SECONDS, so a cache hit costs at most one PRAGMA.
+class ChangeTracker:
+    def __init__(self, app):
+        self.app = app
+        self._watchers = {}
+        self._lock = threading.Lock()
+
+    # Current versions of the given tables on a shard (the request's shard by default).
+    def version(self, *table_names, shard=None):
+        versions = self.versions(shard)
+        return tuple(versions.get(table_name, 0) for table_name in table_names)
+
+    # Current version of one user's data on a shard (the request's shard by default). It changes
+    # with every write to the user and with no write to anyone else.
+    def user_version(self, user_id, shard=None):
+        shard = g.get('shard', 0) if shard is None else shard
+        self.versions(shard)
+        return self._watcher(shard).user_version(int(user_id))
+
+    # Current versions of every counted table on a shard.
+    def versions(self, shard=None):
+        shard = g.get('shard', 0) if shard is None else shard
+
+        # Versions seen earlier in the same request are reused as-is.
+        seen = g.setdefault('change_versions', {}) if has_request_context() else {}
+        if shard in seen:
+            return seen[shard]
+
+        watcher = self._watcher(shard)
+        if time.monotonic() - watcher.checked_at < self.app.config['INVALIDATION_POLL_SECONDS']:
+            versions = watcher.versions
+        else:
+            versions = watcher.check()
+        seen[shard] = versions
+        return versions
+
+    # The watcher of a shard's database, created on first use.
+    def _watcher(self, shard):
+        with self._lock:
+            if shard not in self._watchers:
+                self._watchers[shard] = DatabaseWatcher(shard_engine(shard), self.app.config['INVALIDATION_MAX_USERS'])
+            return self._watchers[shard]
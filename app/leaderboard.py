@@ -0,0 +1,295 @@
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import defaultdict
+from flask import current_app, g
+from sqlalchemy import case, delete, func, insert, literal, select, union_all
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from . import db
+from .invalidation import bump_version
+from .models import Adventure, ArchivedMaterialCount, LeaderboardScore, LootBox
+from .sharding import shard_count, shard_engine
+
+# Leaderboard points for each Legendary/Elite material found and each lootbox forged.
+MATERIAL_POINTS = {'Legendary': 10, 'Elite': 3}
+LOOTBOX_POINTS = {'Legendary': 50, 'Elite': 20, 'Rare': 5, 'Uncommon': 2, 'Common': 1}
+
+# Version of the snapshot file layout; snapshots of any other version are ignored.
+SNAPSHOT_FORMAT = 1
+
+
+# Add points to a user's score in the current transaction, so the score commits with the
+# adventure or lootbox that earned it.
+def add_points(user_id, points):
+    if not points:
+        return
+    upsert = sqlite_insert(LeaderboardScore).values(user_id=user_id, score=points, change_seq=bump_version('leaderboard_score'))
+    db.session.execute(upsert.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={'score': LeaderboardScore.score + upsert.excluded.score, 'change_seq': upsert.excluded.change_seq},
+    ))
+
+
+# Recount every user's score from their adventures, archived material counts and lootboxes,
+# one shard at a time. Used to backfill scores earned before the leaderboard existed.
+def recompute_scores():
+    recomputed = 0
+    for shard in range(shard_count()):
+        g.shard = shard
+        # Bumping the counter first takes the write lock, so nothing is earned while the shard is recounted.
+        change_seq = bump_version('leaderboard_score')
+        points = union_all(
+            select(Adventure.user_id, case(MATERIAL_POINTS, value=Adventure.material, else_=0).label('points'))
+            .where(Adventure.material.in_(MATERIAL_POINTS)),
+            select(ArchivedMaterialCount.user_id,
+                   (ArchivedMaterialCount.count * case(MATERIAL_POINTS, value=ArchivedMaterialCount.material, else_=0)).label('points'))
+            .where(ArchivedMaterialCount.material.in_(MATERIAL_POINTS)),
+            select(LootBox.user_id, case(LOOTBOX_POINTS, value=LootBox.rarity, else_=0).label('points')),
+        ).subquery()
+        db.session.execute(delete(LeaderboardScore))
+        result = db.session.execute(insert(LeaderboardScore).from_select(
+            ['user_id', 'score', 'change_seq'],
+            select(points.c.user_id, func.sum(points.c.points), literal(change_seq)).group_by(points.c.user_id),
+        ))
+        db.session.commit()
+        recomputed += result.rowcount
+    return recomputed
+
+
+# Users ordered by score, with O(log n) rank lookups and O(log n) per distinct score in a top-N.
+#
+# A Fenwick tree indexed by score counts the users at or below each score. Scores grow by at
+# most a few dozen points a day, so the tree stays small however many users there are.
+class ScoreIndex:
+    def __init__(self):
+        self.scores = {}
+        self.users_by_score = defaultdict(set)
+        self.tree = array('q', [0, 0])
+        self.count = 0
+
+    # Set a user's score.
+    def set(self, user_id, score):
+        old_score = self.scores.get(user_id)
+        if old_score == score:
+            return
+        if old_score is not None:
+            self._remove(user_id, old_score)
+        self._grow(score)
+        self.scores[user_id] = score
+        self.users_by_score[score].add(user_id)
+        self._add(score, 1)
+        self.count += 1
+
+    # A user's 1-based rank, shared with everyone on the same score, or None if unranked.
+    def rank(self, user_id):
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return 1 + self.count - self._prefix(score)
+
+    # The n best (rank, user_id, score), ties ordered by user id.
+    def top(self, n):
+        result = []
+        seen = 0
+        while len(result) < n and seen < self.count:
+            score = self._kth(self.count - seen)
+            users = sorted(self.users_by_score[score])
+            result.extend((seen + 1, user_id, score) for user_id in users)
+            seen += len(users)
+        return result[:n]
+
+    def _remove(self, user_id, score):
+        users = self.users_by_score[score]
+        users.discard(user_id)
+        if not users:
+            del self.users_by_score[score]
+        self._add(score, -1)
+        self.count -= 1
+
+    # Tree index i counts score i - 1.
+    def _add(self, score, delta):
+        index = score + 1
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    # Number of users with at most the given score.
+    def _prefix(self, score):
+        index = min(score + 1, len(self.tree) - 1)
+        total = 0
+        while index:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    # The k-th lowest score (1-based).
+    def _kth(self, k):
+        position = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            if position + step < len(self.tree) and self.tree[position + step] < k:
+                position += step
+                k -= self.tree[position]
+            step >>= 1
+        return position
+
+    # The index as three arrays of 64-bit ints: user ids, their scores and the Fenwick tree.
+    def to_arrays(self):
+        return array('q', self.scores.keys()), array('q', self.scores.values()), self.tree
+
+    # Rebuild an index from the arrays of to_arrays. Raises ValueError if they do not fit together.
+    @classmethod
+    def from_arrays(cls, user_ids, scores, tree):
+        if len(user_ids) != len(scores) or len(tree) < 2 or (scores and not 0 <= min(scores) <= max(scores) < len(tree) - 1):
+            raise ValueError("Inconsistent score index")
+        index = cls()
+        index.scores = dict(zip(user_ids, scores))
+        for user_id, score in index.scores.items():
+            index.users_by_score[score].add(user_id)
+        index.count = len(index.scores)
+        index.tree = tree
+        if index.count != len(user_ids) or index._prefix(len(tree) - 2) != index.count:
+            raise ValueError("Inconsistent score index")
+        return index
+
+    # Make room for a score, at least doubling so growth stays linear overall.
+    def _grow(self, score):
+        size = len(self.tree) - 1
+        if score < size:
+            return
+        self.tree = array('q', bytes(8 * (max(size * 2, score + 1) + 1)))
+        for existing_score, users in self.users_by_score.items():
+            self._add(existing_score, len(users))
+
+
+# The Leaderboard ranks every user across all shards from memory.
+#
+# Scores are kept in the leaderboard_score table by the managers (see add_points). Each worker
+# mirrors them in a ScoreIndex, reading only rows whose change_seq is newer than the last one
+# it applied once the shard's change counter moves. The index and its change_seq high-water
+# marks are saved to LEADERBOARD_SNAPSHOT_PATH every LEADERBOARD_SNAPSHOT_SECONDS, so a
+# starting worker loads the snapshot when it is created and its first read streams only what
+# changed since, or the whole table when there is no usable snapshot.
+#
+# A snapshot is a JSON header line (format version, shard count, watermarks and array lengths)
+# followed by the raw user id, score and Fenwick tree arrays of ScoreIndex.to_arrays, so
+# loading one never runs code from the file.
+class Leaderboard:
+    def __init__(self, app):
+        self.app = app
+        self.index = ScoreIndex()
+        self.watermarks = {}
+        self.saved_at = time.monotonic()
+        self._lock = threading.Lock()
+        with app.app_context():
+            self._load_snapshot()
+
+    # The n best (rank, user_id, score).
+    def top(self, n):
+        with self._lock:
+            self._refresh()
+            return self.index.top(n)
+
+    # A user's (rank, score); (None, 0) if they have no points yet.
+    def rank(self, user_id):
+        with self._lock:
+            self._refresh()
+            return self.index.rank(user_id), self.index.scores.get(user_id, 0)
+
+    # Number of users with a score.
+    def size(self):
+        with self._lock:
+            self._refresh()
+            return self.index.count
+
+    # Write the index to the snapshot file, replacing the previous one atomically.
+    def save_snapshot(self):
+        path = self.app.config['LEADERBOARD_SNAPSHOT_PATH']
+        arrays = self.index.to_arrays()
+        header = {
+            'format': SNAPSHOT_FORMAT,
+            'shard_count': shard_count(),
+            'watermarks': {str(shard): watermark for shard, watermark in self.watermarks.items()},
+            'lengths': [len(values) for values in arrays],
+        }
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as snapshot_file:
+            snapshot_file.write(json.dumps(header).encode() + b'\n')
+            for values in arrays:
+                snapshot_file.write(_little_endian(values).tobytes())
+        os.replace(temporary_path, path)
+        self.saved_at = time.monotonic()
+
+    # Apply the score changes of every shard whose change counter moved.
+    def _refresh(self):
+        tracker = current_app.extensions['change_tracker']
+        for shard in range(shard_count()):
+            version, = tracker.version('leaderboard_score', shard=shard)
+            watermark = self.watermarks.get(shard, 0)
+            if version < watermark:
+                # The counter went backwards, so the snapshot came from another database. Start over.
+                self.index = ScoreIndex()
+                self.watermarks = {}
+                return self._refresh()
+            if version > watermark:
+                self._apply_changes(shard, watermark, version)
+
+        if time.monotonic() - self.saved_at >= self.app.config['LEADERBOARD_SNAPSHOT_SECONDS']:
+            self.save_snapshot()
+
+    # Stream the shard's scores changed after the watermark into the index.
+    # Every score stamped up to the counter's version has committed by the time it is read.
+    def _apply_changes(self, shard, watermark, version):
+        statement = (
+            select(LeaderboardScore.user_id, LeaderboardScore.score, LeaderboardScore.change_seq)
+            .where(LeaderboardScore.change_seq > watermark)
+            .order_by(LeaderboardScore.change_seq)
+        )
+        with shard_engine(shard).connect() as conn:
+            rows = conn.execution_options(yield_per=self.app.config['LEADERBOARD_STREAM_CHUNK_SIZE']).execute(statement)
+            for user_id, score, change_seq in rows:
+                self.index.set(user_id, score)
+                version = max(version, change_seq)
+        self.watermarks[shard] = version
+
+    # Load the snapshot if there is a usable one. A snapshot that does not parse is logged and ignored.
+    def _load_snapshot(self):
+        path = self.app.config['LEADERBOARD_SNAPSHOT_PATH']
+        try:
+            with open(path, 'rb') as snapshot_file:
+                header = json.loads(snapshot_file.readline())
+                if header['format'] != SNAPSHOT_FORMAT:
+                    raise ValueError(f"Unknown snapshot format {header['format']!r}")
+                arrays = []
+                for length in header['lengths']:
+                    values = array('q')
+                    values.frombytes(snapshot_file.read(8 * length))
+                    if len(values) != length:
+                        raise ValueError("Truncated snapshot")
+                    arrays.append(_little_endian(values))
+                if snapshot_file.read(1):
+                    raise ValueError("Trailing data in snapshot")
+            index = ScoreIndex.from_arrays(*arrays)
+            watermarks = {int(shard): int(watermark) for shard, watermark in header['watermarks'].items()}
+            snapshot_shard_count = header['shard_count']
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            self.app.logger.warning("Ignoring the leaderboard snapshot %s: %s", path, error)
+            return
+        # Watermarks only mean something for the same shard layout.
+        if snapshot_shard_count != shard_count():
+            return
+        self.index = index
+        self.watermarks = watermarks
+
+
+# Snapshots store their arrays little-endian whatever the host; swapping is its own inverse.
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array('q', values)
+        values.byteswap()
+    return values
@@ -0,0 +1,264 @@
+import atexit
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, event, func, insert, select, update
+from . import db
+from .models import Prize, PrizeLease, PrizeType
+from .sampling import AliasTable
+from .sharding import ShardedSession, shard_engines
+
+
+# A block of units of one prize type reserved by this worker.
+class Lease:
+    def __init__(self, id, prize_type_id, units, expires_at):
+        self.id = id
+        self.prize_type_id = prize_type_id
+        self.remaining = units
+        self.expires_at = expires_at
+        # Units handed out whose transactions have not ended yet.
+        self.in_flight = 0
+
+    # A lease is only handed out from until it expires.
+    def is_live(self):
+        return self.remaining > 0 and datetime.utcnow() < self.expires_at
+
+
+# Once the transaction a unit was taken in has ended, committed or not, the unit is either
+# a Prize row or lost, so a spent or expired lease can be returned without waiting.
+@event.listens_for(ShardedSession, 'after_transaction_end')
+def _settle_leases(session, transaction):
+    if transaction.parent is None:
+        for pool, lease in session.info.pop('prize_leases', ()):
+            pool.settle(lease)
+
+
+# The PrizeLeasePool hands out prize units from blocks reserved in memory, so a
+# PrizeType row is written once per block instead of once per prize.
+#
+# Stock is moved into a lease by bumping number_claimed by the whole block. When a
+# lease is released its unused units are returned, counting the Prize rows that
+# reference it, so number_claimed never exceeds quanity even if a worker dies.
+# A background thread releases this worker's leases as soon as they are spent or
+# expired and their last transaction has ended, and every PRIZE_LEASE_RECLAIM_SECONDS
+# reclaims the expired leases of any worker, dead ones included.
+class PrizeLeasePool:
+    def __init__(self, app):
+        self.app = app
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        # The lease handed out from per prize type, and every lease this worker holds by id.
+        self._leases = {}
+        self._held = {}
+        self._tables = {}
+        self._acquiring = {}
+        self._lock = threading.Lock()
+        self._release_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        atexit.register(self.release_all)
+
+    # Take one unit of a randomly chosen prize of the given rarity, reserving a new block if needed.
+    # The unit is charged to the current session's transaction.
+    def take(self, rarity):
+        self._start()
+        while True:
+            table = self._table(rarity)
+            if table is None:
+                return None
+            prize_type_id = table.sample()
+            lease = self._lease(prize_type_id)
+            if lease is not None:
+                db.session.info.setdefault('prize_leases', []).append((self, lease))
+                return lease
+            # The chosen prize type ran out; forget it and draw again.
+            with self._lock:
+                table.weights.pop(prize_type_id, None)
+                self._tables[rarity] = self._build_table(table.weights)
+
+    # Hand out a unit of the prize type from this worker's lease, reserving a new block if needed.
+    # Only one thread reserves a given prize type at a time; the others wait for its block
+    # instead of reserving one each. Database work happens outside self._lock.
+    def _lease(self, prize_type_id):
+        with self._lock:
+            lease = self._hand_out(prize_type_id)
+            if lease is not None:
+                return lease
+            acquiring = self._acquiring.setdefault(prize_type_id, threading.Lock())
+        with acquiring:
+            with self._lock:
+                lease = self._hand_out(prize_type_id)
+                if lease is not None:
+                    return lease
+            lease = self._acquire(prize_type_id)
+            if lease is None:
+                return None
+            with self._lock:
+                self._leases[prize_type_id] = lease
+                self._held[lease.id] = lease
+                return self._hand_out(prize_type_id)
+
+    # Take a unit from the prize type's live lease, if there is one. Must hold self._lock.
+    def _hand_out(self, prize_type_id):
+        lease = self._live_lease(prize_type_id)
+        if lease is not None:
+            lease.remaining -= 1
+            lease.in_flight += 1
+        return lease
+
+    # Find a lease held by this worker that can still hand out a unit of the prize type.
+    def _live_lease(self, prize_type_id):
+        lease = self._leases.get(prize_type_id)
+        if lease is not None and not lease.is_live():
+            del self._leases[prize_type_id]
+            self._wake.set()
+            return None
+        return lease
+
+    # Called when a transaction that took a unit from the lease has ended.
+    def settle(self, lease):
+        with self._lock:
+            lease.in_flight -= 1
+            if not lease.in_flight and not lease.is_live():
+                self._wake.set()
+
+    # The cached selection table of the rarity. Prize types that run out are dropped from it
+    # in memory, and it is re-read from the database once it is PRIZE_WEIGHTS_SECONDS old.
+    def _table(self, rarity, reclaim=True):
+        table = self._tables.get(rarity)
+        if table is not None and datetime.utcnow() < table.expires_at:
+            return table
+
+        # Prize types are weighted by their configured odds, or by their remaining stock.
+        # Units this worker still holds in leases count as remaining.
+        with db.engine.connect() as conn:
+            rows = conn.execute(select(PrizeType.id, PrizeType.quanity - PrizeType.number_claimed, PrizeType.weight)
+                                .where(PrizeType.rarity == rarity)).all()
+        weights = {}
+        with self._lock:
+            for prize_type_id, available, weight in rows:
+                lease = self._live_lease(prize_type_id)
+                if lease is not None:
+                    available += lease.remaining
+                if available > 0:
+                    weights[prize_type_id] = available if weight is None else weight
+            table = self._build_table(weights)
+            if table is not None:
+                self._tables[rarity] = table
+        if table is not None:
+            return table
+
+        # Out of stock: units may be stuck in spent or abandoned leases, so return them and look once more.
+        if reclaim and self.release_settled() + self.reclaim_expired():
+            return self._table(rarity, reclaim=False)
+        with self._lock:
+            self._tables.pop(rarity, None)
+        return None
+
+    # Build an alias table over the prize types with a positive weight, remembering the
+    # weights and expiry alongside it.
+    def _build_table(self, weights):
+        weights = {prize_type_id: weight for prize_type_id, weight in weights.items() if weight > 0}
+        if not weights:
+            return None
+        table = AliasTable(list(weights), list(weights.values()))
+        table.weights = weights
+        table.expires_at = datetime.utcnow() + timedelta(seconds=self.app.config['PRIZE_WEIGHTS_SECONDS'])
+        return table
+
+    # Reserve a block of the prize type.
+    # This runs on its own connection so the reservation commits independently of the request.
+    def _acquire(self, prize_type_id):
+        config = self.app.config
+        with db.engine.begin() as conn:
+            available = conn.execute(select(PrizeType.quanity - PrizeType.number_claimed)
+                                     .where(PrizeType.id == prize_type_id)).scalar()
+            units = min(config['PRIZE_LEASE_SIZE'], available or 0)
+            if units <= 0:
+                return None
+            # The guard on quanity makes the reservation safe against other workers.
+            reserved = conn.execute(
+                update(PrizeType)
+                .where(PrizeType.id == prize_type_id, PrizeType.number_claimed + units <= PrizeType.quanity)
+                .values(number_claimed=PrizeType.number_claimed + units)
+            ).rowcount
+            if not reserved:
+                return None
+            expires_at = datetime.utcnow() + timedelta(seconds=config['PRIZE_LEASE_SECONDS'])
+            lease_id = conn.execute(insert(PrizeLease).values(
+                prize_type_id=prize_type_id, units=units, owner=self.owner, expires_at=expires_at)).inserted_primary_key[0]
+
+        return Lease(lease_id, prize_type_id, units, expires_at)
+
+    # Return the unused units of every lease past its expiry and grace period, whoever owns it.
+    # This worker's own leases are left to release_settled, which knows when they are done with.
+    def reclaim_expired(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config['PRIZE_LEASE_GRACE_SECONDS'])
+        with db.engine.connect() as conn:
+            expired = conn.execute(select(PrizeLease.id).where(PrizeLease.expires_at < cutoff)).scalars().all()
+        return sum(self._release(lease_id) for lease_id in expired if lease_id not in self._held)
+
+    # Return the unused units of this worker's spent and expired leases whose transactions have all ended.
+    def release_settled(self):
+        # Callers wait for a release already under way, so everything settled is back in stock on return.
+        with self._release_lock:
+            with self._lock:
+                settled = [lease for lease in self._held.values() if not lease.in_flight and not lease.is_live()]
+                for lease in settled:
+                    del self._held[lease.id]
+                    if self._leases.get(lease.prize_type_id) is lease:
+                        del self._leases[lease.prize_type_id]
+            return sum(self._release(lease.id) for lease in settled)
+
+    # Return the unused units of this worker's leases, e.g. on shutdown.
+    def release_all(self):
+        with self._release_lock, self.app.app_context():
+            with self._lock:
+                held = list(self._held.values())
+                self._held.clear()
+                self._leases.clear()
+                self._tables.clear()
+            for lease in held:
+                self._release(lease.id)
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='prize-leases', daemon=True)
+                    self._thread.start()
+
+    # Release leases when woken by one being done with, and reclaim expired ones on a schedule.
+    # Leases that expire while nobody forges are found by the scheduled pass.
+    def _run(self):
+        interval = self.app.config['PRIZE_LEASE_RECLAIM_SECONDS']
+        reclaim_at = time.monotonic() + interval
+        while True:
+            self._wake.wait(max(reclaim_at - time.monotonic(), 0))
+            self._wake.clear()
+            with self.app.app_context():
+                try:
+                    self.release_settled()
+                    if time.monotonic() >= reclaim_at:
+                        reclaim_at = time.monotonic() + interval
+                        self.reclaim_expired()
+                except Exception:
+                    self.app.logger.exception("Returning prize leases failed")
+
+    # Give a lease's unused units back to its prize type and drop the lease.
+    def _release(self, lease_id):
+        used = 0
+        for engine in shard_engines():
+            with engine.connect() as conn:
+                used += conn.execute(select(func.count()).select_from(Prize).where(Prize.lease_id == lease_id)).scalar()
+
+        with db.engine.begin() as conn:
+            lease = conn.execute(select(PrizeLease.prize_type_id, PrizeLease.units).where(PrizeLease.id == lease_id)).first()
+            # Deleting the lease is the claim, so a lease is never returned twice.
+            if lease is None or not conn.execute(delete(PrizeLease).where(PrizeLease.id == lease_id)).rowcount:
+                return 0
+            unused = lease.units - used
+            conn.execute(update(PrizeType).where(PrizeType.id == lease.prize_type_id)
+                         .values(number_claimed=PrizeType.number_claimed - unused))
+        return unused
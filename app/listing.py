@@ -0,0 +1,70 @@
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import select, tuple_
+from . import db
+from .models import LootBox, Prize, PrizeType
+from .sharding import shard_count
+
+# A prize with its prize type's name and rarity, which are None if the type no longer exists.
+PrizeListing = namedtuple('PrizeListing', ['id', 'timestamp', 'prize_type_id', 'name', 'rarity'])
+
+
+# Pack the position of the last row of a page into an opaque cursor.
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(json.dumps([row.timestamp.isoformat(), row.id]).encode()).decode()
+
+
+# Unpack a cursor into a (timestamp, id) position, None for the first page.
+# Raises ValueError for a malformed cursor.
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except TypeError:
+        raise ValueError("Invalid cursor")
+
+
+# A user's lootboxes newest first, after the position, read from the covering
+# (user_id, timestamp, id, rarity) index alone. Streams in chunks of yield_per rows if given.
+def lootbox_rows(user_id, position=None, limit=None, yield_per=None):
+    statement = _newest_first(select(LootBox.id, LootBox.timestamp, LootBox.rarity), LootBox, user_id, position)
+    return _execute(statement.limit(limit), yield_per)
+
+
+# A user's prizes newest first, after the position, as PrizeListings.
+# Streams in chunks of yield_per rows if given.
+def prize_rows(user_id, position=None, limit=None, yield_per=None):
+    columns = (Prize.id, Prize.timestamp, Prize.prize_type_id)
+    if shard_count() == 1:
+        # Everything is in one database, so fetch the prize types in the same query.
+        statement = select(*columns, PrizeType.name, PrizeType.rarity).outerjoin(PrizeType, PrizeType.id == Prize.prize_type_id)
+        for row in _execute(_newest_first(statement, Prize, user_id, position).limit(limit), yield_per):
+            yield PrizeListing(*row)
+        return
+
+    # The catalog lives in its own database, so fetch each chunk's prize types in one more query.
+    result = _execute(_newest_first(select(*columns), Prize, user_id, position).limit(limit), yield_per)
+    for chunk in result.partitions() if yield_per else [result.all()]:
+        prize_types = {prize_type.id: prize_type for prize_type in
+                       PrizeType.query.filter(PrizeType.id.in_({row.prize_type_id for row in chunk}))}
+        for row in chunk:
+            prize_type = prize_types.get(row.prize_type_id)
+            yield PrizeListing(*row, prize_type.name if prize_type else None, prize_type.rarity if prize_type else None)
+
+
+# Restrict a select to the user's rows after the position, newest first.
+def _newest_first(statement, model, user_id, position):
+    statement = statement.where(model.user_id == user_id)
+    if position is not None:
+        statement = statement.where(tuple_(model.timestamp, model.id) < tuple_(*position))
+    return statement.order_by(model.timestamp.desc(), model.id.desc())
+
+
+def _execute(statement, yield_per):
+    if yield_per:
+        statement = statement.execution_options(yield_per=yield_per)
+    return db.session.execute(statement)
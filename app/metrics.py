@@ -0,0 +1,22 @@
+import threading
+from collections import defaultdict
+
+
+# Process-wide counters, served by the /metrics route.
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+
+    # Add to a counter.
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    # Copy of every counter.
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+metrics = Metrics()
@@ -0,0 +1,65 @@
+import sqlalchemy as sa
+
+
+# Bring tables created by older versions of the models up to date: add missing columns and
+# indexes, and rebuild tables the models now want with AUTOINCREMENT, which SQLite cannot add
+# in place. Tables that are already up to date are left alone, so this is safe to re-run.
+def upgrade_tables(engine, tables):
+    with engine.begin() as conn:
+        # pysqlite only opens a transaction before DML, so open one here to make the DDL atomic too.
+        conn.exec_driver_sql("BEGIN")
+        inspector = sa.inspect(conn)
+        existing = set(inspector.get_table_names())
+        for table in tables:
+            if table.name not in existing:
+                continue
+            if table.dialect_options['sqlite']['autoincrement'] and not _has_autoincrement(conn, table):
+                _rebuild(conn, inspector, table)
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN {_column_ddl(conn, column)}')
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+
+
+def _has_autoincrement(conn, table):
+    sql = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)).scalar()
+    return 'AUTOINCREMENT' in sql.upper()
+
+
+# Recreate a table from its model and copy its rows over, ids included. Columns the old
+# table lacks get their default.
+def _rebuild(conn, inspector, table):
+    old_name = f"_{table.name}_old"
+    for index in inspector.get_indexes(table.name):
+        conn.exec_driver_sql(f'DROP INDEX "{index["name"]}"')
+    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" RENAME TO "{old_name}"')
+    table.create(conn)
+    old = sa.Table(old_name, sa.MetaData(), autoload_with=conn)
+    columns = [column for column in table.columns if column.name in old.c or _default(column) is not None]
+    conn.execute(sa.insert(table).from_select(
+        [column.name for column in columns],
+        sa.select(*(old.c[column.name] if column.name in old.c else sa.literal(_default(column)) for column in columns)),
+    ))
+    old.drop(conn)
+
+
+# Column definition for ALTER TABLE ADD COLUMN. SQLite needs a constant default to add a
+# NOT NULL column, so the model's scalar default is written into the schema.
+def _column_ddl(conn, column):
+    ddl = str(sa.schema.CreateColumn(column).compile(dialect=conn.dialect))
+    default = _default(column)
+    if default is not None and column.server_default is None:
+        literal = sa.literal(default).compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True})
+        ddl += f" DEFAULT {literal}"
+    return ddl
+
+
+def _default(column):
+    if column.default is not None and column.default.is_scalar:
+        return column.default.arg
+    return None
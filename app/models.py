@@ -2,6 +2,7 @@ from datetime import datetime
 from . import db
 
 class User(db.Model):
+    __table_args__ = {'info': {'user_scoped': True}}
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(120), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -12,18 +13,31 @@ class User(db.Model):
     adventures = db.relationship('Adventure', backref='adventurer', lazy=True)
 
 class Adventure(db.Model):
+    # AUTOINCREMENT keeps ids of archived adventures from being handed out again.
+    __table_args__ = (
+        db.Index('ix_adventure_user_id_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_adventure_user_id_change_seq', 'user_id', 'change_seq', 'id'),
+        {'info': {'user_scoped': True}, 'sqlite_autoincrement': True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     rng_score = db.Column(db.Integer, nullable=False)
     material = db.Column(db.String(120), nullable=False)
     status = db.Column(db.String(120), nullable=False, default="In Progress")
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    change_seq = db.Column(db.Integer, nullable=False, default=0)
     
 class LootBox(db.Model):
+    __table_args__ = (
+        db.Index('ix_loot_box_user_id_change_seq', 'user_id', 'change_seq', 'id'),
+        db.Index('ix_loot_box_user_id_timestamp', 'user_id', 'timestamp', 'id', 'rarity'),
+        {'info': {'user_scoped': True}},
+    )
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     rarity = db.Column(db.String(120), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    change_seq = db.Column(db.Integer, nullable=False, default=0)
     
 class PrizeType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -31,9 +45,115 @@ class PrizeType(db.Model):
     rarity = db.Column(db.String(120), nullable=False)
     quanity = db.Column(db.Integer, nullable=False)
     number_claimed = db.Column(db.Integer, nullable=False, default=0)
+    weight = db.Column(db.Float)
     
 class Prize(db.Model):
+    __table_args__ = (
+        db.Index('ix_prize_user_id_change_seq', 'user_id', 'change_seq', 'id'),
+        db.Index('ix_prize_user_id_timestamp', 'user_id', 'timestamp', 'id', 'prize_type_id'),
+        {'info': {'user_scoped': True}},
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     prize_type_id = db.Column(db.Integer, db.ForeignKey('prize_type.id'), nullable=False)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lease_id = db.Column(db.Integer, index=True)
+    change_seq = db.Column(db.Integer, nullable=False, default=0)
+
+class PreRolledAdventure(db.Model):
+    __table_args__ = {'info': {'user_scoped': True}}
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
+    threshold = db.Column(db.Integer, nullable=False)
+    rng_score = db.Column(db.Integer, nullable=False)
+    seal = db.Column(db.String(64), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class PrizeLease(db.Model):
+    # AUTOINCREMENT keeps the id of a released lease, which its prizes still reference, from being handed out again.
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    prize_type_id = db.Column(db.Integer, db.ForeignKey('prize_type.id'), nullable=False)
+    units = db.Column(db.Integer, nullable=False)
+    owner = db.Column(db.String(120), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class ArchivedAdventure(db.Model):
+    __table_args__ = (
+        db.Index('ix_archived_adventure_user_id_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_archived_adventure_user_id_change_seq', 'user_id', 'change_seq', 'id'),
+        {'info': {'user_scoped': True}},
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    rng_score = db.Column(db.Integer, nullable=False)
+    material = db.Column(db.String(120), nullable=False)
+    status = db.Column(db.String(120), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    change_seq = db.Column(db.Integer, nullable=False, default=0)
+
+class ArchivedMaterialCount(db.Model):
+    __table_args__ = {'info': {'user_scoped': True}}
+    user_id = db.Column(db.Integer, primary_key=True)
+    material = db.Column(db.String(120), primary_key=True)
+    status = db.Column(db.String(120), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    newest_id = db.Column(db.Integer, nullable=False)
+
+class LeaderboardScore(db.Model):
+    __table_args__ = (
+        db.Index('ix_leaderboard_score_change_seq', 'change_seq'),
+        {'info': {'user_scoped': True}},
+    )
+    user_id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Integer, nullable=False, default=0)
+    change_seq = db.Column(db.Integer, nullable=False, default=0)
+
+# Append-only log of game events for downstream consumers.
+# AUTOINCREMENT keeps sequence numbers from being handed out again.
+class Event(db.Model):
+    __table_args__ = {'info': {'user_scoped': True}, 'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    type = db.Column(db.String(32), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+
+# Drops per minute, hour and day bucket. Kept on every shard, so each drop is counted
+# in the transaction that made it.
+class DropRollup(db.Model):
+    __table_args__ = {'info': {'user_scoped': True}}
+    resolution = db.Column(db.String(16), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    kind = db.Column(db.String(16), primary_key=True)
+    name = db.Column(db.String(120), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+# Responses to writes sent with an Idempotency-Key, replayed to retries of the same request.
+# Kept on the user's shard, so a response commits in the transaction of the write it describes.
+class IdempotencyKey(db.Model):
+    __table_args__ = (
+        db.Index('ix_idempotency_key_created_at', 'created_at'),
+        {'info': {'user_scoped': True}},
+    )
+    user_id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# The shard's 'user' change counter at each user's latest write, so caches of a user's
+# reads are only invalidated by writes to that user.
+class UserVersion(db.Model):
+    __table_args__ = (
+        db.Index('ix_user_version_version', 'version'),
+        {'info': {'user_scoped': True}},
+    )
+    user_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+class ChangeCounter(db.Model):
+    __table_args__ = {'info': {'user_scoped': True}}
+    table_name = db.Column(db.String(120), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
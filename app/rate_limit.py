@@ -0,0 +1,141 @@
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from flask import request
+from .shared_memory import SharedSegment, stable_hash
+
+
+# Build the rate limiter with the storage selected by RATE_LIMIT_BACKEND.
+def create_rate_limiter(app):
+    config = app.config
+    backend = config['RATE_LIMIT_BACKEND']
+    if backend == 'memory':
+        buckets = MemoryTokenBuckets(config['RATE_LIMIT_SLOTS'])
+    elif backend == 'shared_memory':
+        buckets = SharedMemoryTokenBuckets(config['RATE_LIMIT_SHARED_MEMORY_NAME'], config['RATE_LIMIT_SLOTS'])
+    else:
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND {backend!r}")
+    return RateLimiter(config['RATE_LIMITS'], buckets)
+
+
+# The user a request is for, from the URL, the query string or the JSON body, if any.
+def request_user_id():
+    user_id = (request.view_args or {}).get('user_id') or request.args.get('user_id')
+    if user_id is None and request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            user_id = body.get('user_id')
+    try:
+        return int(user_id) if user_id is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+# The RateLimiter applies RATE_LIMITS: for each limited endpoint, a token bucket per user
+# id and, where an 'ip' limit is configured, one per client IP, each holding `requests` tokens and refilled at requests/seconds
+# per second. A request takes a token from every bucket it falls in, or from none if any is empty.
+class RateLimiter:
+    def __init__(self, limits, buckets):
+        self.limits = limits
+        self.buckets = buckets
+
+    # Seconds until the request would be allowed, or 0 if it is allowed and counted.
+    def check(self, endpoint, user_id, ip):
+        limits = self.limits.get(endpoint)
+        if not limits:
+            return 0
+        keys = []
+        if user_id is not None and 'user' in limits:
+            keys.append((f"{endpoint}:user:{user_id}", *limits['user']))
+        if ip and 'ip' in limits:
+            keys.append((f"{endpoint}:ip:{ip}", *limits['ip']))
+        return self.buckets.take(keys)
+
+
+# Token buckets kept as the generic cell rate algorithm: a bucket is just the time at which
+# it will be full again (its theoretical arrival time), one float, and every request pushes
+# that time one refill interval further. The bucket is empty when that time runs a whole
+# refill period ahead of now.
+#
+# Buckets live in a fixed open-addressed table of 16-byte slots (key hash, time), so the
+# memory used never grows with the number of keys. A bucket whose time has passed is full,
+# which is the same as not being stored, so its slot is free for reuse: nothing ever has to
+# be swept. When all PROBE_LENGTH slots of a key hold live buckets, the fullest is dropped,
+# erring towards letting requests through.
+class TokenBuckets(ABC):
+    SLOT = struct.Struct('<Qd')
+    PROBE_LENGTH = 8
+
+    def __init__(self, buffer, slots):
+        self.buffer = buffer
+        self.slots = slots
+
+    # Take a token from each (key, requests, seconds) bucket if all have one. Returns 0 on
+    # success, otherwise the seconds until the emptiest has a token again.
+    def take(self, keys):
+        if not keys:
+            return 0
+        now = time.time()
+        with self._locked():
+            updates = []
+            wait = 0
+            for key, requests, seconds in keys:
+                key_hash = stable_hash(key)
+                slot, full_at = self._find(key_hash, now)
+                full_at = max(full_at, now) + seconds / requests
+                wait = max(wait, full_at - now - seconds)
+                updates.append((slot, key_hash, full_at))
+            if wait > 0:
+                return wait
+            for slot, key_hash, full_at in updates:
+                self.SLOT.pack_into(self.buffer, slot * self.SLOT.size, key_hash, full_at)
+            return 0
+
+    # The key's slot and the time its bucket is full, 0 if it has none. A new key gets a free
+    # slot or, failing that, the fullest bucket's.
+    def _find(self, key_hash, now):
+        start = key_hash % self.slots
+        free_slot, fullest_slot, fullest_at = None, None, None
+        for step in range(min(self.PROBE_LENGTH, self.slots)):
+            slot = (start + step) % self.slots
+            slot_hash, full_at = self.SLOT.unpack_from(self.buffer, slot * self.SLOT.size)
+            if slot_hash == key_hash:
+                return slot, full_at
+            if full_at <= now:
+                if free_slot is None:
+                    free_slot = slot
+            elif fullest_at is None or full_at < fullest_at:
+                fullest_slot, fullest_at = slot, full_at
+        return (free_slot if free_slot is not None else fullest_slot), 0.0
+
+    # A context manager giving exclusive access to the buffer.
+    @abstractmethod
+    def _locked(self):
+        pass
+
+
+# Buckets private to this worker process.
+class MemoryTokenBuckets(TokenBuckets):
+    def __init__(self, slots):
+        super().__init__(bytearray(slots * self.SLOT.size), slots)
+        self._lock = threading.Lock()
+
+    def _locked(self):
+        return self._lock
+
+
+# Buckets shared by every worker process on the host, in a multiprocessing.shared_memory
+# segment guarded by a lock file, like SharedMemoryCache.
+class SharedMemoryTokenBuckets(TokenBuckets):
+    def __init__(self, segment_name, slots):
+        self._segment = SharedSegment(segment_name, slots * self.SLOT.size)
+        super().__init__(self._segment.buf, slots)
+
+    # Detach from the segment, removing it from the host if unlink is set.
+    def close(self, unlink=False):
+        self.buffer = None
+        self._segment.close(unlink)
+
+    def _locked(self):
+        return self._segment.locked()
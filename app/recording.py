@@ -0,0 +1,76 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import time
+from logging.handlers import QueueListener, RotatingFileHandler
+from flask import g, request
+from .rate_limit import request_user_id
+
+# Endpoints never recorded: metrics scrapes, and admin requests, which carry a token.
+UNRECORDED_ENDPOINTS = ('main.get_metrics', 'main.export_endpoint', 'main.get_cancelled_queries')
+
+
+# The RequestRecorder writes a sample of the requests served to a rotating log for replay.py,
+# one compact JSON line each: start time, endpoint, method, path with query string, body,
+# Accept header when it asks for an event stream, status and milliseconds taken to respond.
+#
+# Requests are sampled by user, REQUEST_LOG_SAMPLE_RATE of them, so a replay sees whole
+# sessions (adventures followed by the forges they allow) rather than scattered requests;
+# requests for no user in particular are sampled at random at the same rate. An unsampled
+# request costs a timestamp and a hash. Lines are written by a background thread, so a
+# sampled one only adds its encoding. Each worker writes its own log, REQUEST_LOG_PATH
+# formatted with its pid, rolled over at REQUEST_LOG_MAX_BYTES.
+class RequestRecorder:
+    def __init__(self, app):
+        self.rate = app.config['REQUEST_LOG_SAMPLE_RATE']
+        self.threshold = int(self.rate * 2 ** 32)
+        handler = RotatingFileHandler(app.config['REQUEST_LOG_PATH'].format(pid=os.getpid()),
+                                      maxBytes=app.config['REQUEST_LOG_MAX_BYTES'],
+                                      backupCount=app.config['REQUEST_LOG_BACKUPS'], delay=True)
+        self.queue = queue.SimpleQueue()
+        self.listener = QueueListener(self.queue, handler)
+        self.listener.start()
+        atexit.register(self.close)
+        app.before_request(self._start)
+        app.after_request(self._record)
+
+    # Whether requests for this user are recorded. The multiplicative hash spreads
+    # consecutive ids, so the sample is not one block of old or new users.
+    def sampled(self, user_id):
+        if user_id is None:
+            return random.random() < self.rate
+        return (user_id * 2654435761) % 2 ** 32 < self.threshold
+
+    # Write out the lines still queued and stop the writer thread.
+    def close(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def _start(self):
+        g.request_started = (time.time(), time.perf_counter())
+
+    def _record(self, response):
+        started = g.pop('request_started', None)
+        if started is None or request.endpoint is None or request.endpoint in UNRECORDED_ENDPOINTS:
+            return response
+        if not self.sampled(request_user_id()):
+            return response
+
+        entry = {
+            't': round(started[0], 3),
+            'e': request.endpoint,
+            'm': request.method,
+            'p': request.full_path.rstrip('?'),
+            's': response.status_code,
+            'd': round((time.perf_counter() - started[1]) * 1000, 2),
+        }
+        body = request.get_data(as_text=True)
+        if body:
+            entry['b'] = body
+        if request.accept_mimetypes.best == 'text/event-stream':
+            entry['a'] = 'text/event-stream'
+        self.queue.put(logging.makeLogRecord({'msg': json.dumps(entry, separators=(',', ':'))}))
+        return response
@@ -0,0 +1,45 @@
+import random
+import time
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+from . import db
+from .metrics import metrics
+
+# SQLite error messages meaning another connection holds a conflicting lock.
+LOCK_ERRORS = ('database is locked', 'database table is locked', 'database is busy')
+
+
+def is_lock_error(error):
+    return isinstance(error, OperationalError) and any(message in str(error.orig) for message in LOCK_ERRORS)
+
+
+# Run a write unit, a function doing a whole transaction from its first read to its commit,
+# re-running it from scratch when SQLite reports a lock conflict.
+#
+# SQLite's busy timeout covers most waits, but a transaction that read before writing can be
+# refused the write lock at once to avoid a deadlock, and that fails the request unless the
+# transaction is rolled back and started over. Attempts are spaced by exponential backoff
+# with full jitter (a random sleep up to WRITE_RETRY_BASE_SECONDS doubled per attempt,
+# capped at WRITE_RETRY_MAX_SECONDS), so colliding writers spread out instead of colliding
+# again. After WRITE_RETRY_ATTEMPTS the error is raised. Retries, successes after a retry
+# and give-ups are counted in the metrics under retry.<name>.
+def run_transaction(name, unit, *args, **kwargs):
+    config = current_app.config
+    attempts = config['WRITE_RETRY_ATTEMPTS']
+    for attempt in range(attempts):
+        try:
+            result = unit(*args, **kwargs)
+        except OperationalError as error:
+            if not is_lock_error(error):
+                raise
+            # Rolling back also expires the loaded objects, so the next attempt re-reads them.
+            db.session.rollback()
+            if attempt == attempts - 1:
+                metrics.increment(f"retry.{name}.gave_up")
+                raise
+            metrics.increment(f"retry.{name}.retried")
+            time.sleep(random.uniform(0, min(config['WRITE_RETRY_MAX_SECONDS'], config['WRITE_RETRY_BASE_SECONDS'] * 2 ** attempt)))
+            continue
+        if attempt:
+            metrics.increment(f"retry.{name}.succeeded_after_retry")
+        return result
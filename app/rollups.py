@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from flask import g
+from sqlalchemy import and_, delete, func, insert, literal, or_, select, union_all
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from . import db
+from .models import Adventure, ArchivedAdventure, DropRollup, LootBox
+from .sharding import shard_count
+
+# Bucket resolutions from coarsest to finest, with their length in seconds and the SQLite
+# strftime format truncating a stored timestamp to the start of its bucket.
+RESOLUTIONS = [
+    ('day', 86400, '%Y-%m-%d 00:00:00.000000'),
+    ('hour', 3600, '%Y-%m-%d %H:00:00.000000'),
+    ('minute', 60, '%Y-%m-%d %H:%M:00.000000'),
+]
+
+# What is counted: materials found on adventures and lootbox rarities.
+DROP_KINDS = ('material', 'lootbox')
+
+EPOCH = datetime(1970, 1, 1)
+
+
+# Count one drop in its minute, hour and day buckets, in the current transaction.
+def record_drop(kind, name, timestamp=None):
+    timestamp = timestamp or datetime.utcnow()
+    for resolution, seconds, _ in RESOLUTIONS:
+        upsert = sqlite_insert(DropRollup).values(
+            resolution=resolution, bucket=_floor(timestamp, seconds), kind=kind, name=name, count=1)
+        db.session.execute(upsert.on_conflict_do_update(
+            index_elements=['resolution', 'bucket', 'kind', 'name'],
+            set_={'count': DropRollup.count + 1},
+        ))
+
+
+# Number of drops of a kind per name between since and until, across all shards.
+# Both ends are rounded down to the minute. The window is covered with as few buckets as
+# possible, whole days in the middle and hours and minutes at the edges, so a week costs
+# at most a few hundred bucket rows whatever the traffic.
+def drop_counts(kind, since, until):
+    ranges = _cover(_floor(since, 60), _floor(until, 60), RESOLUTIONS)
+    counts = {}
+    if not ranges:
+        return counts, ranges
+    in_window = or_(*(
+        and_(DropRollup.resolution == resolution, DropRollup.bucket >= start, DropRollup.bucket < end)
+        for resolution, start, end in ranges
+    ))
+    for shard in range(shard_count()):
+        g.shard = shard
+        rows = db.session.execute(
+            select(DropRollup.name, func.sum(DropRollup.count))
+            .where(DropRollup.kind == kind, in_window)
+            .group_by(DropRollup.name)
+        ).all()
+        for name, count in rows:
+            counts[name] = counts.get(name, 0) + count
+    return counts, ranges
+
+
+# Recount every bucket from the adventures, archived adventures and lootboxes, one shard at a
+# time. Used to backfill drops made before the rollups existed.
+def rebuild_rollups():
+    rebuilt = 0
+    for shard in range(shard_count()):
+        g.shard = shard
+        db.session.execute(delete(DropRollup))
+        for resolution, _, bucket_format in RESOLUTIONS:
+            drops = union_all(*(
+                select(literal(kind).label('kind'), column.label('name'),
+                       func.strftime(bucket_format, model.timestamp).label('bucket'))
+                for kind, model, column in (
+                    ('material', Adventure, Adventure.material),
+                    ('material', ArchivedAdventure, ArchivedAdventure.material),
+                    ('lootbox', LootBox, LootBox.rarity),
+                )
+            )).subquery()
+            result = db.session.execute(insert(DropRollup).from_select(
+                ['resolution', 'bucket', 'kind', 'name', 'count'],
+                select(literal(resolution), drops.c.bucket, drops.c.kind, drops.c.name, func.count())
+                .group_by(drops.c.bucket, drops.c.kind, drops.c.name),
+            ))
+            rebuilt += result.rowcount
+        db.session.commit()
+    return rebuilt
+
+
+# (resolution, start, end) bucket ranges exactly covering [start, end), which must be
+# aligned to the finest resolution.
+def _cover(start, end, resolutions):
+    resolution, seconds, _ = resolutions[0]
+    first = _ceil(start, seconds)
+    last = _floor(end, seconds)
+    if len(resolutions) == 1:
+        return [(resolution, start, end)] if start < end else []
+    if first >= last:
+        return _cover(start, end, resolutions[1:])
+    return _cover(start, first, resolutions[1:]) + [(resolution, first, last)] + _cover(last, end, resolutions[1:])
+
+
+def _floor(timestamp, seconds):
+    return EPOCH + timedelta(seconds=(timestamp - EPOCH) // timedelta(seconds=seconds) * seconds)
+
+
+def _ceil(timestamp, seconds):
+    floor = _floor(timestamp, seconds)
+    return floor if floor == timestamp else floor + timedelta(seconds=seconds)
@@ -1,12 +1,105 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, abort, current_app, g, jsonify, request, stream_with_context
+import hmac
+import json
+import math
+import time
 from collections import Counter
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .archive import adventure_history, archived_material_counts
+from .metrics import metrics
 from .models import User, Adventure
 from .game_logic import AdventureManager, LootBoxManager  
+from .sharding import use_shard
+from .sync import changes_since
+from .listing import decode_cursor, encode_cursor, lootbox_rows, prize_rows
+from .rollups import DROP_KINDS, drop_counts
+from .events import event_payload, events_after, format_cursor, parse_cursor
+from .export import EXPORT_FORMATS, EXPORTS, export_table
+from .rate_limit import request_user_id
+from .idempotency import IDEMPOTENCY_HEADER, remember_response, request_hash, stored_response, valid_key
 
 
 # 'main' is the Blueprint name which will be imported and registered in the Flask app.
 main = Blueprint('main', __name__)
 
+# Turn away clients over their rate limit for the route before anything touches the database.
+@main.before_request
+def enforce_rate_limit():
+    endpoint = request.endpoint.rpartition('.')[2]
+    retry_after = current_app.extensions['rate_limiter'].check(endpoint, request_user_id(), request.remote_addr)
+    if retry_after:
+        metrics.increment(f"rate_limit.rejected.{endpoint}")
+        return jsonify({'message': 'Too many requests'}), 429, {'Retry-After': str(math.ceil(retry_after))}
+
+# Admit the request into its route's bulkhead, or shed it at once when the route is saturated.
+@main.before_request
+def enter_bulkhead():
+    bulkhead = current_app.extensions['bulkheads'].get(request.endpoint.rpartition('.')[2])
+    if bulkhead is None:
+        return None
+    if not bulkhead.acquire():
+        retry_after = current_app.config['BULKHEAD_RETRY_AFTER_SECONDS']
+        return jsonify({'message': 'Service busy, try again later'}), 503, {'Retry-After': str(retry_after)}
+    g.bulkhead = bulkhead
+
+# Free the request's bulkhead slot once it is done, streamed responses included.
+@main.teardown_request
+def leave_bulkhead(exception):
+    bulkhead = g.pop('bulkhead', None)
+    if bulkhead is not None:
+        bulkhead.release()
+
+# Build a cache key for a read of a user's data that changes whenever the user's data is written,
+# in this worker or any other. Writes for other users leave it alone.
+def versioned_key(name, user_id, *args):
+    version = current_app.extensions['change_tracker'].user_version(user_id)
+    return ':'.join(str(part) for part in (name, g.shard, user_id, version, *args))
+
+# Get a user to update, rejecting ids known not to exist without touching the database.
+def get_user(user_id):
+    existence = current_app.extensions['user_existence']
+    if not existence.might_exist(user_id):
+        return None
+    user = User.query.get(user_id)
+    if not user:
+        existence.record_missing(user_id)
+    return user
+
+# Get a read-only copy of a user, served from the cache until the user's data changes.
+def get_cached_user(user_id):
+    existence = current_app.extensions['user_existence']
+    if not existence.might_exist(user_id):
+        return None
+    cache = current_app.extensions['cache']
+    cache_key = versioned_key('user', user_id)
+    user = cache.get(cache_key)
+    if user is None:
+        row = User.query.get(user_id)
+        if not row:
+            existence.record_missing(user_id)
+            return None
+        user = SimpleNamespace(id=row.id, username=row.username, current_threshold=row.current_threshold,
+                               reset_threshold=row.reset_threshold)
+        cache.set(cache_key, user)
+    return user
+
+# Serve a JSON body from the cache, building, serializing and storing it on a miss.
+# Concurrent misses for the same key share one build and its serialized bytes.
+def cached_json(cache_key, build):
+    cache = current_app.extensions['cache']
+    body = cache.get(cache_key)
+    if body is None:
+        def build_body():
+            body = jsonify(build()).get_data()
+            cache.set(cache_key, body)
+            return body
+        body = current_app.extensions['single_flight'].do(cache_key, build_body)
+    return current_app.response_class(body, status=200, mimetype='application/json')
+
 # Define an endpoint for the adventure creation functionality.
 @main.route('/adventure', methods=['POST'])
 def adventure_endpoint():
@@ -16,8 +109,21 @@ def adventure_endpoint():
     # Extract the user ID from the incoming data.
     user_id = user_data['user_id']
 
-    # Try to get the user from the database with the provided ID.
-    user = User.query.get(user_id)
+    # Route this request's queries to the shard holding the user.
+    use_shard(user_id)
+
+    # A retry of a request that already went through gets the original response back.
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    fingerprint = request_hash('adventure', user_data)
+    if key is not None:
+        if not valid_key(key):
+            return jsonify({'message': 'Invalid Idempotency-Key'}), 400
+        replay = replayed_response(user_id, key, fingerprint)
+        if replay:
+            return replay
+
+    # Get the user with the provided ID.
+    user = get_user(user_id)
     
     # If the user is not found in the database, return an error message.
     if not user:
@@ -28,12 +134,20 @@ def adventure_endpoint():
     if not AdventureManager.is_eligible(user):
         return jsonify({'message': 'You can only go on one adventure per day'}), 403
 
-    # Create a new adventure for the user using the AdventureManager class.
+    # The success message along with the material the user got from the adventure.
+    def adventure_response(new_adventure):
+        return jsonify({'message': 'Adventure complete', 'material': new_adventure.material}), 201
+
+    # Create a new adventure for the user using the AdventureManager class,
+    # storing the response with it when the request carries an Idempotency-Key.
     adventure_manager = AdventureManager(user)
-    new_adventure = adventure_manager.create()
+    before_commit = remember(user.id, key, fingerprint, adventure_response) if key is not None else None
+    try:
+        new_adventure = adventure_manager.create(before_commit=before_commit)
+    except IntegrityError as error:
+        return replay_after_race(user.id, key, fingerprint, error)
 
-    # Return a success message along with the material the user got from the adventure.
-    return jsonify({'message': 'Adventure complete', 'material': new_adventure.material}), 201
+    return adventure_response(new_adventure)
 
 # Define an endpoint to retrieve a summary of the user's materials.
 @main.route('/materials_summary', methods=['GET'])
@@ -46,29 +160,16 @@ def get_materials_summary():
     if not user_id:
         return jsonify({'message': 'User ID is required'}), 400
 
-    # Try to get the user from the database with the provided ID.
-    user = User.query.get(user_id)
+    # Route this request's queries to the shard holding the user, then get the user with the provided ID.
+    use_shard(user_id)
+    user = get_cached_user(user_id)
 
     # If the user is not found in the database, return an error message.
     if not user:
         return jsonify({'message': 'User not found'}), 404
 
-    # Get all adventures associated with the user from the database.
-    all_adventures = Adventure.query.filter_by(user_id=user.id).all()
-
-    # Separate the adventures based on whether the materials were used or not.
-    used_adventures = [adv for adv in all_adventures if adv.status == "Used Material"]
-    unused_adventures = [adv for adv in all_adventures if adv.status == "Unused Material"]
-
-    # Count the occurrences of each type of material.
-    used_material_counts = Counter([adv.material for adv in used_adventures])
-    unused_material_counts = Counter([adv.material for adv in unused_adventures])
-
-    # Return a summary of both used and unused materials.
-    return jsonify({
-        'used_materials_summary': used_material_counts,
-        'unused_materials_summary': unused_material_counts
-    }), 200
+    # Serve the summary from the cache until the user's adventures change.
+    return cached_json(versioned_key('materials_summary', user.id), lambda: materials_summary(user))
 
 # Define an endpoint to retrieve a user's adventure history.
 @main.route('/adventure_history', methods=['GET'])
@@ -81,28 +182,26 @@ def get_adventure_history():
     if not user_id:
         return jsonify({'message': 'User ID is required'}), 400
 
-    # Try to get the user from the database with the provided ID.
-    user = User.query.get(user_id)
+    # Route this request's queries to the shard holding the user, then get the user with the provided ID.
+    use_shard(user_id)
+    user = get_cached_user(user_id)
 
     # If the user is not found in the database, return an error message.
     if not user:
         return jsonify({'message': 'User not found'}), 404
 
-    # Get all adventures associated with the user from the database, ordered by timestamp.
-    adventures = Adventure.query.filter_by(user_id=user.id).order_by(Adventure.timestamp.desc()).all()
+    # Get the user's adventures newest first, a page at a time when a limit is given.
+    # Pass the returned next_cursor as `before` to get the following page.
+    limit = user_data.get('limit', None, type=int)
+    cursor = user_data.get('before', None)
+    try:
+        before = decode_cursor(cursor)
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
 
-    # Prepare a list of adventure history details to return.
-    adventure_history = [
-        {
-            'id': adventure.id,
-            'timestamp': adventure.timestamp.isoformat(),
-            'material': adventure.material,
-        }
-        for adventure in adventures
-    ]
-
-    # Return the user's adventure history.
-    return jsonify({'adventure_history': adventure_history}), 200
+    # Serve the page from the cache until the user's adventures change.
+    cache_key = versioned_key('adventure_history', user.id, cursor, limit)
+    return cached_json(cache_key, lambda: adventure_history_page(user, before, limit))
 
 # Define an endpoint to create a lootbox.
 @main.route('/forge_lootbox', methods=['POST'])
@@ -114,8 +213,21 @@ def create_lootbox():
     user_id = data['user_id']
     material_ids = data['material_ids']
 
-    # Try to get the user from the database with the provided ID.
-    user = User.query.get(user_id)
+    # Route this request's queries to the shard holding the user.
+    use_shard(user_id)
+
+    # A retry of a request that already went through gets the original response back.
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    fingerprint = request_hash('forge_lootbox', data)
+    if key is not None:
+        if not valid_key(key):
+            return jsonify({'message': 'Invalid Idempotency-Key'}), 400
+        replay = replayed_response(user_id, key, fingerprint)
+        if replay:
+            return replay
+
+    # Get the user with the provided ID.
+    user = get_user(user_id)
 
     # If the user is not found in the database, return an error message.
     if not user:
@@ -125,13 +237,435 @@ def create_lootbox():
     if len(material_ids) != 5:
         return jsonify({'message': 'Exactly 5 materials are required to forge a LootBox'}), 400
 
-    # Create a new lootbox using the LootBoxManager class.
+    # The success message along with the rarity of the created lootbox.
+    def lootbox_response(new_lootbox, new_prize):
+        return jsonify({'message': 'New LootBox created', 'rarity': new_lootbox.rarity}), 201
+
+    # Create a new lootbox using the LootBoxManager class,
+    # storing the response with it when the request carries an Idempotency-Key.
     lootbox_manager = LootBoxManager(user, material_ids)
-    new_lootbox = lootbox_manager.create()
+    before_commit = remember(user.id, key, fingerprint, lootbox_response) if key is not None else None
+    try:
+        result = lootbox_manager.create(before_commit=before_commit)
+    except IntegrityError as error:
+        return replay_after_race(user.id, key, fingerprint, error)
 
     # If there was an error in creating the lootbox (e.g., using already used materials), return an error message.
-    if new_lootbox == "Error: Cannot use already used or ineligible material":
-        return jsonify({'message': new_lootbox}), 400
+    if result == "Error: Cannot use already used or ineligible material":
+        return jsonify({'message': result}), 400
+
+    return lootbox_response(*result)
+
+# The response stored for an earlier request with the same Idempotency-Key, or None if there was none.
+# A key reused for a different request is refused.
+def replayed_response(user_id, key, fingerprint):
+    stored = stored_response(user_id, key)
+    if stored is None:
+        return None
+    stored_hash, status, body = stored
+    if stored_hash != fingerprint:
+        return jsonify({'message': 'Idempotency-Key was used for a different request'}), 422
+    metrics.increment('idempotency.replayed')
+    return current_app.response_class(body, status=status, mimetype='application/json',
+                                      headers={'Idempotent-Replayed': 'true'})
+
+# A before_commit hook storing the response the write will get in the write's own transaction.
+def remember(user_id, key, fingerprint, respond):
+    def before_commit(*created):
+        response, status = respond(*created)
+        remember_response(user_id, key, fingerprint, status, response.get_data(as_text=True))
+    return before_commit
+
+# A retry sent while the original was still running stored its response first, so this
+# request's write was rolled back; answer with the stored response.
+def replay_after_race(user_id, key, fingerprint, error):
+    db.session.rollback()
+    replay = replayed_response(user_id, key, fingerprint) if key is not None else None
+    if not replay:
+        raise error
+    metrics.increment('idempotency.raced')
+    return replay
+
+# Summarize a user's used and unused materials.
+def materials_summary(user):
+    # Count the user's adventures per status and material, in the hot table and in the archive.
+    material_counts = db.session.execute(
+        select(Adventure.status, Adventure.material, func.count())
+        .where(Adventure.user_id == user.id)
+        .group_by(Adventure.status, Adventure.material)
+    ).all()
+    material_counts += archived_material_counts(user.id)
+
+    # Separate the counts based on whether the materials were used or not.
+    used_material_counts = Counter()
+    unused_material_counts = Counter()
+    for status, material, count in material_counts:
+        if status == "Used Material":
+            used_material_counts[material] += count
+        elif status == "Unused Material":
+            unused_material_counts[material] += count
+
+    # Return a summary of both used and unused materials.
+    return {
+        'used_materials_summary': used_material_counts,
+        'unused_materials_summary': unused_material_counts
+    }
+
+# A page of a user's adventure history, with the cursor of the next page.
+def adventure_history_page(user, before, limit):
+    adventures = adventure_history(user.id, before=before, limit=limit)
+    return history_payload(adventures, limit)
+
+# Serialize a page of adventures, with the cursor of the next page.
+def history_payload(adventures, limit):
+    next_cursor = encode_cursor(adventures[-1]) if limit and len(adventures) == limit else None
+
+    # Prepare a list of adventure history details to return.
+    history = [
+        {
+            'id': adventure.id,
+            'timestamp': adventure.timestamp.isoformat(),
+            'material': adventure.material,
+        }
+        for adventure in adventures
+    ]
+
+    # Return the user's adventure history.
+    return {'adventure_history': history, 'next_cursor': next_cursor}
+
+# A user's newest lootboxes.
+def recent_lootboxes(user, limit):
+    return [lootbox_payload(lootbox) for lootbox in lootbox_rows(user.id, limit=limit)]
+
+# A user's newest prizes with their prize type's name and rarity.
+def recent_prizes(user, limit):
+    return [prize_payload(prize) for prize in prize_rows(user.id, limit=limit)]
+
+def lootbox_payload(lootbox):
+    return {'id': lootbox.id, 'timestamp': lootbox.timestamp.isoformat(), 'rarity': lootbox.rarity}
+
+def prize_payload(prize):
+    return {
+        'id': prize.id,
+        'timestamp': prize.timestamp.isoformat(),
+        'prize_type_id': prize.prize_type_id,
+        'name': prize.name,
+        'rarity': prize.rarity,
+    }
+
+# Define an endpoint listing a user's lootboxes, newest first.
+@main.route('/lootboxes', methods=['GET'])
+def get_lootboxes():
+    return listing_response('lootboxes', lootbox_rows, lootbox_payload)
+
+# Define an endpoint listing a user's prizes with their prize types, newest first.
+@main.route('/prizes', methods=['GET'])
+def get_prizes():
+    return listing_response('prizes', prize_rows, prize_payload)
+
+# Serve a user's rows a page at a time; pass the returned next_cursor as `cursor` to get the
+# following page. With format=ndjson every row from the cursor on is streamed, one JSON object per line.
+def listing_response(name, rows, payload):
+    # Extract the user ID from the request arguments.
+    user_data = request.args
+    user_id = user_data.get('user_id', None)
+
+    # Check if a user ID was provided.
+    if not user_id:
+        return jsonify({'message': 'User ID is required'}), 400
+
+    # Route this request's queries to the shard holding the user, then get the user with the provided ID.
+    use_shard(user_id)
+    user = get_cached_user(user_id)
+
+    # If the user is not found in the database, return an error message.
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+
+    cursor = user_data.get('cursor', None)
+    try:
+        position = decode_cursor(cursor)
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+
+    if user_data.get('format') == 'ndjson':
+        chunk_size = current_app.config['LISTING_STREAM_CHUNK_SIZE']
+        def stream():
+            for row in rows(user.id, position, yield_per=chunk_size):
+                yield json.dumps(payload(row)) + '\n'
+        return current_app.response_class(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+    limit = min(max(user_data.get('limit', 50, type=int), 1), 500)
+    def build():
+        page = list(rows(user.id, position, limit))
+        return {name: [payload(row) for row in page], 'next_cursor': encode_cursor(page[-1]) if len(page) == limit else None}
+
+    # Serve the page from the cache until the user's rows change.
+    return cached_json(versioned_key(name, user.id, cursor, limit), build)
+
+# Define an endpoint returning everything the client's home screen needs in one response:
+# adventure eligibility, material inventory, recent history, lootboxes and prizes.
+@main.route('/users/<int:user_id>/state', methods=['GET'])
+def get_user_state(user_id):
+    # Route this request's queries to the shard holding the user, then get the user with the provided ID.
+    use_shard(user_id)
+    user = get_cached_user(user_id)
+
+    # If the user is not found in the database, return an error message.
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+
+    # Number of history entries, lootboxes and prizes to include.
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+
+    # Eligibility is decided exactly as POST /adventure decides it.
+    adventures = adventure_history(user.id, limit=limit)
+    next_eligible_time = AdventureManager.next_eligible_time(AdventureManager.last_adventure(user))
+
+    return jsonify({
+        'user_id': user.id,
+        'eligible': next_eligible_time is None or datetime.utcnow() > next_eligible_time,
+        'next_eligible_at': next_eligible_time.isoformat() if next_eligible_time else None,
+        'materials': materials_summary(user),
+        **history_payload(adventures, limit),
+        'lootboxes': recent_lootboxes(user, limit),
+        'prizes': recent_prizes(user, limit),
+    }), 200
+
+# Define an endpoint returning only the adventures, lootboxes and prizes that changed since the
+# client's last sync. Send the returned token next time; keep syncing while has_more is true.
+@main.route('/users/<int:user_id>/sync', methods=['GET'])
+def get_user_sync(user_id):
+    # Route this request's queries to the shard holding the user, then get the user with the provided ID.
+    use_shard(user_id)
+    user = get_cached_user(user_id)
+
+    # If the user is not found in the database, return an error message.
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+
+    # Get the changes since the client's token, at most `limit` rows per table.
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 1000)
+    try:
+        changes, token, has_more = changes_since(user.id, request.args.get('token'), limit)
+    except ValueError:
+        return jsonify({'message': 'Invalid sync token'}), 400
+
+    return jsonify({
+        'adventures': [
+            {
+                'id': adventure.id,
+                'timestamp': adventure.timestamp.isoformat(),
+                'material': adventure.material,
+                'status': adventure.status,
+            }
+            for adventure in changes['adventure']
+        ],
+        'lootboxes': [
+            {'id': lootbox.id, 'timestamp': lootbox.timestamp.isoformat(), 'rarity': lootbox.rarity}
+            for lootbox in changes['loot_box']
+        ],
+        'prizes': [
+            {'id': prize.id, 'timestamp': prize.timestamp.isoformat(), 'prize_type_id': prize.prize_type_id}
+            for prize in changes['prize']
+        ],
+        'token': token,
+        'has_more': has_more,
+    }), 200
+
+# Define an endpoint that holds the connection until the user can go on their next adventure,
+# so clients need not poll POST /adventure. Clients accepting text/event-stream get an event
+# stream that ends with an 'eligible' event; others get a long-poll answered when the user becomes
+# eligible or after `timeout` seconds, whichever comes first.
+@main.route('/users/<int:user_id>/eligibility', methods=['GET'])
+def get_user_eligibility(user_id):
+    # Route this request's queries to the shard holding the user, then get the user with the provided ID.
+    use_shard(user_id)
+    user = get_cached_user(user_id)
+
+    # If the user is not found in the database, return an error message.
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+
+    config = current_app.config
+    if request.accept_mimetypes.best == 'text/event-stream':
+        def stream():
+            next_eligible_time = pending_eligible_time(user)
+            yield f"event: waiting\ndata: {json.dumps(eligibility_payload(user, next_eligible_time))}\n\n"
+            while next_eligible_time is not None:
+                next_eligible_time = wait_until_eligible(user, config['ELIGIBILITY_KEEPALIVE_SECONDS'])
+                if next_eligible_time is not None:
+                    yield ": keepalive\n\n"
+            yield f"event: eligible\ndata: {json.dumps(eligibility_payload(user, None))}\n\n"
+        return current_app.response_class(stream_with_context(stream()), mimetype='text/event-stream',
+                                          headers={'Cache-Control': 'no-cache'})
+
+    timeout = min(max(request.args.get('timeout', 30, type=float), 0), config['ELIGIBILITY_MAX_WAIT_SECONDS'])
+    return jsonify(eligibility_payload(user, wait_until_eligible(user, timeout))), 200
+
+# When the user can go on their next adventure, or None if they already can.
+def pending_eligible_time(user):
+    next_eligible_time = AdventureManager.next_eligible_time(AdventureManager.last_adventure(user))
+    if next_eligible_time and datetime.utcnow() <= next_eligible_time:
+        return next_eligible_time
+    return None
+
+# Park the request until the user is eligible or `timeout` seconds have passed.
+# Returns the user's pending eligibility time, None once they are eligible.
+def wait_until_eligible(user, timeout):
+    notifier = current_app.extensions['eligibility_notifier']
+    give_up_at = time.monotonic() + timeout
+    while True:
+        # Re-read on every wake-up: an adventure from another device moves the deadline.
+        next_eligible_time = pending_eligible_time(user)
+        remaining = give_up_at - time.monotonic()
+        if next_eligible_time is None or remaining <= 0:
+            return next_eligible_time
+
+        # Hand the connection back to the pool while parked.
+        db.session.close()
+        event = notifier.subscribe(user.id, next_eligible_time.replace(tzinfo=timezone.utc).timestamp())
+        try:
+            event.wait(remaining)
+        finally:
+            notifier.forget(user.id, event)
+
+def eligibility_payload(user, next_eligible_time):
+    return {
+        'user_id': user.id,
+        'eligible': next_eligible_time is None,
+        'next_eligible_at': next_eligible_time.isoformat() if next_eligible_time else None,
+    }
+
+# Define an endpoint returning the best players across all shards.
+@main.route('/leaderboard', methods=['GET'])
+def get_leaderboard():
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    leaderboard = current_app.extensions['leaderboard']
+    return jsonify({
+        'leaderboard': [
+            {'rank': rank, 'user_id': user_id, 'score': score}
+            for rank, user_id, score in leaderboard.top(limit)
+        ],
+    }), 200
+
+# Define an endpoint returning a user's leaderboard score and rank.
+@main.route('/users/<int:user_id>/rank', methods=['GET'])
+def get_user_rank(user_id):
+    # Route this request's queries to the shard holding the user, then get the user with the provided ID.
+    use_shard(user_id)
+    user = get_cached_user(user_id)
+
+    # If the user is not found in the database, return an error message.
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+
+    # Users without points yet have no rank.
+    leaderboard = current_app.extensions['leaderboard']
+    rank, score = leaderboard.rank(user.id)
+    return jsonify({'user_id': user.id, 'score': score, 'rank': rank, 'ranked_users': leaderboard.size()}), 200
+
+# Define an endpoint counting the materials (kind=material) or lootbox rarities (kind=lootbox)
+# dropped in a window: the last `window` seconds, or from `since` to `until` (ISO 8601, UTC).
+@main.route('/analytics/drops', methods=['GET'])
+def get_drop_analytics():
+    args = request.args
+    kind = args.get('kind', 'material')
+    if kind not in DROP_KINDS:
+        return jsonify({'message': f"kind must be one of {', '.join(DROP_KINDS)}"}), 400
+
+    try:
+        until = parse_utc(args['until']) if 'until' in args else datetime.utcnow()
+        if 'since' in args:
+            since = parse_utc(args['since'])
+        else:
+            since = until - timedelta(seconds=args.get('window', 86400, type=int))
+    except ValueError:
+        return jsonify({'message': 'since and until must be ISO 8601 timestamps'}), 400
+
+    # Whole minutes are counted, so the minute `until` falls in is included.
+    counts, buckets = drop_counts(kind, since, until + timedelta(minutes=1))
+    return jsonify({
+        'kind': kind,
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'counts': counts,
+        'total': sum(counts.values()),
+        'bucket_ranges': len(buckets),
+    }), 200
+
+# Parse an ISO 8601 timestamp into a naive UTC datetime, like the stored timestamps.
+def parse_utc(value):
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+# Define an endpoint serving the event log after a cursor, in sequence order. Pass the returned
+# cursor as `after` to get the next page. With stream=1 events are sent as NDJSON as they are
+# written, each line carrying the cursor to resume from, until EVENT_STREAM_MAX_SECONDS pass.
+@main.route('/events', methods=['GET'])
+def get_events():
+    try:
+        positions = parse_cursor(request.args.get('after'))
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+
+    if request.args.get('stream'):
+        config = current_app.config
+        def stream():
+            stop_at = time.monotonic() + config['EVENT_STREAM_MAX_SECONDS']
+            while time.monotonic() < stop_at:
+                events, _ = events_after(positions, limit)
+                if not events:
+                    # Caught up: hand the connection back to the pool and check again shortly.
+                    db.session.close()
+                    time.sleep(config['EVENT_FEED_POLL_SECONDS'])
+                    continue
+                for shard, event in events:
+                    positions[shard] = event.id
+                    yield json.dumps({**event_payload(shard, event), 'cursor': format_cursor(positions)}) + '\n'
+        return current_app.response_class(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+    events, positions = events_after(positions, limit)
+    return jsonify({
+        'events': [event_payload(shard, event) for shard, event in events],
+        'cursor': format_cursor(positions),
+    }), 200
+
+# Reject requests without the admin token. Admin endpoints do not exist unless ADMIN_TOKEN is set.
+def require_admin():
+    admin_token = current_app.config['ADMIN_TOKEN']
+    if not admin_token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token):
+        abort(403)
+
+# Define an admin endpoint streaming a whole table (adventures, lootboxes or prizes) from every
+# shard as CSV or NDJSON (format=), gzipped with gzip=1.
+@main.route('/admin/export/<name>', methods=['GET'])
+def export_endpoint(name):
+    require_admin()
+    export_format = request.args.get('format', 'csv')
+    if name not in EXPORTS or export_format not in EXPORT_FORMATS:
+        return jsonify({'message': f"Exports are {', '.join(EXPORTS)} as {' or '.join(EXPORT_FORMATS)}"}), 404
+
+    compress = bool(request.args.get('gzip'))
+    filename = f"{name}.{export_format}" + ('.gz' if compress else '')
+    mimetype = 'application/gzip' if compress else ('text/csv' if export_format == 'csv' else 'application/x-ndjson')
+    return current_app.response_class(stream_with_context(export_table(name, export_format, compress)), mimetype=mimetype,
+                                      headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+# Define an admin endpoint listing this worker's most recent statements cancelled for running
+# past their request's deadline.
+@main.route('/admin/cancelled_queries', methods=['GET'])
+def get_cancelled_queries():
+    require_admin()
+    return jsonify({'cancelled': list(current_app.extensions['deadlines'].cancelled)}), 200
 
-    # Return a success message along with the rarity of the created lootbox.
-    return jsonify({'message': 'New LootBox created', 'rarity': new_lootbox.rarity}), 201
+# Define an admin endpoint exposing the process's counters (cache hits, misses, evictions, ...).
+@main.route('/metrics', methods=['GET'])
+def get_metrics():
+    require_admin()
+    return jsonify(metrics.snapshot()), 200
@@ -0,0 +1,34 @@
+from random import random
+
+
+# Vose's alias method: O(n) to build, O(1) to draw an item with probability proportional to its weight.
+class AliasTable:
+    def __init__(self, items, weights):
+        count = len(items)
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights]
+        self.items = list(items)
+        self.probability = [1.0] * count
+        self.alias = list(range(count))
+
+        # Pair each under-full column with an over-full one that tops it up.
+        small = [index for index, weight in enumerate(scaled) if weight < 1]
+        large = [index for index, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+
+    # Draw one item, with the given uniform [0, 1) source if not the random module's.
+    def sample(self, random=random):
+        # The whole part of one uniform draw picks the column, the fraction picks within it.
+        column = random() * len(self.items)
+        index = min(int(column), len(self.items) - 1)
+        if column - index < self.probability[index]:
+            return self.items[index]
+        return self.items[self.alias[index]]
@@ -0,0 +1,98 @@
+import zlib
+import sqlalchemy as sa
+from flask import current_app, g
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.util import find_tables
+from .migrations import upgrade_tables
+
+
+# Number of shard databases the user-scoped tables are spread across.
+def shard_count():
+    return current_app.config['SHARD_COUNT']
+
+
+# Map a user id to its shard. The id is hashed as text so 5 and "5" land on the same shard.
+def shard_for(user_id, count=None):
+    return zlib.crc32(str(user_id).encode()) % (count or shard_count())
+
+
+# Route the user-scoped queries of the current app context to the user's shard.
+def use_shard(user_id):
+    g.shard = shard_for(user_id)
+    return g.shard
+
+
+# Name of the SQLALCHEMY_BINDS entry holding the given shard.
+def bind_key(shard):
+    return f"shard{shard}"
+
+
+# Engine holding the given shard. With a single shard everything lives in the default database.
+def shard_engine(shard):
+    db = current_app.extensions['sqlalchemy']
+    if shard_count() == 1:
+        return db.engine
+    return db.engines[bind_key(shard)]
+
+
+# Engines of every shard, in shard order.
+def shard_engines():
+    return [shard_engine(shard) for shard in range(shard_count())]
+
+
+# Tables flagged as user-scoped in their model's table info.
+def user_scoped_tables(metadata):
+    return [table for table in metadata.sorted_tables if table.info.get('user_scoped')]
+
+
+# Create the catalog tables in the default database and the user-scoped tables in every shard,
+# and upgrade the ones created by older versions.
+def create_all():
+    db = current_app.extensions['sqlalchemy']
+    if shard_count() == 1:
+        db.metadata.create_all(db.engine)
+        upgrade_tables(db.engine, db.metadata.sorted_tables)
+        return
+
+    user_tables = user_scoped_tables(db.metadata)
+    catalog_tables = [table for table in db.metadata.sorted_tables if table not in user_tables]
+    db.metadata.create_all(db.engine, tables=catalog_tables)
+    upgrade_tables(db.engine, catalog_tables)
+    for engine in shard_engines():
+        db.metadata.create_all(engine, tables=user_tables)
+        upgrade_tables(engine, user_tables)
+
+
+# Add a bind per shard to the app config so Flask-SQLAlchemy creates their engines.
+def configure_binds(app):
+    if app.config['SHARD_COUNT'] == 1:
+        return
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for shard in range(app.config['SHARD_COUNT']):
+        binds[bind_key(shard)] = app.config['SHARD_DATABASE_URI'].format(shard)
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+# Session that sends user-scoped tables to the shard picked by use_shard and
+# everything else (the PrizeType catalog) to the default database.
+class ShardedSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and shard_count() > 1 and self._is_user_scoped(mapper, clause):
+            shard = g.get('shard')
+            if shard is None:
+                raise RuntimeError("No shard selected, call use_shard(user_id) first")
+            return self._db.engines[bind_key(shard)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    # Check whether the mapped class or statement touches a user-scoped table.
+    @staticmethod
+    def _is_user_scoped(mapper, clause):
+        if mapper is not None:
+            return sa.inspect(mapper).local_table.info.get('user_scoped', False)
+        if clause is None:
+            return False
+        if isinstance(clause, sa.Table):
+            tables = [clause]
+        else:
+            tables = find_tables(clause, include_crud=True)
+        return any(getattr(table, 'info', {}).get('user_scoped') for table in tables)
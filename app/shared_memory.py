@@ -0,0 +1,55 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+
+# A named multiprocessing.shared_memory segment shared by every worker process on the host,
+# created by the first to open it, with a lock file guarding it.
+class SharedSegment:
+    def __init__(self, name, size):
+        try:
+            self._memory = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            self._memory = shared_memory.SharedMemory(name)
+        # The segment outlives any one worker; without this the first worker to exit would remove it.
+        resource_tracker.unregister(self._memory._name, 'shared_memory')
+        self.buf = self._memory.buf
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), 'a')
+        self._thread_lock = threading.Lock()
+
+    # Exclusive access to the segment for the duration of a with block.
+    def locked(self):
+        return _FileLock(self._lock_file, self._thread_lock)
+
+    # Detach from the segment, removing it from the host if unlink is set.
+    def close(self, unlink=False):
+        self.buf = None
+        self._memory.close()
+        if unlink:
+            # unlink() unregisters the segment from the resource tracker, so register it back first.
+            resource_tracker.register(self._memory._name, 'shared_memory')
+            self._memory.unlink()
+
+
+# A 64-bit hash that is the same in every process; never 0, which marks an empty slot.
+def stable_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') | 1
+
+
+# Exclusive lock held for the duration of a with block, across processes and threads.
+# flock alone does not exclude threads sharing the same open file, hence the thread lock.
+class _FileLock:
+    def __init__(self, lock_file, thread_lock):
+        self.lock_file = lock_file
+        self.thread_lock = thread_lock
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.thread_lock.release()
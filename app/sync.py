@@ -0,0 +1,60 @@
+import base64
+import json
+from sqlalchemy import tuple_
+from .models import Adventure, ArchivedAdventure, LootBox, Prize
+
+# Tables a client can sync, by the name used in sync tokens and change counters.
+SYNCED_MODELS = {'adventure': Adventure, 'loot_box': LootBox, 'prize': Prize}
+
+
+# Pack the client's position in each table into an opaque token.
+def encode_token(positions):
+    return base64.urlsafe_b64encode(json.dumps(positions, separators=(',', ':')).encode()).decode()
+
+
+# Unpack a token into the (change_seq, id) position reached in each table.
+# No token means nothing has been synced yet. Raises ValueError for a malformed token.
+def decode_token(token):
+    if not token:
+        return {name: [-1, 0] for name in SYNCED_MODELS}
+    positions = json.loads(base64.urlsafe_b64decode(token.encode()))
+    if not isinstance(positions, dict) or set(positions) != set(SYNCED_MODELS):
+        raise ValueError("Invalid sync token")
+    for position in positions.values():
+        if not (isinstance(position, list) and len(position) == 2 and all(isinstance(part, int) for part in position)):
+            raise ValueError("Invalid sync token")
+    return positions
+
+
+# The user's rows of a model created or changed after a position, in change order.
+def _changed_rows(model, user_id, position, limit):
+    return model.query.filter(
+        model.user_id == user_id,
+        tuple_(model.change_seq, model.id) > tuple_(*position),
+    ).order_by(model.change_seq, model.id).limit(limit).all()
+
+
+# The user's adventures, lootboxes and prizes created or changed since the token, at most
+# `limit` per table, with the token to send next time and whether more changes are waiting.
+#
+# Every write stamps its rows with the table's next change counter version (see
+# invalidation.bump_version), so (change_seq, id) only ever grows and a client resumes
+# exactly where it stopped.
+def changes_since(user_id, token, limit):
+    positions = decode_token(token)
+    changes = {}
+    has_more = False
+    for name, model in SYNCED_MODELS.items():
+        rows = _changed_rows(model, user_id, positions[name], limit)
+        if model is Adventure:
+            # Adventures changed since the token may have been archived since. The archiver can move a
+            # row between the two queries, so the same id may come back from both.
+            archived = _changed_rows(ArchivedAdventure, user_id, positions[name], limit)
+            rows = sorted({row.id: row for row in archived + rows}.values(),
+                          key=lambda row: (row.change_seq, row.id))[:limit]
+        if len(rows) == limit:
+            has_more = True
+        if rows:
+            positions[name] = [rows[-1].change_seq, rows[-1].id]
+        changes[name] = rows
+    return changes, encode_token(positions), has_more
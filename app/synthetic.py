@@ -0,0 +1,277 @@
+import random
+import time
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy import func, select, update
+from . import db
+from .game_logic import AdventureManager, LootBoxManager
+from .invalidation import bump_version
+from .leaderboard import LOOTBOX_POINTS, MATERIAL_POINTS
+from .models import Adventure, DropRollup, LeaderboardScore, LootBox, Prize, PrizeType, User
+from .rollups import RESOLUTIONS
+from .sampling import AliasTable
+from .sharding import shard_count, shard_engine, shard_for
+
+RARITIES = ("Common", "Uncommon", "Rare", "Elite", "Legendary")
+
+# Tables loaded by the generator, in insert order; their secondary indexes are dropped during the load.
+LOADED_TABLES = (User.__table__, Adventure.__table__, LootBox.__table__, Prize.__table__,
+                 LeaderboardScore.__table__, DropRollup.__table__)
+
+# Length of the stored timestamp prefix kept by each rollup resolution, and what completes the bucket start.
+BUCKET_PREFIXES = {'day': (10, ' 00:00:00.000000'), 'hour': (13, ':00:00.000000'), 'minute': (16, ':00.000000')}
+
+
+# An INSERT for every column of a table with named parameters, run through executemany on the
+# driver, skipping the per-row parameter processing of a compiled statement. Timestamps must
+# therefore be given in the stored text format.
+def _insert_sql(model_table, preparer):
+    names = [model_column.name for model_column in model_table.columns]
+    sql = (f"INSERT INTO {preparer.format_table(model_table)} ({', '.join(preparer.quote(name) for name in names)}) "
+           f"VALUES ({', '.join(':' + name for name in names)})")
+    if model_table is DropRollup.__table__:
+        # Buckets may already hold drops made before the load.
+        sql += " ON CONFLICT (resolution, bucket, kind, name) DO UPDATE SET count = count + excluded.count"
+    return sql
+
+
+# Fill the database with `users` synthetic users, each with up to `days` days of history,
+# for capacity tests. Returns the number of rows inserted per table.
+#
+# Every user adventures with the real AdventureManager roll and threshold rules, on average
+# once every 1 + gap_days days, and forges each five unused materials into a lootbox with a
+# prize with probability forge_rate, rated with the real LootBoxManager rules. Prizes are
+# drawn like PrizeLeasePool draws them, from the prize types with stock left, and a lootbox
+# gets no prize once its rarity is sold out. Leaderboard scores and drop rollups are counted
+# along the way. Draws come from a generator of their own seeded with `seed`, leaving the
+# random module's, which live requests use, alone.
+#
+# Rows go in with executemany in transactions of about rows_per_commit rows, one shard
+# connection each, with the loaded tables' secondary indexes dropped until the end.
+def generate(users, days, gap_days=0.5, forge_rate=0.9, seed=None, rows_per_commit=1000000, progress=None):
+    rng = random.Random(seed)
+    prize_stock = _prize_catalog()
+    shards = [_ShardLoader(shard, rows_per_commit) for shard in range(shard_count())]
+    start_user_id = max(loader.next_ids['user'] for loader in shards)
+    now = time.time()
+    history_start = now - days * 86400
+
+    try:
+        for loader in shards:
+            loader.drop_indexes()
+        for user_id in range(start_user_id, start_user_id + users):
+            loader = shards[shard_for(user_id, len(shards))]
+            _generate_user(loader, rng, user_id, history_start, now, gap_days, forge_rate, prize_stock)
+            if progress and (user_id - start_user_id + 1) % 1000 == 0:
+                progress(sum(loader.inserted + loader.pending() for loader in shards))
+        for loader in shards:
+            loader.flush_rollups()
+            loader.flush()
+            loader.commit()
+    finally:
+        for loader in shards:
+            loader.close()
+
+    inserted = Counter()
+    for loader in shards:
+        inserted.update(loader.inserted_by_table)
+    return inserted
+
+
+# Roll one user's whole history into the loader's buffers.
+def _generate_user(loader, rng, user_id, history_start, now, gap_days, forge_rate, prize_stock):
+    user = SimpleNamespace(id=user_id, current_threshold=500, reset_threshold=500)
+    adventure_manager = AdventureManager(user)
+    determine_material = adventure_manager._determine_material
+    update_threshold = adventure_manager._update_user_threshold
+    lootbox_rarity = LootBoxManager(user, [])._determine_lootbox_rarity
+    adventures, lootboxes, prizes = loader.rows['adventure'], loader.rows['loot_box'], loader.rows['prize']
+    drops = loader.drops
+    score = 0
+    unused = []
+
+    moment = history_start + rng.random() * 86400
+    while moment < now:
+        # The roll of AdventureManager._generate_random_number.
+        rng_score = rng.randint(1, user.current_threshold)
+        material = determine_material(rng_score)
+        update_threshold(material)
+        timestamp = datetime.utcfromtimestamp(moment).isoformat(' ', 'microseconds')
+        adventure = {
+            'id': loader.next_id('adventure'), 'timestamp': timestamp, 'rng_score': rng_score, 'material': material,
+            'status': "No Material" if material == "None" else "Unused Material", 'user_id': user_id, 'change_seq': 0,
+        }
+        adventures.append(adventure)
+        drops[('material', material, timestamp)] += 1
+        score += MATERIAL_POINTS.get(material, 0)
+
+        if material != "None":
+            unused.append(adventure)
+            if len(unused) == 5 and rng.random() < forge_rate:
+                rarity = lootbox_rarity(sum(row['rng_score'] for row in unused))
+                for row in unused:
+                    row['status'] = "Used Material"
+                unused = []
+                forged_at = datetime.utcfromtimestamp(moment + rng.randint(1, 3600)).isoformat(' ', 'microseconds')
+                lootboxes.append({'id': loader.next_id('loot_box'), 'timestamp': forged_at, 'rarity': rarity,
+                                  'user_id': user_id, 'change_seq': 0})
+                prize_type_id = prize_stock[rarity].draw(rng)
+                if prize_type_id is not None:
+                    prizes.append({'id': loader.next_id('prize'), 'user_id': user_id, 'prize_type_id': prize_type_id,
+                                   'timestamp': forged_at, 'lease_id': None, 'change_seq': 0})
+                drops[('lootbox', rarity, forged_at)] += 1
+                score += LOOTBOX_POINTS[rarity]
+            elif len(unused) == 5:
+                # Hoarded materials stay unused.
+                unused = []
+
+        # At least a day between adventures, like AdventureManager.is_eligible enforces.
+        moment += 86400 * (1 + rng.expovariate(1 / gap_days) if gap_days else 1)
+
+    loader.rows['user'].append({
+        'id': user_id, 'username': f"user{user_id}", 'email': f"user{user_id}@example.com", 'NFTno': user_id,
+        'password': "synthetic", 'current_threshold': user.current_threshold, 'reset_threshold': user.reset_threshold,
+    })
+    if score:
+        loader.rows['leaderboard_score'].append({'user_id': user_id, 'score': score, 'change_seq': loader.score_seq})
+    if loader.pending() >= 100000:
+        loader.flush()
+
+
+# The prize stock of each rarity, creating one plentiful prize type for each rarity without any.
+def _prize_catalog():
+    prize_types = {rarity: [] for rarity in RARITIES}
+    for prize_type_id, rarity, available, weight in db.session.execute(
+            select(PrizeType.id, PrizeType.rarity, PrizeType.quanity - PrizeType.number_claimed, PrizeType.weight)):
+        prize_types.setdefault(rarity, []).append((prize_type_id, available, weight))
+    for rarity, rows in prize_types.items():
+        if not rows:
+            prize_type = PrizeType(name=f"Synthetic {rarity} prize", rarity=rarity, quanity=10 ** 9)
+            db.session.add(prize_type)
+            db.session.flush()
+            rows.append((prize_type.id, prize_type.quanity, None))
+    db.session.commit()
+    return {rarity: _PrizeStock(rows) for rarity, rows in prize_types.items()}
+
+
+# The units of one rarity's prize types left when the load started, drawn from with an alias
+# table weighted like PrizeLeasePool's: by each type's configured odds, or by its remaining
+# stock. A prize type that runs out is dropped from the table.
+class _PrizeStock:
+    def __init__(self, rows):
+        self.remaining = {prize_type_id: available for prize_type_id, available, _ in rows if available > 0}
+        self.weights = {prize_type_id: available if weight is None else weight
+                        for prize_type_id, available, weight in rows if available > 0 and (weight is None or weight > 0)}
+        self._build_table()
+
+    # Take a unit of a prize type with stock left, or None if the rarity is sold out.
+    def draw(self, rng):
+        if self.table is None:
+            return None
+        prize_type_id = self.table.sample(rng.random)
+        self.remaining[prize_type_id] -= 1
+        if not self.remaining[prize_type_id]:
+            del self.weights[prize_type_id]
+            self._build_table()
+        return prize_type_id
+
+    def _build_table(self):
+        self.table = AliasTable(list(self.weights), list(self.weights.values())) if self.weights else None
+
+
+# Buffers one shard's generated rows and writes them on its own connection.
+class _ShardLoader:
+    def __init__(self, shard, rows_per_commit):
+        self.rows_per_commit = rows_per_commit
+        self.engine = shard_engine(shard)
+        self.conn = self.engine.connect()
+        # Durability does not matter for generated data; syncing every commit would dominate the load.
+        self.synchronous = self.conn.exec_driver_sql("PRAGMA synchronous").scalar()
+        self.conn.exec_driver_sql("PRAGMA synchronous=OFF")
+        self.next_ids = {
+            name: (self.conn.execute(select(func.max(model.id))).scalar() or 0) + 1
+            for name, model in (('user', User), ('adventure', Adventure), ('loot_box', LootBox), ('prize', Prize))
+        }
+        # Workers pick up the new scores once the change counter passes their watermark.
+        self.score_seq = bump_version('leaderboard_score', self.conn)
+        self.rows = {model_table.name: [] for model_table in LOADED_TABLES}
+        self.statements = {model_table.name: _insert_sql(model_table, self.conn.dialect.identifier_preparer)
+                           for model_table in LOADED_TABLES}
+        self.drops = Counter()
+        self.inserted_by_table = Counter()
+        self.inserted = 0
+        self.uncommitted = 0
+
+    def next_id(self, name):
+        next_id = self.next_ids[name]
+        self.next_ids[name] = next_id + 1
+        return next_id
+
+    def pending(self):
+        return sum(len(rows) for rows in self.rows.values())
+
+    def flush(self):
+        self._claim_prizes()
+        for model_table in LOADED_TABLES:
+            rows = self.rows[model_table.name]
+            if not rows:
+                continue
+            self.conn.exec_driver_sql(self.statements[model_table.name], rows)
+            self.inserted_by_table[model_table.name] += len(rows)
+            self.inserted += len(rows)
+            self.uncommitted += len(rows)
+            rows.clear()
+        if self.uncommitted >= self.rows_per_commit:
+            self.commit()
+
+    # Count the buffered prizes against their prize types' stock before writing them, with the
+    # guard PrizeLeasePool reserves with, so number_claimed never passes quanity even if live
+    # workers took stock since the load started. With a single shard the catalog is in the
+    # shard's database, so the claim goes in the load's own transaction.
+    def _claim_prizes(self):
+        counts = Counter(row['prize_type_id'] for row in self.rows['prize'])
+        if not counts:
+            return
+        with nullcontext(self.conn) if self.engine is db.engine else db.engine.begin() as conn:
+            for prize_type_id, count in counts.items():
+                claimed = conn.execute(
+                    update(PrizeType)
+                    .where(PrizeType.id == prize_type_id, PrizeType.number_claimed + count <= PrizeType.quanity)
+                    .values(number_claimed=PrizeType.number_claimed + count)
+                ).rowcount
+                if not claimed:
+                    raise RuntimeError(f"Prize type {prize_type_id} ran out of stock during the load")
+
+    # Fold the drops counted per timestamp into the minute, hour and day buckets.
+    def flush_rollups(self):
+        buckets = Counter()
+        for (kind, name, timestamp), count in self.drops.items():
+            for resolution, _, _ in RESOLUTIONS:
+                length, suffix = BUCKET_PREFIXES[resolution]
+                buckets[(resolution, timestamp[:length] + suffix, kind, name)] += count
+        self.rows['drop_rollup'] = [
+            {'resolution': resolution, 'bucket': bucket, 'kind': kind, 'name': name, 'count': count}
+            for (resolution, bucket, kind, name), count in buckets.items()
+        ]
+        self.drops.clear()
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def drop_indexes(self):
+        for model_table in LOADED_TABLES:
+            for index in model_table.indexes:
+                index.drop(self.conn, checkfirst=True)
+        self.conn.commit()
+
+    # Rebuild the indexes once the rows are in, which is much faster than maintaining them row by row.
+    def close(self):
+        for model_table in LOADED_TABLES:
+            for index in model_table.indexes:
+                index.create(self.conn, checkfirst=True)
+        self.conn.exec_driver_sql(f"PRAGMA synchronous={self.synchronous}")
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,121 @@
+import threading
+import time
+from array import array
+
+
+# A hierarchical timing wheel holding (id, deadline) pairs in flat arrays of 64-bit ints,
+# 16 bytes per deadline, so millions of them fit comfortably in memory.
+#
+# Level 0 has one slot per tick; each higher level's slot spans a whole turn of the level
+# below. Deadlines go in the lowest level whose range covers them and move down a level
+# each time the wheel below completes a turn, so advancing costs O(1) per tick plus
+# O(1) per deadline per level.
+class TimingWheel:
+    def __init__(self, tick=1.0, slots=256, levels=4, now=None):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current = int((time.time() if now is None else now) // tick)
+        self.wheels = [[array('q') for _ in range(slots)] for _ in range(levels)]
+        self.overflow = array('q')
+        self.count = 0
+
+    # Schedule an id at a time in seconds. Returns True if the deadline has already passed.
+    def add(self, item_id, deadline):
+        due = []
+        self._place(item_id, -int(-deadline // self.tick), due)
+        return bool(due)
+
+    # Move the wheel forward to `now`, returning the ids whose deadlines have passed.
+    def advance(self, now):
+        target = int(now // self.tick)
+        due = []
+        while self.current < target:
+            self.current += 1
+            self._cascade(1, due)
+            slot = self.wheels[0][self.current % self.slots]
+            if slot:
+                due.extend(slot[0::2])
+                self.count -= len(slot) // 2
+                del slot[:]
+        return due
+
+    # Put a deadline in the lowest level that covers it, or in `due` if it has passed.
+    def _place(self, item_id, deadline_tick, due):
+        delta = deadline_tick - self.current
+        if delta <= 0:
+            due.append(item_id)
+            return
+        self.count += 1
+        for level in range(self.levels):
+            span = self.slots ** level
+            if delta < span * self.slots:
+                self.wheels[level][(deadline_tick // span) % self.slots].extend((item_id, deadline_tick))
+                return
+        # Beyond the top level: parked until the top level completes a turn.
+        self.overflow.extend((item_id, deadline_tick))
+
+    # When the wheel below a level completes a turn, move the level's next slot down.
+    def _cascade(self, level, due):
+        if self.current % self.slots ** level:
+            return
+        if level == self.levels:
+            entries, self.overflow = self.overflow, array('q')
+        else:
+            self._cascade(level + 1, due)
+            slot_index = (self.current // self.slots ** level) % self.slots
+            entries = self.wheels[level][slot_index]
+            self.wheels[level][slot_index] = array('q')
+        self.count -= len(entries) // 2
+        for index in range(0, len(entries), 2):
+            self._place(entries[index], entries[index + 1], due)
+
+
+# The EligibilityNotifier parks callers until a user's next adventure is allowed, so clients
+# wait on one connection instead of polling POST /adventure.
+#
+# Each user waiting is put in the timing wheel once; a background thread advances the wheel
+# every tick and wakes all of that user's waiters together.
+class EligibilityNotifier:
+    def __init__(self, app):
+        self.app = app
+        self.wheel = TimingWheel(tick=app.config['ELIGIBILITY_WHEEL_TICK_SECONDS'])
+        self._waiters = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    # Register interest in a user becoming eligible at `deadline` (seconds since the epoch).
+    # Returns an event that is set at the deadline; pass it to `forget` when done.
+    def subscribe(self, user_id, deadline):
+        event = threading.Event()
+        with self._lock:
+            self._start()
+            waiters = self._waiters.get(user_id)
+            if waiters is None:
+                # Already due: nothing to wait for, so no waiter set is kept for the wheel to clear.
+                if self.wheel.add(user_id, deadline):
+                    event.set()
+                    return event
+                waiters = self._waiters[user_id] = set()
+            waiters.add(event)
+        return event
+
+    # Drop a subscription, e.g. when the client disconnected or timed out.
+    def forget(self, user_id, event):
+        with self._lock:
+            waiters = self._waiters.get(user_id)
+            if waiters is not None:
+                waiters.discard(event)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='eligibility-notifier', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.wheel.tick)
+            with self._lock:
+                for user_id in self.wheel.advance(time.time()):
+                    for event in self._waiters.pop(user_id, ()):
+                        event.set()
@@ -0,0 +1,20 @@
+import argparse
+import time
+from app import create_app
+from app.archive import archive_adventures
+from app.idempotency import prune_idempotency_keys
+
+parser = argparse.ArgumentParser(description="Move old empty and used adventures into the archive tables "
+                                             "and prune expired idempotency keys.")
+parser.add_argument('--every', type=float, help="keep running in the background, archiving every EVERY seconds")
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    while True:
+        print(f"Archived {archive_adventures()} adventures")
+        print(f"Pruned {prune_idempotency_keys()} idempotency keys")
+        if args.every is None:
+            break
+        time.sleep(args.every)
@@ -0,0 +1,76 @@
+import argparse
+import os
+import tempfile
+import time
+from multiprocessing import Pool
+from sqlalchemy.exc import OperationalError
+from config import Config
+from app import create_app, db
+from app.game_logic import AdventureManager
+from app.metrics import metrics
+from app.models import User
+from app.sharding import create_all, use_shard
+
+parser = argparse.ArgumentParser(description="Hammer one database with concurrent adventure writers and report "
+                                             "how many writes failed on lock errors, with and without retries.")
+parser.add_argument('--writers', type=int, default=16)
+parser.add_argument('--writes', type=int, default=200, help="adventures each writer creates")
+parser.add_argument('--busy-timeout', type=float, default=5.0,
+                    help="seconds SQLite waits for a lock before reporting it; lower it to provoke more conflicts")
+parser.add_argument('--attempts', type=int, nargs='+', default=[1, 5], help="WRITE_RETRY_ATTEMPTS values to compare")
+args = parser.parse_args()
+
+
+def make_app(directory, attempts):
+    config = type('ContentionConfig', (Config,), {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'contention.db')}",
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': args.busy_timeout}},
+        'LEADERBOARD_SNAPSHOT_PATH': os.path.join(directory, 'leaderboard.snapshot'),
+        'WRITE_RETRY_ATTEMPTS': attempts,
+    })
+    return create_app(config)
+
+
+def setup(directory):
+    app = make_app(directory, 1)
+    with app.app_context():
+        create_all()
+        for user_id in range(1, args.writers + 1):
+            use_shard(user_id)
+            db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com", NFTno=user_id, password="contention"))
+        db.session.commit()
+
+
+# Create adventures for one user as fast as possible, counting the writes that failed.
+def writer(job):
+    directory, attempts, user_id = job
+    app = make_app(directory, attempts)
+    failed = 0
+    with app.app_context():
+        use_shard(user_id)
+        for _ in range(args.writes):
+            try:
+                AdventureManager(db.session.get(User, user_id)).create()
+            except OperationalError:
+                db.session.rollback()
+                failed += 1
+    return failed, metrics.snapshot()
+
+
+if __name__ == '__main__':
+    for attempts in args.attempts:
+        with tempfile.TemporaryDirectory() as directory:
+            setup(directory)
+            started = time.perf_counter()
+            with Pool(args.writers) as pool:
+                results = pool.map(writer, [(directory, attempts, user_id) for user_id in range(1, args.writers + 1)])
+            elapsed = time.perf_counter() - started
+        failed = sum(result[0] for result in results)
+        counters = {}
+        for _, snapshot in results:
+            for name, count in snapshot.items():
+                if name.startswith('retry.'):
+                    counters[name] = counters.get(name, 0) + count
+        total = args.writers * args.writes
+        print(f"{attempts} attempt(s): {total - failed}/{total} writes succeeded in {elapsed:.1f}s, {failed} failed; "
+              + (', '.join(f"{name}={count}" for name, count in sorted(counters.items())) or "no retries"))
@@ -0,0 +1,64 @@
+import argparse
+import os
+import tempfile
+import time
+from multiprocessing import Pool
+from config import Config
+from app import create_app, db
+from app.game_logic import AdventureManager
+from app.models import User
+from app.sharding import create_all, use_shard
+
+parser = argparse.ArgumentParser(description="Measure adventure write throughput for different shard counts.")
+parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+parser.add_argument('--workers', type=int, default=8)
+parser.add_argument('--users', type=int, default=64)
+parser.add_argument('--seconds', type=float, default=5.0)
+args = parser.parse_args()
+
+
+# Build an app whose default database and shards live in the given directory.
+def make_app(directory, shards):
+    config = type('BenchmarkConfig', (Config,), {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'catalog.db')}",
+        'SHARD_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'shard{}.db')}",
+        'SHARD_COUNT': shards,
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30}},
+    })
+    return create_app(config)
+
+
+# Create the databases and the benchmark users.
+def setup(directory, shards):
+    app = make_app(directory, shards)
+    with app.app_context():
+        create_all()
+        for user_id in range(1, args.users + 1):
+            use_shard(user_id)
+            db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com", NFTno=user_id, password="benchmark"))
+            db.session.commit()
+
+
+# Write adventures for the worker's slice of users until time runs out.
+def worker(job):
+    directory, shards, worker_id = job
+    app = make_app(directory, shards)
+    writes = 0
+    with app.app_context():
+        deadline = time.perf_counter() + args.seconds
+        user_ids = list(range(worker_id + 1, args.users + 1, args.workers))
+        while time.perf_counter() < deadline:
+            user_id = user_ids[writes % len(user_ids)]
+            use_shard(user_id)
+            AdventureManager(db.session.get(User, user_id)).create()
+            writes += 1
+    return writes
+
+
+if __name__ == '__main__':
+    for shards in args.shards:
+        with tempfile.TemporaryDirectory() as directory:
+            setup(directory, shards)
+            with Pool(args.workers) as pool:
+                writes = sum(pool.map(worker, [(directory, shards, worker_id) for worker_id in range(args.workers)]))
+            print(f"{shards:>3} shard(s): {writes / args.seconds:10.0f} adventures/s")
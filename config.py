@@ -1,3 +1,146 @@
+import os
+
 class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///site.db'
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Key used to seal pre-rolled adventure outcomes.
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'dev')
+    # Number of users pre-rolled per batch by preroll.py.
+    PREROLL_CHUNK_SIZE = 5000
+    # Number of databases the user-scoped tables are sharded across by user id.
+    # With 1 everything stays in SQLALCHEMY_DATABASE_URI, which always holds the PrizeType catalog.
+    SHARD_COUNT = 1
+    # URI of each shard database, formatted with the shard number.
+    SHARD_DATABASE_URI = 'sqlite:///site_shard{}.db'
+    # Prize units a worker reserves from a PrizeType row at a time, and for how long.
+    PRIZE_LEASE_SIZE = 10
+    PRIZE_LEASE_SECONDS = 300
+    # Time after expiry before other workers reclaim a lease's unused units, long enough
+    # for the owner's transactions still using the lease to finish.
+    PRIZE_LEASE_GRACE_SECONDS = 60
+    # How often each worker returns the unused units of expired leases, its own and abandoned ones.
+    PRIZE_LEASE_RECLAIM_SECONDS = 60
+    # Longest a cached per-rarity prize selection table is used before it is rebuilt.
+    PRIZE_WEIGHTS_SECONDS = 30
+    # Empty and used adventures older than this move to the archive tables.
+    ARCHIVE_RETENTION_DAYS = 30
+    # Adventures moved per archive transaction, and the pause between transactions
+    # so the archiver does not hold the write lock for long.
+    ARCHIVE_CHUNK_SIZE = 1000
+    ARCHIVE_PAUSE_SECONDS = 0.1
+    # Longest a worker trusts its view of other workers' writes before re-checking the database.
+    INVALIDATION_POLL_SECONDS = 0.005
+    # Recently written users whose cache version each worker tracks per shard. Users written
+    # longer ago share one version, so their cached reads are dropped when it moves.
+    INVALIDATION_MAX_USERS = 100000
+    # Cache backend: 'lru' (per process), 'shared_memory' (per host) or 'redis'.
+    CACHE_BACKEND = 'lru'
+    CACHE_MAX_ENTRIES = 10000
+    # Bytes the lru backend holds at most, and the largest value it stores; bigger ones,
+    # such as a long unpaginated history, are rebuilt on every request.
+    CACHE_MAX_BYTES = 64 * 1024 * 1024
+    CACHE_MAX_ENTRY_BYTES = 1024 * 1024
+    CACHE_DEFAULT_TTL = 60
+    # Name of the shared memory segment and bytes per entry for the shared_memory backend.
+    CACHE_SHARED_MEMORY_NAME = 'projectpurple_cache'
+    CACHE_SLOT_SIZE = 2048
+    CACHE_REDIS_URL = 'redis://localhost:6379/0'
+    # Seconds to wait on the Redis server before treating the cache as unavailable.
+    CACHE_REDIS_TIMEOUT = 0.5
+    # How often each worker loads newly created user ids into its existence bitmap.
+    # Ids it has not loaded yet are looked up in the database, so this only saves queries.
+    EXISTENCE_REFRESH_SECONDS = 5
+    # Ids confirmed missing in the database, remembered to skip repeat lookups. A user created
+    # after its id was looked up is reported missing until the next refresh loads it, or for up
+    # to NEGATIVE_CACHE_TTL if its id is below ids already loaded.
+    NEGATIVE_CACHE_SIZE = 100000
+    NEGATIVE_CACHE_TTL = 60
+    # Granularity of the timing wheel waking clients parked on a user's eligibility.
+    ELIGIBILITY_WHEEL_TICK_SECONDS = 1.0
+    # Longest a long-poll eligibility request is held, and how often an event stream sends a keepalive.
+    ELIGIBILITY_MAX_WAIT_SECONDS = 60
+    ELIGIBILITY_KEEPALIVE_SECONDS = 15
+    # Rows fetched per round trip when streaming a lootbox or prize listing.
+    LISTING_STREAM_CHUNK_SIZE = 1000
+    # Where each worker saves its copy of the leaderboard, how often, and how many scores it
+    # reads per round trip when catching up with the database.
+    LEADERBOARD_SNAPSHOT_PATH = 'leaderboard.snapshot'
+    LEADERBOARD_SNAPSHOT_SECONDS = 300
+    LEADERBOARD_STREAM_CHUNK_SIZE = 10000
+    # How often a streaming event feed checks for new events once caught up, and how long
+    # one stream stays open before the consumer has to reconnect with its cursor.
+    EVENT_FEED_POLL_SECONDS = 1.0
+    EVENT_STREAM_MAX_SECONDS = 300
+    # Token admin endpoints, /metrics included, require in the X-Admin-Token header.
+    # Admin endpoints are off when unset.
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+    # Rows read per round trip by exports, and the gzip level of compressed exports.
+    EXPORT_CHUNK_SIZE = 10000
+    EXPORT_GZIP_LEVEL = 1
+    # Opt-in recording of sampled requests for replay.py: the log path, formatted with each
+    # worker's pid (recording is off when unset), the share of users whose requests are
+    # recorded, and the size at which a log rolls over and how many old logs are kept.
+    REQUEST_LOG_PATH = os.environ.get('REQUEST_LOG_PATH')
+    REQUEST_LOG_SAMPLE_RATE = 0.01
+    REQUEST_LOG_MAX_BYTES = 64 * 1024 * 1024
+    REQUEST_LOG_BACKUPS = 4
+    # How long responses to writes sent with an Idempotency-Key are kept for retries
+    # before archive.py prunes them.
+    IDEMPOTENCY_KEY_TTL_HOURS = 24
+    # Token-bucket rate limits per main blueprint endpoint, per user id and optionally per client
+    # IP, as (requests, seconds): up to `requests` at once, refilled at requests/seconds per second.
+    # Add an 'ip' entry, e.g. 'ip': (300, 60), only where the client address can be told apart:
+    # behind a reverse proxy every request comes from the proxy unless RATE_LIMIT_TRUSTED_PROXIES is set.
+    RATE_LIMITS = {
+        'adventure_endpoint': {'user': (5, 60)},
+        'create_lootbox': {'user': (10, 60)},
+    }
+    # Number of reverse proxies in front of the app whose X-Forwarded-For entries are trusted
+    # for the client address. 0 uses the address of the connection.
+    RATE_LIMIT_TRUSTED_PROXIES = 0
+    # Rate limiter storage: 'memory' (per process) or 'shared_memory' (per host), and its number
+    # of 16-byte buckets. A bucket is reused once it has refilled, so this bounds the keys
+    # limited at the same time, not the keys ever seen.
+    RATE_LIMIT_BACKEND = 'memory'
+    RATE_LIMIT_SLOTS = 1 << 20
+    RATE_LIMIT_SHARED_MEMORY_NAME = 'projectpurple_rate_limit'
+    # Per main blueprint endpoint, how many requests a worker runs at once and how many more
+    # may queue, as (limit, queue size). Endpoints not listed are not limited. Parked
+    # eligibility long polls and streams hold a worker thread each for as long as they wait,
+    # so they get a share of the threads without a queue: keep their limit well below the
+    # worker's thread count, so waiters can never starve POST /adventure.
+    BULKHEADS = {
+        'get_user_eligibility': (32, 0),
+        'adventure_endpoint': (16, 64),
+        'create_lootbox': (8, 32),
+        'get_materials_summary': (8, 32),
+        'get_adventure_history': (4, 16),
+        'get_user_state': (8, 32),
+        'get_user_sync': (4, 16),
+        'get_lootboxes': (4, 16),
+        'get_prizes': (4, 16),
+    }
+    # Longest a request queues for its bulkhead before it is shed, and the Retry-After sent when it is.
+    BULKHEAD_MAX_WAIT_SECONDS = 1.0
+    BULKHEAD_RETRY_AFTER_SECONDS = 1
+    # Time budget of a request, counted from its arrival, after which its running SQLite
+    # statement is interrupted and it gets a 504; overridden per main blueprint endpoint in
+    # ROUTE_DEADLINE_SECONDS, where None means no deadline. Parked long polls and streams
+    # run for minutes by design.
+    REQUEST_DEADLINE_SECONDS = 5.0
+    ROUTE_DEADLINE_SECONDS = {
+        'get_user_eligibility': None,
+        'get_events': None,
+        'export_endpoint': None,
+        'get_lootboxes': 60.0,
+        'get_prizes': 60.0,
+    }
+    # SQLite virtual machine instructions between deadline checks, and how many cancelled
+    # statements each worker keeps for GET /admin/cancelled_queries.
+    DEADLINE_CHECK_INSTRUCTIONS = 1000
+    CANCELLED_QUERY_LOG_SIZE = 100
+    # Attempts at a manager's write transaction when SQLite reports a lock conflict, and the
+    # base and longest backoff between attempts.
+    WRITE_RETRY_ATTEMPTS = 5
+    WRITE_RETRY_BASE_SECONDS = 0.01
+    WRITE_RETRY_MAX_SECONDS = 0.5
@@ -0,0 +1,24 @@
+import argparse
+import sys
+import time
+from app import create_app
+from app.export import EXPORT_FORMATS, EXPORTS, export_table
+
+parser = argparse.ArgumentParser(description="Stream a whole table from every shard, e.g. for audits.")
+parser.add_argument('table', choices=list(EXPORTS))
+parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+parser.add_argument('--gzip', action='store_true', help="gzip the output")
+parser.add_argument('--output', help="file to write to instead of standard output")
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    started = time.monotonic()
+    written = 0
+    for chunk in export_table(args.table, args.format, args.gzip):
+        output.write(chunk)
+        written += len(chunk)
+    output.flush()
+    print(f"Exported {args.table}: {written} bytes in {time.monotonic() - started:.1f}s", file=sys.stderr)
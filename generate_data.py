@@ -0,0 +1,29 @@
+import argparse
+import sys
+import time
+from app import create_app
+from app.sharding import create_all
+from app.synthetic import generate
+
+parser = argparse.ArgumentParser(description="Fill the database with synthetic users and their history for capacity tests.")
+parser.add_argument('--users', type=int, default=10000)
+parser.add_argument('--days', type=int, default=3 * 365, help="length of each user's history")
+parser.add_argument('--gap-days', type=float, default=0.5, help="average extra days between a user's adventures")
+parser.add_argument('--forge-rate', type=float, default=0.9, help="chance five unused materials are forged")
+parser.add_argument('--seed', type=int)
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    create_all()
+    started = time.monotonic()
+    def progress(rows):
+        elapsed = time.monotonic() - started
+        print(f"\r{rows} rows, {rows / elapsed:,.0f} rows/s", end='', file=sys.stderr)
+    inserted = generate(args.users, args.days, args.gap_days, args.forge_rate, args.seed, progress=progress)
+    elapsed = time.monotonic() - started
+    total = sum(inserted.values())
+    print(f"\nInserted {total} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s):", file=sys.stderr)
+    for table_name, count in inserted.items():
+        print(f"  {table_name}: {count}", file=sys.stderr)
@@ -1,6 +1,8 @@
-from app import create_app, db
+from app import create_app
+from app.sharding import create_all
 
+# Create the tables, or bring the tables of a database made by an older version up to date.
 app = create_app()
 
 with app.app_context():
-    db.create_all()
+    create_all()
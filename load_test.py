@@ -0,0 +1,321 @@
+import argparse
+import http.client
+import json
+import math
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+# What each simulated request does, given the client and a user id. Forging is the client's
+# whole action: a sync to find five unused materials, then the POST.
+ACTIONS = {
+    'adventure': lambda client, user_id: client.post('/adventure', {'user_id': user_id}),
+    'forge_lootbox': lambda client, user_id: forge_lootbox(client, user_id),
+    'materials_summary': lambda client, user_id: client.get(f'/materials_summary?user_id={user_id}'),
+    'adventure_history': lambda client, user_id: client.get(f'/adventure_history?user_id={user_id}&limit=20'),
+    'state': lambda client, user_id: client.get(f'/users/{user_id}/state'),
+    'sync': lambda client, user_id: client.get(f'/users/{user_id}/sync'),
+    'eligibility': lambda client, user_id: client.get(f'/users/{user_id}/eligibility?timeout=0'),
+    'lootboxes': lambda client, user_id: client.get(f'/lootboxes?user_id={user_id}'),
+    'prizes': lambda client, user_id: client.get(f'/prizes?user_id={user_id}'),
+    'leaderboard': lambda client, user_id: client.get('/leaderboard'),
+    'rank': lambda client, user_id: client.get(f'/users/{user_id}/rank'),
+    'drops': lambda client, user_id: client.get('/analytics/drops?window=3600'),
+    'events': lambda client, user_id: client.get('/events?limit=100'),
+}
+
+# The steady background of clients polling their screens.
+READ_MIX = 'state=4,eligibility=4,materials_summary=2,adventure_history=2,sync=2,lootboxes=1,prizes=1,leaderboard=1,rank=1'
+
+# A day of traffic compressed into a few minutes, as (seconds, requests/s, mix) phases:
+# constant polling, the midnight rush of adventures as everyone becomes eligible, and bursts
+# of forging once materials pile up. Every request comes from this one address, so run it
+# against an instance without per-IP rate limits or the midnight rush is mostly 429s.
+DAILY_SHAPE = [
+    (60, 50, READ_MIX),
+    (30, 400, 'adventure=6,eligibility=2,state=2'),
+    (60, 50, READ_MIX),
+    (15, 150, 'forge_lootbox=3,' + READ_MIX),
+    (60, 50, READ_MIX),
+    (15, 150, 'forge_lootbox=3,' + READ_MIX),
+]
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+parser = argparse.ArgumentParser(description="Replay a traffic shape against a running instance at a constant arrival rate "
+                                             "and report coordinated-omission-corrected latency percentiles.")
+parser.add_argument('--url', default='http://127.0.0.1:5000')
+parser.add_argument('--phase', action='append', metavar='SECONDS:RATE[:MIX]',
+                    help="a phase of the shape, e.g. 30:400:adventure=6,state=2; repeat for more phases "
+                         "(default: a compressed day of traffic)")
+parser.add_argument('--rate-scale', type=float, default=1.0, help="multiply every phase's request rate")
+parser.add_argument('--time-scale', type=float, default=1.0, help="multiply every phase's length")
+parser.add_argument('--users', type=int, default=10000, help="requests go to user ids 1 to USERS")
+parser.add_argument('--threads', type=int, default=64, help="requests in flight at most")
+parser.add_argument('--timeout', type=float, default=30.0)
+parser.add_argument('--seed', type=int)
+parser.add_argument('--output', default='load_test_results', help="directory for the .hgrm histograms")
+
+
+# A histogram of microsecond latencies in the HdrHistogram layout: exact below 2048, then
+# buckets doubling in width with 1024 sub-buckets each, so every value is kept to three
+# significant digits in a few thousand counters whatever the range.
+class LatencyHistogram:
+    SUB_BUCKETS = 2048
+    SUB_BUCKET_BITS = 11
+    HALF = SUB_BUCKETS // 2
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.total = 0
+        self.sum = 0
+        self.sum_of_squares = 0
+        self.max = 0
+
+    def record(self, value):
+        value = max(int(value), 0)
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.sum += value
+        self.sum_of_squares += value * value
+        self.max = max(self.max, value)
+
+    def add(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        self.sum_of_squares += other.sum_of_squares
+        self.max = max(self.max, other.max)
+
+    # The highest value recorded at or below the given percentile, like HdrHistogram reports it.
+    def value_at(self, percentile):
+        wanted = max(math.ceil(percentile / 100 * self.total), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= wanted:
+                return min(self._highest(index), self.max)
+        return self.max
+
+    # (value, percentile, total count) lines, five per halving of the distance to 100%.
+    def distribution(self, ticks_per_half_distance=5):
+        lines = []
+        level = 0.0
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            value = min(self._highest(index), self.max)
+            # Past the last value, stop once the remaining distance holds less than one value.
+            while level < 100 and seen >= level / 100 * self.total and (seen < self.total or (100 - level) / 100 * self.total >= 1):
+                lines.append((value, level / 100, seen))
+                half_distance = 2 ** (int(math.log2(100 / (100 - level))) + 1)
+                level += 100 / (ticks_per_half_distance * half_distance)
+        lines.append((self.max, 1.0, self.total))
+        return lines
+
+    # Write the percentile distribution in HdrHistogram's .hgrm text format, in milliseconds.
+    def write(self, path):
+        with open(path, 'w') as hgrm:
+            hgrm.write(f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>14}\n\n")
+            for value, percentile, count in self.distribution():
+                if percentile < 1:
+                    hgrm.write(f"{value / 1000:12.3f} {percentile:14.12f} {count:10d} {1 / (1 - percentile):14.2f}\n")
+                else:
+                    hgrm.write(f"{value / 1000:12.3f} {percentile:14.12f} {count:10d}\n")
+            mean = self.sum / self.total if self.total else 0
+            deviation = math.sqrt(max(self.sum_of_squares / self.total - mean * mean, 0)) if self.total else 0
+            buckets = max(self.max.bit_length() - self.SUB_BUCKET_BITS, 0) + 1
+            hgrm.write(f"#[Mean    = {mean / 1000:12.3f}, StdDeviation   = {deviation / 1000:12.3f}]\n")
+            hgrm.write(f"#[Max     = {self.max / 1000:12.3f}, Total count    = {self.total:12d}]\n")
+            hgrm.write(f"#[Buckets = {buckets:12d}, SubBuckets     = {self.SUB_BUCKETS:12d}]\n")
+
+    # Values below SUB_BUCKETS count exactly; above, a value's top SUB_BUCKET_BITS bits pick its sub-bucket.
+    def _index(self, value):
+        bucket = max(value.bit_length() - self.SUB_BUCKET_BITS, 0)
+        if not bucket:
+            return value
+        return self.SUB_BUCKETS + (bucket - 1) * self.HALF + (value >> bucket) - self.HALF
+
+    def _highest(self, index):
+        if index < self.SUB_BUCKETS:
+            return index
+        bucket, sub_bucket = divmod(index - self.SUB_BUCKETS, self.HALF)
+        bucket += 1
+        return ((sub_bucket + self.HALF + 1) << bucket) - 1
+
+
+# One keep-alive connection per worker thread, reopened after any failure.
+class Client:
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.connection = None
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def post(self, path, payload):
+        return self.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+
+    # The response's status and decoded JSON body, if any.
+    def request(self, method, path, body=None, headers=None):
+        if self.connection is None:
+            self.connection = self.connection_class(self.netloc, timeout=self.timeout)
+        try:
+            self.connection.request(method, self.prefix + path, body, headers or {})
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+        if response.getheader('Content-Type', '').startswith('application/json') and data:
+            return response.status, json.loads(data)
+        return response.status, None
+
+
+def forge_lootbox(client, user_id):
+    status, changes = client.get(f'/users/{user_id}/sync?limit=1000')
+    if status != 200:
+        return status, changes
+    material_ids = [adventure['id'] for adventure in changes['adventures']
+                    if adventure['status'] == "Unused Material"][:5]
+    return client.post('/forge_lootbox', {'user_id': user_id, 'material_ids': material_ids})
+
+
+# Parse "name=weight,..." into (names, cumulative weights) for random.choices.
+def parse_mix(mix):
+    names, weights = [], []
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ACTIONS:
+            raise ValueError(f"Unknown action {name!r}, expected one of {', '.join(ACTIONS)}")
+        names.append(name)
+        weights.append(float(weight or 1))
+    if sum(weights) <= 0:
+        raise ValueError("A mix needs a positive weight")
+    return names, [sum(weights[:i + 1]) for i in range(len(weights))]
+
+
+def parse_phase(phase):
+    seconds, rate, *mix = phase.split(':', 2)
+    return float(seconds), float(rate), mix[0] if mix else READ_MIX
+
+
+# Latencies and response statuses per action, shared by the worker threads.
+class Results:
+    def __init__(self):
+        self.corrected = defaultdict(LatencyHistogram)
+        self.uncorrected = defaultdict(LatencyHistogram)
+        self.statuses = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def record(self, action, status, intended, started, finished):
+        with self._lock:
+            self.corrected[action].record((finished - intended) * 1e6)
+            self.uncorrected[action].record((finished - started) * 1e6)
+            self.statuses[action][status] += 1
+
+
+# Take scheduled requests off the queue and send them. Latency is measured from when the
+# request was due, not when it was sent, so time spent waiting behind slow responses counts
+# and a stalled server cannot hide its stall by slowing the load down (coordinated omission).
+def worker(pending, results, url, timeout):
+    client = Client(url, timeout)
+    while True:
+        job = pending.get()
+        if job is None:
+            return
+        intended, action, user_id = job
+        started = time.perf_counter()
+        try:
+            status, _ = ACTIONS[action](client, user_id)
+        except (OSError, http.client.HTTPException, ValueError):
+            status = 'error'
+        results.record(action, status, intended, started, time.perf_counter())
+
+
+# Queue each phase's requests at evenly spaced due times, whatever the responses are doing.
+def schedule(phases, pending, users, rng):
+    start = time.perf_counter()
+    late = 0.0
+    for seconds, rate, (names, cumulative_weights) in phases:
+        print(f"{seconds:g}s at {rate:g} requests/s: {', '.join(names)}", file=sys.stderr)
+        for n in range(int(seconds * rate)):
+            intended = start + n / rate
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                late = max(late, -delay)
+            action = rng.choices(names, cum_weights=cumulative_weights)[0]
+            pending.put((intended, action, rng.randint(1, users)))
+        start += seconds
+    return late
+
+
+def print_summary(results, elapsed):
+    width = max([len(action) for action in results.corrected] + [len('action')])
+    print(f"{'action':<{width}} {'count':>7} {'req/s':>7} {'errors':>6}  "
+          + ' '.join(f"{'p' + format(p, 'g'):>8}" for p in PERCENTILES) + f" {'max':>8}  (ms, from due time)")
+    overall = LatencyHistogram()
+    for action in sorted(results.corrected):
+        histogram = results.corrected[action]
+        overall.add(histogram)
+        statuses = results.statuses[action]
+        errors = sum(count for status, count in statuses.items() if status == 'error' or status >= 500)
+        print(f"{action:<{width}} {histogram.total:7d} {histogram.total / elapsed:7.1f} {errors:6d}  "
+              + ' '.join(f"{histogram.value_at(p) / 1000:8.1f}" for p in PERCENTILES) + f" {histogram.max / 1000:8.1f}"
+              + f"  {dict(sorted(statuses.items(), key=str))}")
+    print(f"{'all':<{width}} {overall.total:7d} {overall.total / elapsed:7.1f} {'':6}  "
+          + ' '.join(f"{overall.value_at(p) / 1000:8.1f}" for p in PERCENTILES) + f" {overall.max / 1000:8.1f}")
+    return overall
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    try:
+        phases = [parse_phase(phase) for phase in args.phase] if args.phase else DAILY_SHAPE
+        phases = [(seconds * args.time_scale, rate * args.rate_scale, parse_mix(mix)) for seconds, rate, mix in phases]
+    except ValueError as error:
+        parser.error(str(error))
+
+    results = Results()
+    pending = queue.SimpleQueue()
+    threads = [threading.Thread(target=worker, args=(pending, results, args.url, args.timeout), daemon=True)
+               for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+
+    started = time.perf_counter()
+    late = schedule(phases, pending, args.users, random.Random(args.seed))
+    for _ in threads:
+        pending.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if late > 0.01:
+        print(f"The load generator fell up to {late * 1000:.0f}ms behind schedule; latencies still count from the due times.",
+              file=sys.stderr)
+
+    overall = print_summary(results, elapsed)
+
+    # Write the corrected and the service-time-only histograms of each action and of them all.
+    os.makedirs(args.output, exist_ok=True)
+    uncorrected = LatencyHistogram()
+    for action in results.corrected:
+        results.corrected[action].write(os.path.join(args.output, f"{action}.hgrm"))
+        results.uncorrected[action].write(os.path.join(args.output, f"{action}.uncorrected.hgrm"))
+        uncorrected.add(results.uncorrected[action])
+    overall.write(os.path.join(args.output, 'all.hgrm'))
+    uncorrected.write(os.path.join(args.output, 'all.uncorrected.hgrm'))
+    print(f"Histograms written to {args.output}/", file=sys.stderr)
@@ -0,0 +1,9 @@
+from app import create_app
+from app.game_logic import PreRollManager
+
+# Run from a scheduler (e.g. cron) ahead of peak hours.
+app = create_app()
+
+with app.app_context():
+    created = PreRollManager.generate()
+    print(f"Pre-rolled {created} adventures")
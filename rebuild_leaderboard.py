@@ -0,0 +1,10 @@
+from app import create_app
+from app.leaderboard import recompute_scores
+
+# Recount every user's leaderboard score from their history, e.g. after adding the leaderboard
+# to an existing database. Holds each shard's write lock while it is recounted.
+app = create_app()
+
+with app.app_context():
+    recomputed = recompute_scores()
+    print(f"Recomputed the scores of {recomputed} users")
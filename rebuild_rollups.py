@@ -0,0 +1,10 @@
+from app import create_app
+from app.rollups import rebuild_rollups
+
+# Recount the drop-rate rollups from the adventure and lootbox history, e.g. after adding
+# them to an existing database.
+app = create_app()
+
+with app.app_context():
+    rebuilt = rebuild_rollups()
+    print(f"Rebuilt {rebuilt} rollup buckets")
@@ -0,0 +1,99 @@
+import argparse
+import glob
+import http.client
+import json
+import queue
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from load_test import PERCENTILES, Client, LatencyHistogram, Results, print_summary
+
+parser = argparse.ArgumentParser(description="Re-issue requests recorded with REQUEST_LOG_PATH against a running instance, "
+                                             "ideally one serving a copy of the recorded database, and compare the "
+                                             "latencies and statuses with the recorded ones.")
+parser.add_argument('logs', nargs='+', help="request logs, rotated ones included; glob patterns are expanded")
+parser.add_argument('--url', default='http://127.0.0.1:5000')
+parser.add_argument('--speed', type=float, default=1.0, help="replay this many times faster than recorded")
+parser.add_argument('--threads', type=int, default=64, help="requests in flight at most")
+parser.add_argument('--timeout', type=float, default=60.0)
+
+
+# Every recorded request in the logs, in the order they started.
+def load(patterns):
+    entries = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with open(path) as log:
+                entries.extend(json.loads(line) for line in log if line.strip())
+    entries.sort(key=lambda entry: entry['t'])
+    return entries
+
+
+# Send the recorded requests as they come due, timing them from the due time like load_test.py.
+def worker(pending, results, matches, url, timeout):
+    client = Client(url, timeout)
+    while True:
+        job = pending.get()
+        if job is None:
+            return
+        intended, entry = job
+        headers = {'Content-Type': 'application/json'} if 'b' in entry else {}
+        if 'a' in entry:
+            headers['Accept'] = entry['a']
+        started = time.perf_counter()
+        try:
+            status, _ = client.request(entry['m'], entry['p'], entry.get('b'), headers)
+        except (OSError, http.client.HTTPException, ValueError):
+            status = 'error'
+        results.record(entry['e'], status, intended, started, time.perf_counter())
+        matches[entry['e']][status == entry['s']] += 1
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    entries = load(args.logs)
+    if not entries:
+        parser.error("No recorded requests")
+    first = entries[0]['t']
+    print(f"Replaying {len(entries)} requests recorded over {entries[-1]['t'] - first:.0f}s "
+          f"at {args.speed:g}x speed", file=sys.stderr)
+
+    results = Results()
+    matches = defaultdict(Counter)
+    pending = queue.SimpleQueue()
+    threads = [threading.Thread(target=worker, args=(pending, results, matches, args.url, args.timeout), daemon=True)
+               for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+
+    # Keep the recorded spacing between requests, divided by the speed.
+    started = time.perf_counter()
+    for entry in entries:
+        intended = started + (entry['t'] - first) / args.speed
+        delay = intended - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        pending.put((intended, entry))
+    for _ in threads:
+        pending.put(None)
+    for thread in threads:
+        thread.join()
+
+    print_summary(results, time.perf_counter() - started)
+
+    # The recorded times are service times, so they compare with the replay's uncorrected ones.
+    recorded = defaultdict(LatencyHistogram)
+    for entry in entries:
+        recorded[entry['e']].record(entry['d'] * 1000)
+    width = max(len(endpoint) for endpoint in recorded)
+    print(f"\n{'endpoint':<{width}} " + ' '.join(f"{'p' + format(p, 'g'):>17}" for p in PERCENTILES)
+          + f" {'same status':>12}  (ms recorded -> replayed, service time)")
+    for endpoint in sorted(recorded):
+        replayed = results.uncorrected[endpoint]
+        same = matches[endpoint]
+        print(f"{endpoint:<{width}} " + ' '.join(
+            f"{recorded[endpoint].value_at(p) / 1000:7.1f} -> {replayed.value_at(p) / 1000:7.1f}" for p in PERCENTILES
+        ) + f" {same[True] / (same[True] + same[False]):11.1%}")
@@ -0,0 +1,59 @@
+import argparse
+from sqlalchemy import create_engine, insert, select
+from app import create_app, db
+from app.sharding import shard_count, shard_engines, shard_for, user_scoped_tables
+
+BATCH_SIZE = 10000
+
+parser = argparse.ArgumentParser(description="Copy the user-scoped tables into a new set of shard databases.")
+parser.add_argument('shards', type=int, help="new number of shards, a multiple of the current SHARD_COUNT")
+parser.add_argument('--uri', default='sqlite:///resharded{}.db', help="URI of each new shard, formatted with its number")
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    # Growing by a multiple keeps every new shard fed by exactly one old shard,
+    # so row ids that are only unique within a shard never collide.
+    if args.shards % shard_count() != 0:
+        parser.error(f"the new shard count must be a multiple of {shard_count()}")
+
+    tables = user_scoped_tables(db.metadata)
+    # Tables without a user column need their own rule for splitting them between the new shards.
+    unsplittable = [table.name for table in tables if table.name not in ('user', 'change_counter', 'drop_rollup')
+                    and table.c.get('user_id') is None]
+    if unsplittable:
+        parser.error(f"don't know how to split {', '.join(unsplittable)} between the new shards")
+    targets = [create_engine(args.uri.format(shard)) for shard in range(args.shards)]
+    for engine in targets:
+        db.metadata.create_all(engine, tables=tables)
+
+    for source_shard, source in enumerate(shard_engines()):
+        # The new shards fed by this one: shard_for(id, n * k) % n == shard_for(id, n).
+        children = list(range(source_shard, args.shards, shard_count()))
+        with source.connect() as source_conn:
+            # Copy parents before children and stream each table in batches.
+            for table in tables:
+                user_column = table.c.id if table.name == 'user' else table.c.get('user_id')
+                result = source_conn.execution_options(yield_per=BATCH_SIZE).execute(select(table))
+                for rows in result.partitions():
+                    batches = {}
+                    for row in rows:
+                        row = dict(row._mapping)
+                        if user_column is not None:
+                            batches.setdefault(shard_for(row[user_column.name], args.shards), []).append(row)
+                        elif table.name == 'change_counter':
+                            # Change sequences stamped on the copied rows must stay below the counters of
+                            # whichever child they land on, so every child starts from the parent's counters.
+                            for child in children:
+                                batches.setdefault(child, []).append(row)
+                        elif table.name == 'drop_rollup':
+                            # Counts are summed across shards when read, so the parent's buckets go to one
+                            # child, the one keeping its number, and every drop stays counted exactly once.
+                            batches.setdefault(source_shard, []).append(row)
+                    for shard, batch in batches.items():
+                        with targets[shard].begin() as target_conn:
+                            target_conn.execute(insert(table), batch)
+                print(f"Copied {table.name} from {source.url}")
+
+    print(f"Done. Point SHARD_DATABASE_URI at {args.uri!r} and set SHARD_COUNT = {args.shards}.")
@@ -0,0 +1,32 @@
+import pytest
+from config import Config
+from app import create_app
+from app.sharding import create_all
+
+
+# Config keeping every database and file in the given directory, with overrides.
+def make_config(directory, **overrides):
+    return type('TestConfig', (Config,), {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{directory}/site.db",
+        'SHARD_DATABASE_URI': f"sqlite:///{directory}/site_shard{{}}.db",
+        'LEADERBOARD_SNAPSHOT_PATH': f"{directory}/leaderboard.snapshot",
+        'REQUEST_LOG_PATH': None,
+        **overrides,
+    })
+
+
+# Build apps on databases in the test's temporary directory, with config overrides.
+# Apps made by the same test share their databases, like worker processes do.
+@pytest.fixture
+def make_app(tmp_path):
+    def make_app(**overrides):
+        app = create_app(make_config(tmp_path, **overrides))
+        with app.app_context():
+            create_all()
+        return app
+    return make_app
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
@@ -0,0 +1,135 @@
+import threading
+import time
+from datetime import datetime
+import pytest
+from app import db, routes
+from app.bulkhead import Bulkhead
+from app.metrics import metrics
+from app.models import LootBox, User
+
+
+def add_users(app, count):
+    with app.app_context():
+        for user_id in range(1, count + 1):
+            db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                                NFTno=user_id, password='secret'))
+            db.session.add(LootBox(user_id=user_id, timestamp=datetime.utcnow(), rarity='Common'))
+        db.session.commit()
+
+
+def wait_for(condition, seconds=5):
+    give_up_at = time.monotonic() + seconds
+    while not condition():
+        assert time.monotonic() < give_up_at
+        time.sleep(0.005)
+
+
+def counter(name):
+    return metrics.snapshot().get(f"bulkhead.get_materials_summary.{name}", 0)
+
+
+# The materials summary route with a bulkhead of one slot and one queue place, whose view
+# blocks until `release` is set.
+@pytest.fixture
+def blocking_app(make_app, monkeypatch):
+    def make_blocking_app(**overrides):
+        app = make_app(BULKHEADS={'get_materials_summary': (1, 1)}, **overrides)
+        add_users(app, 3)
+        release = threading.Event()
+        summary = routes.materials_summary
+        def blocking_summary(user):
+            release.wait(5)
+            return summary(user)
+        monkeypatch.setattr(routes, 'materials_summary', blocking_summary)
+        return app, app.extensions['bulkheads']['get_materials_summary'], release
+    return make_blocking_app
+
+
+def get_in_background(app, user_id, statuses):
+    def get():
+        statuses[user_id] = app.test_client().get(f"/materials_summary?user_id={user_id}").status_code
+    thread = threading.Thread(target=get)
+    thread.start()
+    return thread
+
+
+# With the slot taken and the queue full, the next request is shed at once with a Retry-After.
+def test_request_beyond_queue_is_shed(blocking_app):
+    app, bulkhead, release = blocking_app(BULKHEAD_MAX_WAIT_SECONDS=5)
+    statuses = {}
+    running = get_in_background(app, 1, statuses)
+    wait_for(lambda: bulkhead.active == 1)
+    queued = get_in_background(app, 2, statuses)
+    wait_for(lambda: bulkhead.waiting == 1)
+
+    rejected = counter('rejected')
+    response = app.test_client().get('/materials_summary?user_id=3')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(app.config['BULKHEAD_RETRY_AFTER_SECONDS'])
+    assert counter('rejected') == rejected + 1
+
+    release.set()
+    running.join()
+    queued.join()
+    assert statuses == {1: 200, 2: 200}
+    assert (bulkhead.active, bulkhead.waiting) == (0, 0)
+
+
+# A request queued longer than BULKHEAD_MAX_WAIT_SECONDS is shed and counted as timed out.
+def test_queued_request_times_out(blocking_app):
+    app, bulkhead, release = blocking_app(BULKHEAD_MAX_WAIT_SECONDS=0.1)
+    statuses = {}
+    running = get_in_background(app, 1, statuses)
+    wait_for(lambda: bulkhead.active == 1)
+
+    timed_out = counter('timed_out')
+    started = time.monotonic()
+    response = app.test_client().get('/materials_summary?user_id=2')
+    assert response.status_code == 503
+    assert 'Retry-After' in response.headers
+    assert 0.1 <= time.monotonic() - started < 2
+    assert counter('timed_out') == timed_out + 1
+
+    release.set()
+    running.join()
+    assert statuses == {1: 200}
+    assert bulkhead.waiting == 0
+
+
+# Queued requests get the slot in the order they arrived.
+def test_queued_requests_are_admitted_in_order():
+    bulkhead = Bulkhead('ordering', 1, 3, max_wait=5)
+    assert bulkhead.acquire()
+    admitted = []
+    def queue(number):
+        assert bulkhead.acquire()
+        admitted.append(number)
+        bulkhead.release()
+    threads = []
+    for number in range(3):
+        threads.append(threading.Thread(target=queue, args=(number,)))
+        threads[-1].start()
+        wait_for(lambda: bulkhead.waiting == number + 1)
+
+    bulkhead.release()
+    for thread in threads:
+        thread.join()
+    assert admitted == [0, 1, 2]
+    assert (bulkhead.active, bulkhead.waiting) == (0, 0)
+
+
+# A streamed listing keeps its slot until the stream is closed.
+def test_ndjson_stream_keeps_its_slot_until_closed(make_app):
+    app = make_app(BULKHEADS={'get_lootboxes': (1, 0)})
+    add_users(app, 1)
+    bulkhead = app.extensions['bulkheads']['get_lootboxes']
+    client = app.test_client()
+
+    stream = client.get('/lootboxes?user_id=1&format=ndjson', buffered=False)
+    assert b'Common' in next(stream.response)
+    assert bulkhead.active == 1
+    assert client.get('/lootboxes?user_id=1').status_code == 503
+
+    stream.close()
+    assert bulkhead.active == 0
+    assert client.get('/lootboxes?user_id=1').status_code == 200
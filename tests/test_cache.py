@@ -0,0 +1,170 @@
+import os
+import socket
+import time
+import pytest
+from app import db
+from app.cache import LRUCache, RedisCache, RespServer, SharedMemoryCache
+from app.metrics import metrics
+from app.models import User
+
+
+def test_lru_cache_is_bounded_by_bytes():
+    cache = LRUCache(max_entries=1000, max_bytes=10000, max_entry_bytes=5000, default_ttl=60)
+    for index in range(10):
+        cache.set(f"key{index}", b'x' * 2000)
+    assert cache.size <= 10000
+    assert cache.get('key0') is None
+    assert cache.get('key9') == b'x' * 2000
+
+    # Replacing a value does not count it twice.
+    size = cache.size
+    cache.set('key9', b'x' * 2000)
+    assert cache.size == size
+
+
+def test_lru_cache_skips_oversized_values():
+    cache = LRUCache(max_entries=1000, max_bytes=100000, max_entry_bytes=5000, default_ttl=60)
+    cache.set('small', b'x' * 100)
+    cache.set('big', b'x' * 10000)
+    assert cache.get('big') is None
+    assert cache.get('small') == b'x' * 100
+
+    # A value growing past the limit drops the old one rather than serving it.
+    cache.set('small', b'x' * 10000)
+    assert cache.get('small') is None
+    assert cache.size == 0
+
+
+def cache_counters(backend):
+    snapshot = metrics.snapshot()
+    return {event: snapshot.get(f"cache.{backend}.{event}", 0) for event in ('hits', 'misses', 'evictions', 'errors')}
+
+
+@pytest.fixture
+def shared_memory_cache():
+    name = f"test_cache_{os.getpid()}"
+    caches = []
+    def open_cache(slots=64, slot_size=512):
+        caches.append(SharedMemoryCache(name, slots, slot_size, default_ttl=60))
+        return caches[-1]
+    yield open_cache
+    for cache in reversed(caches):
+        cache.close(unlink=cache is caches[0])
+
+
+def test_shared_memory_cache_round_trip_and_expiry(shared_memory_cache):
+    cache = shared_memory_cache()
+    before = cache_counters('shared_memory')
+    cache.set('key', {'value': 1})
+    assert cache.get('key') == {'value': 1}
+    cache.delete('key')
+    assert cache.get('key') is None
+
+    cache.set('short', 'lived', ttl=0.05)
+    assert cache.get('short') == 'lived'
+    time.sleep(0.1)
+    assert cache.get('short') is None
+    after = cache_counters('shared_memory')
+    assert (after['hits'] - before['hits'], after['misses'] - before['misses']) == (2, 2)
+
+
+# Every worker attached to the segment sees the others' writes and deletes.
+def test_shared_memory_cache_is_shared_between_instances(shared_memory_cache):
+    first, second = shared_memory_cache(), shared_memory_cache()
+    first.set('key', 'from first')
+    assert second.get('key') == 'from first'
+    second.delete('key')
+    assert first.get('key') is None
+
+
+# When every slot of a key's probe window is taken, the least recently used one is evicted.
+def test_shared_memory_cache_evicts_least_recently_used_in_probe_window(shared_memory_cache):
+    # With as many slots as the probe window, every key competes for the same slots.
+    cache = shared_memory_cache(slots=SharedMemoryCache.PROBE_LENGTH)
+    keys = [f"key{index}" for index in range(SharedMemoryCache.PROBE_LENGTH)]
+    for key in keys:
+        cache.set(key, key)
+        time.sleep(0.002)
+    assert cache.get(keys[0]) == keys[0]
+    time.sleep(0.002)
+
+    before = cache_counters('shared_memory')
+    cache.set('newcomer', 'newcomer')
+    assert cache_counters('shared_memory')['evictions'] - before['evictions'] == 1
+    assert cache.get('newcomer') == 'newcomer'
+    assert cache.get(keys[0]) == keys[0]
+    assert cache.get(keys[1]) is None
+    assert all(cache.get(key) == key for key in keys[2:])
+
+
+def test_shared_memory_cache_skips_values_too_big_for_a_slot(shared_memory_cache):
+    cache = shared_memory_cache(slot_size=256)
+    cache.set('big', b'x' * 1000)
+    assert cache.get('big') is None
+
+
+@pytest.fixture
+def resp_server():
+    server = RespServer().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_redis_cache_round_trip_and_expiry(resp_server):
+    cache = RedisCache(resp_server.url, default_ttl=60)
+    before = cache_counters('redis')
+    cache.set('key', {'value': 1})
+    assert cache.get('key') == {'value': 1}
+    cache.delete('key')
+    assert cache.get('key') is None
+
+    cache.set('short', 'lived', ttl=0.05)
+    assert cache.get('short') == 'lived'
+    time.sleep(0.1)
+    assert cache.get('short') is None
+    after = cache_counters('redis')
+    assert (after['hits'] - before['hits'], after['misses'] - before['misses']) == (2, 2)
+
+
+# Caches in different workers share the server's entries.
+def test_redis_cache_is_shared_between_instances(resp_server):
+    first, second = RedisCache(resp_server.url, 60), RedisCache(resp_server.url, 60)
+    first.set('key', 'from first')
+    assert second.get('key') == 'from first'
+
+
+def unused_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+# Without a server, reads miss and writes are dropped, each counted as an error, instead of raising.
+def test_redis_cache_outage_falls_through(resp_server):
+    cache = RedisCache(f"redis://127.0.0.1:{unused_port()}/0", 60, timeout=0.5)
+    before = cache_counters('redis')
+    cache.set('key', 'value')
+    assert cache.get('key') is None
+    cache.delete('key')
+    after = cache_counters('redis')
+    assert after['errors'] - before['errors'] == 3
+    assert after['misses'] - before['misses'] == 1
+
+    # A connection the server drops is reopened on the next command.
+    cache = RedisCache(resp_server.url, 60)
+    cache.set('key', 'value')
+    cache._local.connection.shutdown(socket.SHUT_RDWR)
+    assert cache.get('key') is None
+    assert cache.get('key') == 'value'
+
+
+# Cached read routes keep answering from the database while the Redis server is down.
+def test_read_routes_work_while_redis_is_down(make_app):
+    app = make_app(CACHE_BACKEND='redis', CACHE_REDIS_URL=f"redis://127.0.0.1:{unused_port()}/0")
+    with app.app_context():
+        db.session.add(User(id=1, username='player', email='player@example.com', NFTno=1, password='secret'))
+        db.session.commit()
+    client = app.test_client()
+    assert client.get('/users/1/state').status_code == 200
+    assert client.get('/lootboxes', query_string={'user_id': 1}).status_code == 200
@@ -0,0 +1,65 @@
+import threading
+import time
+import pytest
+from app.coalescing import SingleFlight
+from app.metrics import metrics
+
+CALLERS = 8
+
+
+def coalesced():
+    return metrics.snapshot().get('coalescing.coalesced', 0)
+
+
+# Call do(key, compute) from CALLERS threads at once. compute only finishes once every other
+# caller is waiting on it, then returns or raises `outcome`. Returns what each caller got.
+def call_together(flight, outcome):
+    runs = []
+    before = coalesced()
+
+    def compute():
+        runs.append(1)
+        give_up_at = time.monotonic() + 5
+        while coalesced() - before < CALLERS - 1 and time.monotonic() < give_up_at:
+            time.sleep(0.001)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    results = [None] * CALLERS
+    def caller(index):
+        try:
+            results[index] = flight.do('key', compute)
+        except Exception as error:
+            results[index] = error
+    threads = [threading.Thread(target=caller, args=(index,)) for index in range(CALLERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert coalesced() - before == CALLERS - 1
+    return runs, results
+
+
+def test_concurrent_callers_share_one_computation():
+    flight = SingleFlight()
+    result = {'rows': [1, 2, 3]}
+    runs, results = call_together(flight, result)
+    assert len(runs) == 1
+    assert all(got is result for got in results)
+    assert flight._calls == {}
+
+    # The key is free again, so the next call computes afresh.
+    assert flight.do('key', lambda: 'fresh') == 'fresh'
+
+
+def test_error_reaches_every_waiter():
+    flight = SingleFlight()
+    error = RuntimeError('database is down')
+    runs, results = call_together(flight, error)
+    assert len(runs) == 1
+    assert all(got is error for got in results)
+    assert flight._calls == {}
+    with pytest.raises(ValueError):
+        flight.do('key', lambda: int('not a number'))
+    assert flight._calls == {}
@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy import text
+from app import db, routes
+from app.metrics import metrics
+from app.models import User
+
+# A statement that would run for minutes: counting to a billion with a recursive CTE.
+RUNAWAY = "WITH RECURSIVE counter(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM counter WHERE n < 1000000000) SELECT count(*) FROM counter"
+ADMIN = {'X-Admin-Token': 'secret'}
+
+
+@pytest.fixture
+def deadline_app(make_app, monkeypatch):
+    app = make_app(ROUTE_DEADLINE_SECONDS={'get_materials_summary': 0.05}, ADMIN_TOKEN='secret')
+    with app.app_context():
+        db.session.add(User(id=1, username='player', email='player@example.com', NFTno=1, password='secret'))
+        db.session.commit()
+    # What the summary view runs; None runs the real summary.
+    statement = {}
+    summary = routes.materials_summary
+    def materials_summary(user):
+        if statement.get('sql'):
+            db.session.execute(text(statement['sql'])).all()
+        return summary(user)
+    monkeypatch.setattr(routes, 'materials_summary', materials_summary)
+    return app, statement
+
+
+def cancelled_count():
+    return metrics.snapshot().get('deadline.cancelled.get_materials_summary', 0)
+
+
+# A statement running past the route's deadline is interrupted: the request gets a 504, the
+# cancellation is recorded and counted, and the connection serves the next request normally.
+def test_runaway_statement_is_cancelled(deadline_app):
+    app, statement = deadline_app
+    client = app.test_client()
+    before = cancelled_count()
+
+    statement['sql'] = RUNAWAY
+    response = client.get('/materials_summary?user_id=1')
+    assert response.status_code == 504
+    assert response.get_json() == {'message': 'Request timed out'}
+    assert cancelled_count() == before + 1
+
+    cancelled = client.get('/admin/cancelled_queries', headers=ADMIN).get_json()['cancelled']
+    assert cancelled[-1]['endpoint'] == 'get_materials_summary'
+    assert cancelled[-1]['deadline_seconds'] == 0.05
+    assert 'WITH RECURSIVE counter' in cancelled[-1]['statement']
+
+    statement['sql'] = None
+    assert client.get('/materials_summary?user_id=1').status_code == 200
+    # Other routes keep the default deadline.
+    assert client.get('/users/1/state').status_code == 200
+
+
+# Operational errors that are not the deadline's still fail the request as before.
+def test_other_operational_errors_still_raise(deadline_app):
+    app, statement = deadline_app
+    before = cancelled_count()
+    statement['sql'] = "SELECT * FROM no_such_table"
+    client = app.test_client()
+    assert client.get('/materials_summary?user_id=1').status_code == 500
+    assert cancelled_count() == before
+    assert client.get('/admin/cancelled_queries', headers=ADMIN).get_json() == {'cancelled': []}
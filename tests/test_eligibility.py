@@ -0,0 +1,68 @@
+import threading
+import time
+from datetime import datetime
+from app import db
+from app.models import Adventure, User
+
+
+def add_users(app, *user_ids, adventured=()):
+    with app.app_context():
+        for user_id in user_ids:
+            db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                                NFTno=user_id, password='secret'))
+            if user_id in adventured:
+                db.session.add(Adventure(user_id=user_id, timestamp=datetime.utcnow(), rng_score=300,
+                                         material='None', status='No Material'))
+        db.session.commit()
+
+
+def wait_for(condition, seconds=5):
+    give_up_at = time.monotonic() + seconds
+    while not condition():
+        assert time.monotonic() < give_up_at
+        time.sleep(0.01)
+
+
+# Parked waiters are capped per worker without a queue: past the cap a waiter is turned away
+# at once with a Retry-After, while other routes keep their threads.
+def test_parked_waiters_are_capped(make_app):
+    app = make_app(BULKHEADS={'get_user_eligibility': (2, 0)}, ELIGIBILITY_MAX_WAIT_SECONDS=1)
+    add_users(app, 1, 2, adventured=(1,))
+    bulkhead = app.extensions['bulkheads']['get_user_eligibility']
+
+    statuses = []
+    def park():
+        statuses.append(app.test_client().get('/users/1/eligibility?timeout=1').status_code)
+    waiters = [threading.Thread(target=park) for _ in range(2)]
+    for waiter in waiters:
+        waiter.start()
+    wait_for(lambda: bulkhead.active == 2)
+
+    client = app.test_client()
+    response = client.get('/users/1/eligibility?timeout=1')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(app.config['BULKHEAD_RETRY_AFTER_SECONDS'])
+    assert client.post('/adventure', json={'user_id': 2}).status_code == 201
+
+    for waiter in waiters:
+        waiter.join()
+    assert statuses == [200, 200]
+    assert bulkhead.active == 0
+    assert client.get('/users/1/eligibility?timeout=0').status_code == 200
+
+
+# An event stream holds its slot until the client goes away.
+def test_event_stream_holds_its_slot_until_closed(make_app):
+    app = make_app(BULKHEADS={'get_user_eligibility': (1, 0)})
+    add_users(app, 1, adventured=(1,))
+    bulkhead = app.extensions['bulkheads']['get_user_eligibility']
+    client = app.test_client()
+
+    stream = client.get('/users/1/eligibility', headers={'Accept': 'text/event-stream'}, buffered=False)
+    assert next(stream.response).startswith(b'event: waiting')
+    assert bulkhead.active == 1
+    assert client.get('/users/1/eligibility?timeout=0').status_code == 503
+
+    stream.close()
+    assert bulkhead.active == 0
+    assert client.get('/users/1/eligibility?timeout=0').status_code == 200
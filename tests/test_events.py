@@ -0,0 +1,97 @@
+import json
+import pytest
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.events import record_event
+from app.models import User
+from app.sharding import use_shard
+
+
+def add_user(user_id):
+    db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                        NFTno=user_id, password='secret'))
+
+
+# Write `count` events for each of the users, each event in a transaction of its own.
+def write_events(app, user_ids, count):
+    with app.app_context():
+        for index in range(count):
+            for user_id in user_ids:
+                use_shard(user_id)
+                record_event('adventure_rolled', user_id, index=index)
+                db.session.commit()
+
+
+def event_keys(events):
+    return [(event['shard'], event['seq']) for event in events]
+
+
+# Paging from no cursor to the end returns every event exactly once, in sequence order
+# within each shard, and the final cursor then returns nothing new.
+@pytest.mark.parametrize('shards', [1, 2])
+def test_paging_returns_every_event_once(make_app, shards):
+    app = make_app(SHARD_COUNT=shards)
+    write_events(app, range(1, 7), 4)
+    client = app.test_client()
+
+    seen, cursor = [], None
+    while True:
+        body = client.get('/events', query_string={'limit': 5, **({'after': cursor} if cursor else {})}).get_json()
+        if not body['events']:
+            break
+        assert len(body['events']) <= 5
+        seen += body['events']
+        cursor = body['cursor']
+    assert len(seen) == 24
+    assert len(set(event_keys(seen))) == 24
+    for shard in range(shards):
+        sequence = [seq for event_shard, seq in event_keys(seen) if event_shard == shard]
+        assert sequence == sorted(sequence)
+    assert sorted((event['user_id'], event['data']['index']) for event in seen) == \
+        sorted((user_id, index) for user_id in range(1, 7) for index in range(4))
+    assert body['cursor'] == cursor and len(cursor.split(',')) == shards
+
+
+@pytest.mark.parametrize('shards, cursor', [
+    (1, 'abc'),
+    (1, '-1'),
+    (1, '1,2'),
+    (2, '3'),
+    (2, '1,2,3'),
+    (2, '1,'),
+])
+def test_malformed_cursor_is_refused(make_app, shards, cursor):
+    app = make_app(SHARD_COUNT=shards)
+    assert app.test_client().get('/events', query_string={'after': cursor}).status_code == 400
+
+
+# Each streamed line carries the cursor to resume from: resuming after any line returns
+# exactly the events that followed it.
+def test_stream_lines_carry_the_resume_cursor(make_app):
+    app = make_app(SHARD_COUNT=2, EVENT_STREAM_MAX_SECONDS=0.2, EVENT_FEED_POLL_SECONDS=0.05)
+    write_events(app, range(1, 5), 2)
+    client = app.test_client()
+
+    response = client.get('/events', query_string={'stream': 1, 'limit': 3})
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(lines) == 8
+    for index, line in enumerate(lines):
+        rest = client.get('/events', query_string={'after': line['cursor'], 'limit': 100}).get_json()['events']
+        assert event_keys(rest) == event_keys(lines[index + 1:])
+
+
+# An event is written in the transaction of the change it describes, so a change that is
+# rolled back leaves no event behind.
+def test_rolled_back_write_leaves_no_event(app):
+    with app.app_context():
+        use_shard(1)
+        add_user(1)
+        db.session.commit()
+        record_event('threshold_changed', 1, threshold=50)
+        add_user(1)
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+    body = app.test_client().get('/events').get_json()
+    assert body == {'events': [], 'cursor': '0'}
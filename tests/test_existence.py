@@ -0,0 +1,46 @@
+from app import db
+from app.metrics import metrics
+from app.models import User
+
+
+def add_user(app, user_id):
+    with app.app_context():
+        db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                            NFTno=user_id, password='secret'))
+        db.session.commit()
+
+
+# A user committed below the highest id already loaded is found in the database, not rejected.
+def test_users_created_below_the_loaded_ids_are_found(app):
+    client = app.test_client()
+    add_user(app, 10)
+    assert client.get('/users/10/state').status_code == 200
+
+    add_user(app, 7)
+    assert client.get('/users/7/state').status_code == 200
+    assert client.post('/adventure', json={'user_id': 7}).status_code == 201
+
+
+# Users created by another worker after the last refresh are found before it comes round.
+def test_users_created_since_the_last_refresh_are_found(make_app):
+    app = make_app(EXISTENCE_REFRESH_SECONDS=3600)
+    client = app.test_client()
+    add_user(app, 1)
+    assert client.get('/users/1/state').status_code == 200
+
+    add_user(make_app(), 2)
+    assert client.get('/users/2/state').status_code == 200
+
+
+# Unknown ids cost one lookup, then are rejected from the negative cache.
+def test_unknown_ids_are_looked_up_once(app):
+    client = app.test_client()
+    add_user(app, 1)
+    assert client.get('/users/999/state').status_code == 404
+
+    before = metrics.snapshot()
+    for _ in range(5):
+        assert client.get('/users/999/state').status_code == 404
+    after = metrics.snapshot()
+    assert after.get('existence.lookups', 0) == before.get('existence.lookups', 0)
+    assert after['existence.negative_hits'] - before.get('existence.negative_hits', 0) == 5
@@ -0,0 +1,104 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+import pytest
+from app import db
+from app.models import Adventure, ArchivedAdventure, LootBox, Prize, PrizeType, User
+from app.sharding import use_shard
+
+ADMIN = {'X-Admin-Token': 'secret'}
+USERS = range(1, 5)
+
+
+# Give every user two hot adventures, one archived adventure, a lootbox and a prize.
+def add_history(app):
+    now = datetime(2024, 5, 1, 12, 30)
+    with app.app_context():
+        prize_type = PrizeType(name='Rare', rarity='Rare', quanity=10)
+        db.session.add(prize_type)
+        db.session.commit()
+        for user_id in USERS:
+            use_shard(user_id)
+            db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                                NFTno=user_id, password='secret'))
+            for index in range(2):
+                db.session.add(Adventure(id=user_id * 10 + index, user_id=user_id, timestamp=now + timedelta(minutes=index),
+                                         rng_score=index, material='Common', status='Unused Material'))
+            db.session.add(ArchivedAdventure(id=user_id * 10 + 9, user_id=user_id, timestamp=now - timedelta(days=90),
+                                             rng_score=7, material='None', status='No Material'))
+            db.session.add(LootBox(user_id=user_id, timestamp=now, rarity='Rare'))
+            db.session.add(Prize(user_id=user_id, prize_type_id=prize_type.id, timestamp=now))
+            db.session.commit()
+
+
+@pytest.fixture(params=[1, 2], ids=['1-shard', '2-shards'])
+def export_app(make_app, request):
+    app = make_app(SHARD_COUNT=request.param, ADMIN_TOKEN='secret', EXPORT_CHUNK_SIZE=2)
+    add_history(app)
+    return app
+
+
+def export(app, name, **params):
+    response = app.test_client().get(f"/admin/export/{name}", query_string=params, headers=ADMIN)
+    assert response.status_code == 200
+    return response
+
+
+# Every adventure of every shard is exported once, archived ones flagged, with the same rows
+# in CSV and NDJSON.
+def test_adventures_export_every_shard(export_app):
+    response = export(export_app, 'adventures')
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename="adventures.csv"'
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert sorted(int(row['id']) for row in rows) == sorted(user_id * 10 + index for user_id in USERS for index in (0, 1, 9))
+    for row in rows:
+        assert row['archived'] == ('1' if row['id'].endswith('9') else '0')
+        assert int(row['id']) // 10 == int(row['user_id'])
+    assert rows[0].keys() == {'id', 'timestamp', 'user_id', 'rng_score', 'material', 'status', 'archived'}
+
+    response = export(export_app, 'adventures', format='ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(lines, key=lambda line: line['id']) == sorted(
+        ({**row, 'id': int(row['id']), 'user_id': int(row['user_id']), 'rng_score': int(row['rng_score']),
+          'archived': int(row['archived'])} for row in rows), key=lambda line: line['id'])
+    archived = next(line for line in lines if line['id'] == 19)
+    assert archived['status'] == 'No Material' and archived['timestamp'] == '2024-02-01T12:30:00.000000'
+
+
+@pytest.mark.parametrize('name, columns', [
+    ('lootboxes', ['id', 'timestamp', 'user_id', 'rarity']),
+    ('prizes', ['id', 'timestamp', 'user_id', 'prize_type_id', 'lease_id']),
+])
+def test_other_tables_export_every_shard(export_app, name, columns):
+    lines = export(export_app, name).get_data(as_text=True).splitlines()
+    assert lines[0] == ','.join(columns)
+    assert sorted(int(row['user_id']) for row in csv.DictReader(lines)) == list(USERS)
+    lines = export(export_app, name, format='ndjson').get_data(as_text=True).splitlines()
+    assert sorted(json.loads(line)['user_id'] for line in lines) == list(USERS)
+
+
+# A gzipped export decompresses to exactly the plain one.
+@pytest.mark.parametrize('export_format', ['csv', 'ndjson'])
+def test_gzip_decompresses_to_the_same_bytes(export_app, export_format):
+    plain = export(export_app, 'adventures', format=export_format).get_data()
+    response = export(export_app, 'adventures', format=export_format, gzip=1)
+    assert response.mimetype == 'application/gzip'
+    assert response.headers['Content-Disposition'] == f'attachment; filename="adventures.{export_format}.gz"'
+    assert gzip.decompress(response.get_data()) == plain
+
+
+# Exports do not exist without ADMIN_TOKEN and are refused without the right token.
+def test_export_needs_the_admin_token(make_app):
+    app = make_app()
+    assert app.test_client().get('/admin/export/adventures', headers=ADMIN).status_code == 404
+
+    app = make_app(ADMIN_TOKEN='secret')
+    client = app.test_client()
+    assert client.get('/admin/export/adventures').status_code == 403
+    assert client.get('/admin/export/adventures', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    assert client.get('/admin/export/users', headers=ADMIN).status_code == 404
+    assert client.get('/admin/export/adventures?format=xml', headers=ADMIN).status_code == 404
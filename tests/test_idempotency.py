@@ -0,0 +1,125 @@
+import json
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func, select
+from app import db, routes
+from app.idempotency import MAX_KEY_LENGTH, prune_idempotency_keys, remember_response, request_hash
+from app.metrics import metrics
+from app.models import Adventure, IdempotencyKey, LootBox, Prize, PrizeType, User
+from app.sharding import use_shard
+from app.synthetic import RARITIES
+
+
+def add_user(app, user_id=1):
+    with app.app_context():
+        use_shard(user_id)
+        db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                            NFTno=user_id, password='secret'))
+        db.session.commit()
+
+
+def count(app, model):
+    with app.app_context():
+        use_shard(1)
+        return db.session.execute(select(func.count()).select_from(model)).scalar()
+
+
+# A retry gets the stored response back, marked as replayed, without a second adventure.
+def test_retry_replays_stored_response(app):
+    add_user(app)
+    client = app.test_client()
+    headers = {'Idempotency-Key': 'first-try'}
+    first = client.post('/adventure', json={'user_id': 1}, headers=headers)
+    assert first.status_code == 201
+    assert 'Idempotent-Replayed' not in first.headers
+
+    retry = client.post('/adventure', json={'user_id': 1}, headers=headers)
+    assert retry.status_code == 201
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first.get_json()
+    assert count(app, Adventure) == 1
+
+    # Without the key the same request is a new, and here refused, adventure.
+    assert client.post('/adventure', json={'user_id': 1}).status_code == 403
+
+
+def test_key_reused_for_another_request_is_refused(app):
+    add_user(app)
+    client = app.test_client()
+    headers = {'Idempotency-Key': 'reused'}
+    assert client.post('/adventure', json={'user_id': 1}, headers=headers).status_code == 201
+    response = client.post('/adventure', json={'user_id': 1, 'extra': True}, headers=headers)
+    assert response.status_code == 422
+    assert count(app, Adventure) == 1
+
+
+@pytest.mark.parametrize('key', ['', 'k' * (MAX_KEY_LENGTH + 1)])
+def test_invalid_keys_are_refused(app, key):
+    add_user(app)
+    response = app.test_client().post('/adventure', json={'user_id': 1}, headers={'Idempotency-Key': key})
+    assert response.status_code == 400
+    assert count(app, Adventure) == 0
+
+
+# A retry racing the original: the original stores its response after the retry looked for
+# it, so the retry's own write hits the key, is rolled back, and answers with the original's
+# response. The prize unit its forge took goes back to stock.
+def test_losing_a_race_replays_the_winner(make_app, monkeypatch):
+    app = make_app(PRIZE_LEASE_SIZE=1)
+    add_user(app)
+    data = {'user_id': 1, 'material_ids': [1, 2, 3, 4, 5]}
+    winner_body = json.dumps({'message': 'New LootBox created', 'rarity': 'Common'})
+    with app.app_context():
+        for rarity in RARITIES:
+            db.session.add(PrizeType(name=rarity, rarity=rarity, quanity=10))
+        for adventure_id in data['material_ids']:
+            db.session.add(Adventure(id=adventure_id, user_id=1, timestamp=datetime.utcnow(), rng_score=10,
+                                     material='Common', status='Unused Material'))
+        db.session.commit()
+        use_shard(1)
+        remember_response(1, 'raced', request_hash('forge_lootbox', data), 201, winner_body)
+        db.session.commit()
+
+    # The winner had not committed yet when the loser first looked.
+    lookups = []
+    stored_response = routes.stored_response
+    def racing_stored_response(user_id, key):
+        lookups.append(key)
+        return None if len(lookups) == 1 else stored_response(user_id, key)
+    monkeypatch.setattr(routes, 'stored_response', racing_stored_response)
+
+    raced = metrics.snapshot().get('idempotency.raced', 0)
+    response = app.test_client().post('/forge_lootbox', json=data, headers={'Idempotency-Key': 'raced'})
+    assert response.status_code == 201
+    assert response.headers['Idempotent-Replayed'] == 'true'
+    assert response.get_data(as_text=True) == winner_body
+    assert metrics.snapshot()['idempotency.raced'] == raced + 1
+
+    # The loser's forge was rolled back whole.
+    assert count(app, LootBox) == 0 and count(app, Prize) == 0
+    with app.app_context():
+        use_shard(1)
+        assert {adventure.status for adventure in Adventure.query.all()} == {'Unused Material'}
+        # Its spent one-unit lease is returned as soon as its transaction ended.
+        app.extensions['prize_leases'].release_settled()
+        assert db.session.execute(select(func.sum(PrizeType.number_claimed))).scalar() == 0
+
+
+# Stored responses older than IDEMPOTENCY_KEY_TTL_HOURS are pruned from every shard.
+@pytest.mark.parametrize('shards', [1, 2])
+def test_prune_expired_keys(make_app, shards):
+    app = make_app(SHARD_COUNT=shards, IDEMPOTENCY_KEY_TTL_HOURS=24)
+    old = datetime.utcnow() - timedelta(hours=25)
+    with app.app_context():
+        for user_id in (1, 2):
+            use_shard(user_id)
+            db.session.add(IdempotencyKey(user_id=user_id, key='old', request_hash='x', status=201, body='{}', created_at=old))
+            db.session.add(IdempotencyKey(user_id=user_id, key='new', request_hash='x', status=201, body='{}'))
+            db.session.commit()
+
+        assert prune_idempotency_keys() == 2
+        remaining = []
+        for user_id in (1, 2):
+            use_shard(user_id)
+            remaining += [(row.user_id, row.key) for row in IdempotencyKey.query.filter_by(user_id=user_id)]
+        assert sorted(remaining) == [(1, 'new'), (2, 'new')]
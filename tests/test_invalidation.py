@@ -0,0 +1,111 @@
+import multiprocessing
+import pytest
+from app import create_app, db
+from app.models import User
+from app.sharding import use_shard
+from tests.conftest import make_config
+
+
+def add_user(app, user_id=1):
+    with app.app_context():
+        use_shard(user_id)
+        db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                            NFTno=user_id, password='secret'))
+        db.session.commit()
+
+
+def history_length(client, user_id=1):
+    response = client.get(f'/adventure_history?user_id={user_id}')
+    assert response.status_code == 200
+    return len(response.get_json()['adventure_history'])
+
+
+# Go on an adventure from a worker process of its own.
+def adventure_in_other_process(directory, user_id):
+    app = create_app(make_config(directory))
+    response = app.test_client().post('/adventure', json={'user_id': user_id})
+    assert response.status_code == 201
+
+
+@pytest.mark.parametrize('shards', [1, 2])
+def test_cached_reads_see_writes_from_another_app(make_app, shards):
+    writer = make_app(SHARD_COUNT=shards)
+    reader = make_app(SHARD_COUNT=shards, INVALIDATION_POLL_SECONDS=0)
+    add_user(writer)
+
+    # The reader caches the empty history, then the writer adds an adventure to the shared database.
+    assert history_length(reader.test_client()) == 0
+    assert history_length(reader.test_client()) == 0
+    assert writer.test_client().post('/adventure', json={'user_id': 1}).status_code == 201
+    assert history_length(reader.test_client()) == 1
+
+
+def test_cached_reads_see_writes_from_another_process(make_app, tmp_path):
+    reader = make_app(INVALIDATION_POLL_SECONDS=0)
+    add_user(reader)
+    assert history_length(reader.test_client()) == 0
+
+    process = multiprocessing.get_context('spawn').Process(target=adventure_in_other_process, args=(str(tmp_path), 1))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+    assert history_length(reader.test_client()) == 1
+
+
+def test_change_tracker_sees_commits_of_another_app(make_app):
+    writer = make_app()
+    reader = make_app(INVALIDATION_POLL_SECONDS=0)
+    add_user(writer)
+    tracker = reader.extensions['change_tracker']
+
+    with reader.app_context():
+        before = tracker.version('adventure', 'user', shard=0)
+    assert writer.test_client().post('/adventure', json={'user_id': 1}).status_code == 201
+    with reader.app_context():
+        after = tracker.version('adventure', 'user', shard=0)
+    assert after[0] == before[0] + 1
+    assert after[1] > before[1]
+
+
+# Writes for one user must not invalidate the cached reads of another.
+def test_user_versions_only_move_with_the_users_own_writes(make_app):
+    writer = make_app()
+    reader = make_app(INVALIDATION_POLL_SECONDS=0)
+    add_user(writer, 1)
+    add_user(writer, 2)
+    tracker = reader.extensions['change_tracker']
+    client = writer.test_client()
+
+    with reader.app_context():
+        first = tracker.user_version(1, shard=0), tracker.user_version(2, shard=0)
+    assert client.post('/adventure', json={'user_id': 2}).status_code == 201
+    with reader.app_context():
+        second = tracker.user_version(1, shard=0), tracker.user_version(2, shard=0)
+    assert second[0] == first[0]
+    assert second[1] > first[1]
+
+    assert client.post('/adventure', json={'user_id': 1}).status_code == 201
+    with reader.app_context():
+        third = tracker.user_version(1, shard=0), tracker.user_version(2, shard=0)
+    assert third[0] > second[0]
+    assert third[1] == second[1]
+
+
+# Users beyond INVALIDATION_MAX_USERS fall back to a floor at or after their latest write.
+def test_forgotten_users_share_a_floor_past_their_writes(make_app):
+    writer = make_app()
+    reader = make_app(INVALIDATION_POLL_SECONDS=0, INVALIDATION_MAX_USERS=1)
+    tracker = reader.extensions['change_tracker']
+    for user_id in (1, 2):
+        add_user(writer, user_id)
+    with reader.app_context():
+        tracker.user_version(1, shard=0)
+
+    client = writer.test_client()
+    assert client.post('/adventure', json={'user_id': 1}).status_code == 201
+    with reader.app_context():
+        after_first = tracker.user_version(1, shard=0)
+    assert client.post('/adventure', json={'user_id': 2}).status_code == 201
+    with reader.app_context():
+        assert tracker.user_version(1, shard=0) >= after_first
+        assert tracker.user_version(2, shard=0) > after_first
@@ -0,0 +1,87 @@
+import pickle
+import random
+from app import db
+from app.leaderboard import ScoreIndex, add_points
+
+
+# Ranks and top-N by sorting every score: a user's rank is one more than the number of
+# users with a higher score, and ties are listed by user id.
+def brute_force_top(scores, n):
+    ordered = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return [(1 + sum(other > score for other in scores.values()), user_id, score) for user_id, score in ordered[:n]]
+
+
+def assert_matches_brute_force(index, scores):
+    assert index.count == len(scores)
+    assert index.top(len(scores) + 5) == brute_force_top(scores, len(scores) + 5)
+    assert index.top(7) == brute_force_top(scores, 7)
+    for user_id, score in scores.items():
+        assert index.rank(user_id) == 1 + sum(other > score for other in scores.values())
+    assert index.rank(-1) is None
+
+
+def test_score_index_matches_brute_force():
+    rng = random.Random(1)
+    index, scores = ScoreIndex(), {}
+    for _ in range(3000):
+        user_id = rng.randrange(300)
+        # Scores mostly grow, with the occasional recount down, and cross the tree's size many times.
+        score = max(0, scores.get(user_id, 0) + rng.choice((0, 1, 2, 5, 20, 50, -30)))
+        index.set(user_id, score)
+        scores[user_id] = score
+    assert_matches_brute_force(index, scores)
+
+    restored = ScoreIndex.from_arrays(*index.to_arrays())
+    assert_matches_brute_force(restored, scores)
+
+
+def add_scores(app, scores):
+    with app.app_context():
+        for user_id, score in scores.items():
+            add_points(user_id, score)
+        db.session.commit()
+
+
+# A worker started from a snapshot ranks like the one that saved it, and then catches up with
+# scores earned since.
+def test_snapshot_round_trip(make_app):
+    rng = random.Random(2)
+    scores = {user_id: rng.randrange(1, 500) for user_id in range(1, 200)}
+    app = make_app()
+    add_scores(app, scores)
+    with app.app_context():
+        leaderboard = app.extensions['leaderboard']
+        assert leaderboard.top(len(scores)) == brute_force_top(scores, len(scores))
+        leaderboard.save_snapshot()
+
+    add_scores(app, {1: 1000})
+    scores[1] += 1000
+    restarted = make_app()
+    leaderboard = restarted.extensions['leaderboard']
+    # The snapshot is loaded when the worker starts, before any request.
+    assert leaderboard.index.count == len(scores)
+    with restarted.app_context():
+        assert leaderboard.top(len(scores)) == brute_force_top(scores, len(scores))
+        assert leaderboard.rank(1) == (1, scores[1])
+
+
+# Snapshots that are not in the expected format are ignored, never unpickled.
+def test_unusable_snapshots_are_ignored(make_app, tmp_path):
+    path = tmp_path / 'leaderboard.snapshot'
+    app = make_app()
+    add_scores(app, {1: 5, 2: 7})
+    with app.app_context():
+        app.extensions['leaderboard'].top(1)
+        app.extensions['leaderboard'].save_snapshot()
+    valid = path.read_bytes()
+
+    class Exploit:
+        def __reduce__(self):
+            return (exec, ("raise SystemExit('unpickled')",))
+
+    header, _, body = valid.partition(b'\n')
+    for content in (pickle.dumps(Exploit()), b'not json\n', valid[:-3], valid + b'x',
+                    header.replace(b'"format": 1', b'"format": 2') + b'\n' + body):
+        path.write_bytes(content)
+        leaderboard = make_app().extensions['leaderboard']
+        assert leaderboard.index.count == 0 and leaderboard.watermarks == {}
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from app import db
+from app.game_logic import PrizeManager
+from app.models import LootBox, Prize, PrizeLease, PrizeType, User
+
+
+def setup_catalog(app):
+    with app.app_context():
+        db.session.add(User(id=1, username='player', email='player@example.com', NFTno=1, password='secret'))
+        db.session.add(PrizeType(id=1, name='Sword', rarity='Common', quanity=100))
+        db.session.commit()
+
+
+# Forge `count` prizes the way LootBoxManager does, one transaction each.
+def claim(app, count):
+    with app.app_context():
+        user = db.session.get(User, 1)
+        for _ in range(count):
+            lootbox = LootBox(rarity='Common', user_id=user.id)
+            db.session.add(lootbox)
+            prize = PrizeManager(user, lootbox).create()
+            assert isinstance(prize, Prize)
+            db.session.commit()
+
+
+# number_claimed must always be the prizes handed out plus the units still held in leases.
+def assert_stock_balanced(app, held):
+    with app.app_context():
+        claimed = db.session.execute(select(PrizeType.number_claimed).where(PrizeType.id == 1)).scalar()
+        prizes = db.session.execute(select(func.count()).select_from(Prize)).scalar()
+        assert claimed == prizes + held
+        return prizes
+
+
+def live_units(pool):
+    return sum(lease.remaining for lease in pool._held.values() if lease.is_live())
+
+
+def test_number_claimed_matches_prizes_and_live_leases(make_app):
+    app = make_app(PRIZE_LEASE_SIZE=10, PRIZE_LEASE_RECLAIM_SECONDS=3600)
+    setup_catalog(app)
+    pool = app.extensions['prize_leases']
+
+    # A block of 10 is reserved and 6 units handed out from it.
+    claim(app, 6)
+    assert live_units(pool) == 4
+    assert_stock_balanced(app, 4)
+
+    # Spending the block returns it as soon as its last transaction ends.
+    claim(app, 4)
+    with app.app_context():
+        pool.release_settled()
+        assert db.session.execute(select(func.count()).select_from(PrizeLease)).scalar() == 0
+    assert_stock_balanced(app, 0)
+
+    # An expired lease goes back with its unused units.
+    claim(app, 1)
+    assert live_units(pool) == 9
+    for lease in pool._held.values():
+        lease.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    with app.app_context():
+        assert pool.release_settled() == 9
+    assert not pool._held
+    assert_stock_balanced(app, 0)
+
+    # A dead worker's lease, 2 of its 10 units used, is reclaimed after the grace period.
+    with app.app_context():
+        expired = datetime.utcnow() - timedelta(seconds=app.config['PRIZE_LEASE_GRACE_SECONDS'] + 1)
+        lease = PrizeLease(prize_type_id=1, units=10, owner='dead-host:1', expires_at=expired)
+        db.session.add(lease)
+        db.session.flush()
+        db.session.add_all([Prize(user_id=1, prize_type_id=1, lease_id=lease.id) for _ in range(2)])
+        db.session.get(PrizeType, 1).number_claimed += 10
+        db.session.commit()
+        assert pool.reclaim_expired() == 8
+    assert_stock_balanced(app, 0)
+
+    # Shutting down returns the live lease too.
+    claim(app, 3)
+    assert_stock_balanced(app, 7)
+    pool.release_all()
+    prizes = assert_stock_balanced(app, 0)
+    assert prizes == 16
+    with app.app_context():
+        assert db.session.execute(select(func.count()).select_from(PrizeLease)).scalar() == 0
+
+
+# A unit whose transaction rolls back is not a prize, so it goes back with the lease.
+def test_rolled_back_units_return_to_stock(make_app):
+    app = make_app(PRIZE_LEASE_SIZE=5, PRIZE_LEASE_RECLAIM_SECONDS=3600)
+    setup_catalog(app)
+    pool = app.extensions['prize_leases']
+
+    claim(app, 2)
+    with app.app_context():
+        user = db.session.get(User, 1)
+        for _ in range(3):
+            lootbox = LootBox(rarity='Common', user_id=user.id)
+            db.session.add(lootbox)
+            PrizeManager(user, lootbox).create()
+            db.session.rollback()
+        assert pool.release_settled() == 3
+    assert_stock_balanced(app, 0)
@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event
+from app import db
+from app.models import LootBox, Prize, PrizeType, User
+from app.sharding import use_shard
+
+
+# Give a user `count` lootboxes and prizes, each prize of a prize type of its own.
+def add_user_with_items(app, user_id, count):
+    now = datetime.utcnow()
+    with app.app_context():
+        prize_types = [PrizeType(name=f"type{user_id}-{index}", rarity='Rare', quanity=10, number_claimed=1)
+                       for index in range(count)]
+        db.session.add_all(prize_types)
+        db.session.commit()
+        use_shard(user_id)
+        db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                            NFTno=user_id, password='secret'))
+        for index, prize_type in enumerate(prize_types):
+            timestamp = now - timedelta(minutes=index)
+            db.session.add(LootBox(user_id=user_id, timestamp=timestamp, rarity='Rare'))
+            db.session.add(Prize(user_id=user_id, prize_type_id=prize_type.id, timestamp=timestamp))
+        db.session.commit()
+
+
+# Collect the statements run on any of the app's databases.
+@contextmanager
+def recorded_statements(app):
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', record)
+
+
+# A page costs the same number of queries whether it holds a few rows or many: the prize
+# types come in the page's query, or in one more query per page when the catalog is apart.
+@pytest.mark.parametrize('shards', [1, 2])
+@pytest.mark.parametrize('path, queries', [('/lootboxes', 1), ('/prizes', 1)])
+def test_listing_queries_do_not_grow_with_rows(make_app, shards, path, queries):
+    app = make_app(SHARD_COUNT=shards)
+    add_user_with_items(app, 1, 2)
+    add_user_with_items(app, 2, 40)
+    if shards > 1 and path == '/prizes':
+        queries += 1
+
+    client = app.test_client()
+    counts = []
+    for user_id, count in ((1, 2), (2, 40)):
+        # Load the user first, so only the listing's own queries are counted.
+        assert client.get(f"/users/{user_id}/state").status_code == 200
+        with recorded_statements(app) as statements:
+            response = client.get(path, query_string={'user_id': user_id, 'limit': 100})
+        assert response.status_code == 200
+        assert len(response.get_json()[path.strip('/')]) == count
+        counts.append(len([statement for statement in statements if 'loot_box' in statement or 'prize' in statement]))
+    assert counts == [queries, queries]
@@ -0,0 +1,10 @@
+# The counters are only served to admins, and not at all without an ADMIN_TOKEN.
+def test_metrics_require_admin_token(make_app):
+    assert make_app().test_client().get('/metrics').status_code == 404
+
+    client = make_app(ADMIN_TOKEN='secret').test_client()
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    response = client.get('/metrics', headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 200
+    assert isinstance(response.get_json(), dict)
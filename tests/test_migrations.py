@@ -0,0 +1,61 @@
+import sqlite3
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import Adventure, Prize, PrizeType
+from app.sharding import create_all
+from tests.conftest import make_config
+
+# The schema the first release created, before change sequences, prize leases, weights and AUTOINCREMENT.
+BASELINE_SCHEMA = """
+CREATE TABLE user (
+    id INTEGER NOT NULL, username VARCHAR(120) NOT NULL, email VARCHAR(120) NOT NULL,
+    "NFTno" INTEGER NOT NULL, password VARCHAR(60) NOT NULL, current_threshold INTEGER, reset_threshold INTEGER,
+    PRIMARY KEY (id), UNIQUE (username), UNIQUE (email)
+);
+CREATE TABLE prize_type (
+    id INTEGER NOT NULL, name VARCHAR(120) NOT NULL, rarity VARCHAR(120) NOT NULL,
+    quanity INTEGER NOT NULL, number_claimed INTEGER NOT NULL, PRIMARY KEY (id)
+);
+CREATE TABLE adventure (
+    id INTEGER NOT NULL, timestamp DATETIME NOT NULL, rng_score INTEGER NOT NULL, material VARCHAR(120) NOT NULL,
+    status VARCHAR(120) NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id)
+);
+CREATE TABLE loot_box (
+    id INTEGER NOT NULL, timestamp DATETIME NOT NULL, rarity VARCHAR(120) NOT NULL, user_id INTEGER NOT NULL,
+    PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id)
+);
+CREATE TABLE prize (
+    id INTEGER NOT NULL, user_id INTEGER NOT NULL, prize_type_id INTEGER NOT NULL, timestamp DATETIME NOT NULL,
+    PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id), FOREIGN KEY(prize_type_id) REFERENCES prize_type (id)
+);
+"""
+
+
+# A database made by the first release keeps its rows and works with the current models after create_all.
+def test_create_all_upgrades_baseline_database(tmp_path):
+    old = (datetime.utcnow() - timedelta(days=2)).isoformat(' ')
+    with sqlite3.connect(tmp_path / 'site.db') as conn:
+        conn.executescript(BASELINE_SCHEMA)
+        conn.execute("INSERT INTO user VALUES (1, 'player', 'player@example.com', 1, 'secret', 500, 500)")
+        conn.execute("INSERT INTO prize_type VALUES (1, 'Sword', 'Rare', 10, 1)")
+        conn.execute("INSERT INTO adventure VALUES (7, ?, 300, 'None', 'No Material', 1)", (old,))
+        conn.execute("INSERT INTO prize VALUES (1, 1, 1, ?)", (old,))
+    conn.close()
+
+    app = create_app(make_config(tmp_path))
+    with app.app_context():
+        create_all()
+        # Running it again on an up-to-date database changes nothing.
+        create_all()
+        assert db.session.get(Adventure, 7).change_seq == 0
+        assert db.session.get(Prize, 1).lease_id is None
+        # Prize types without a configured weight are drawn by their remaining stock.
+        assert db.session.get(PrizeType, 1).weight is None
+
+    assert app.test_client().post('/adventure', json={'user_id': 1}).status_code == 201
+    with sqlite3.connect(tmp_path / 'site.db') as conn:
+        assert 'AUTOINCREMENT' in conn.execute("SELECT sql FROM sqlite_master WHERE name = 'adventure'").fetchone()[0]
+        assert conn.execute("SELECT max(id) FROM adventure").fetchone()[0] == 8
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    assert {'ix_adventure_user_id_change_seq', 'ix_loot_box_user_id_timestamp', 'ix_prize_user_id_timestamp'} <= indexes
@@ -0,0 +1,95 @@
+import pytest
+from flask import g
+from sqlalchemy import select
+from app import db, game_logic
+from app.game_logic import AdventureManager, PreRollManager
+from app.models import PreRolledAdventure, User
+from app.sharding import shard_count, use_shard
+
+# What a fresh roll always gives here, telling it apart from the pre-rolled scores.
+FRESH_SCORE = 300
+
+
+@pytest.fixture(autouse=True)
+def fixed_rolls(monkeypatch):
+    monkeypatch.setattr(game_logic, 'randint', lambda low, high: FRESH_SCORE)
+
+
+def add_user(user_id):
+    use_shard(user_id)
+    db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                        NFTno=user_id, password='secret'))
+    db.session.commit()
+
+
+def add_pre_roll(user_id, threshold, rng_score, seal=None):
+    use_shard(user_id)
+    db.session.add(PreRolledAdventure(user_id=user_id, threshold=threshold, rng_score=rng_score,
+                                      seal=seal or PreRollManager.seal(user_id, threshold, rng_score)))
+    db.session.commit()
+
+
+# Every shard's pre-rolls, as rows rather than objects: ids repeat across shards, and the
+# session would hand back one shard's object for another's row.
+def pre_rolls():
+    rows = []
+    for shard in range(shard_count()):
+        g.shard = shard
+        rows += db.session.execute(select(PreRolledAdventure.user_id, PreRolledAdventure.id, PreRolledAdventure.threshold,
+                                          PreRolledAdventure.rng_score, PreRolledAdventure.seal)).all()
+    return sorted(rows)
+
+
+def adventure_score(user_id):
+    use_shard(user_id)
+    return AdventureManager(db.session.get(User, user_id)).create().rng_score
+
+
+# A pre-roll is the user's next adventure, and only that one: it is deleted as it is used.
+def test_pre_roll_is_used_once(app):
+    with app.app_context():
+        add_user(1)
+        add_pre_roll(1, 500, 3)
+        assert adventure_score(1) == 3
+        assert pre_rolls() == []
+        assert adventure_score(1) == FRESH_SCORE
+
+
+# A pre-roll whose score or seal was edited, or drawn against a threshold the user no longer
+# has, is thrown away and the adventure rolled afresh.
+@pytest.mark.parametrize('edit', ['score', 'seal', 'stale threshold'])
+def test_unusable_pre_roll_falls_back_to_fresh_roll(app, edit):
+    with app.app_context():
+        add_user(1)
+        if edit == 'stale threshold':
+            add_pre_roll(1, 490, 3)
+        else:
+            add_pre_roll(1, 500, FRESH_SCORE - 1)
+            use_shard(1)
+            PreRolledAdventure.query.filter_by(user_id=1).update({'rng_score': 3} if edit == 'score' else {'seal': '0' * 64})
+            db.session.commit()
+        assert adventure_score(1) == FRESH_SCORE
+        assert pre_rolls() == []
+
+
+# generate pre-rolls for every user without a usable pre-roll: valid ones are kept, stale ones
+# replaced, and a second run has nothing left to do.
+@pytest.mark.parametrize('shards', [1, 2])
+def test_generate_skips_users_with_a_pre_roll(make_app, shards):
+    app = make_app(SHARD_COUNT=shards)
+    with app.app_context():
+        for user_id in range(1, 8):
+            add_user(user_id)
+        add_pre_roll(1, 500, 3)
+        kept = pre_rolls()[0].id
+        add_pre_roll(2, 490, 3)
+
+        assert PreRollManager.generate(chunk_size=2) == 6
+        rows = pre_rolls()
+        assert [row.user_id for row in rows] == list(range(1, 8))
+        assert (rows[0].id, rows[0].rng_score) == (kept, 3)
+        for row in rows[1:]:
+            assert (row.threshold, row.rng_score) == (500, FRESH_SCORE)
+            assert row.seal == PreRollManager.seal(row.user_id, row.threshold, row.rng_score)
+
+        assert PreRollManager.generate(chunk_size=2) == 0
@@ -0,0 +1,102 @@
+import os
+from types import SimpleNamespace
+import pytest
+from app import rate_limit
+from app.rate_limit import MemoryTokenBuckets, RateLimiter, SharedMemoryTokenBuckets, TokenBuckets
+
+LIMITS = {'adventure_endpoint': {'user': (2, 60), 'ip': (3, 60)}}
+
+
+# Without an 'ip' limit, users sharing an address (say, behind one proxy) are limited only each on their own.
+def test_no_ip_limit_by_default(app):
+    client = app.test_client()
+    statuses = [client.post('/adventure', json={'user_id': user_id}).status_code for user_id in range(1, 50)]
+    assert 429 not in statuses
+
+
+# Per-IP limits count the client address forwarded by the trusted proxy, not the proxy's.
+def test_ip_limit_behind_trusted_proxy(make_app):
+    app = make_app(RATE_LIMITS=LIMITS, RATE_LIMIT_TRUSTED_PROXIES=1)
+    client = app.test_client()
+
+    def post(user_id, address):
+        return client.post('/adventure', json={'user_id': user_id}, headers={'X-Forwarded-For': address}).status_code
+
+    assert [post(user_id, '203.0.113.1') for user_id in range(1, 5)][-1] == 429
+    assert post(5, '203.0.113.2') != 429
+
+
+# Worker processes attached to the same segment share their buckets.
+def test_shared_memory_buckets_are_shared():
+    name = f"test_rate_limit_{os.getpid()}"
+    first = SharedMemoryTokenBuckets(name, 64)
+    second = SharedMemoryTokenBuckets(name, 64)
+    try:
+        limiter, other = RateLimiter(LIMITS, first), RateLimiter(LIMITS, second)
+        assert limiter.check('adventure_endpoint', 1, None) == 0
+        assert other.check('adventure_endpoint', 1, None) == 0
+        assert limiter.check('adventure_endpoint', 1, None) > 0
+    finally:
+        second.close()
+        first.close(unlink=True)
+
+
+# A clock standing still until moved, in place of time.time() in the rate limiter.
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(rate_limit, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+# A full bucket allows a burst of `requests`, then one more request per emission interval
+# (seconds / requests), telling refused requests exactly how long to wait.
+def test_gcra_burst_then_one_per_interval(clock):
+    buckets = MemoryTokenBuckets(64)
+    key = [('user:1', 3, 60)]
+    assert [buckets.take(key) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take(key) == pytest.approx(20)
+
+    clock.now += 19.5
+    assert buckets.take(key) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert buckets.take(key) == 0
+    assert buckets.take(key) == pytest.approx(20)
+
+    # Left alone for a whole period, the bucket is full again.
+    clock.now += 60
+    assert [buckets.take(key) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take(key) == pytest.approx(20)
+
+
+# A refused request takes no token from any of its buckets, and the route answers with the
+# wait rounded up in Retry-After.
+def test_refused_request_reports_retry_after(make_app, clock):
+    app = make_app(RATE_LIMITS={'adventure_endpoint': {'user': (3, 60), 'ip': (4, 60)}})
+    client = app.test_client()
+    statuses = [client.post('/adventure', json={'user_id': 1}).status_code for _ in range(4)]
+    assert 429 not in statuses[:3] and statuses[3] == 429
+
+    clock.now += 10.5
+    response = client.post('/adventure', json={'user_id': 1})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '10'
+    # The per-IP bucket still has the token the refused requests did not take.
+    assert client.post('/adventure', json={'user_id': 2}).status_code != 429
+    assert client.post('/adventure', json={'user_id': 3}).status_code == 429
+
+
+# When every slot a new key could use holds a live bucket, the fullest one is dropped to make
+# room: its key starts over with a full bucket, and every other key keeps its own.
+def test_fullest_bucket_is_dropped_when_probe_is_full(clock):
+    buckets = MemoryTokenBuckets(TokenBuckets.PROBE_LENGTH)
+    keys = [f"user:{index}" for index in range(TokenBuckets.PROBE_LENGTH + 1)]
+    for key in keys[:-1]:
+        assert buckets.take([(key, 1, 60)]) == 0
+        clock.now += 1
+    assert all(buckets.take([(key, 1, 60)]) > 0 for key in keys[:-1])
+
+    # The newcomer takes the slot of the bucket nearest full, the first key's.
+    assert buckets.take([(keys[-1], 1, 60)]) == 0
+    assert all(buckets.take([(key, 1, 60)]) > 0 for key in keys[1:])
+    assert buckets.take([(keys[0], 1, 60)]) == 0
@@ -0,0 +1,84 @@
+import json
+import pytest
+import replay
+from app import db
+from app.models import User
+
+
+@pytest.fixture
+def recording_app(make_app, tmp_path):
+    def make_recording_app(rate):
+        return make_app(REQUEST_LOG_PATH=f"{tmp_path}/requests-{{pid}}.log", REQUEST_LOG_SAMPLE_RATE=rate,
+                        ADMIN_TOKEN='secret')
+    return make_recording_app
+
+
+# Stop the app's recorder, so every line is written, and read the log back as replay.py does.
+def recorded(app, tmp_path):
+    app.extensions['request_recorder'].close()
+    return replay.load([f"{tmp_path}/requests-*.log"])
+
+
+# A user is always in the sample or always out of it, in every worker, and consecutive ids
+# are sampled at about the configured rate.
+def test_users_are_sampled_deterministically(recording_app):
+    first = recording_app(0.25).extensions['request_recorder']
+    second = recording_app(0.25).extensions['request_recorder']
+    sampled = [user_id for user_id in range(1, 4001) if first.sampled(user_id)]
+    assert sampled == [user_id for user_id in range(1, 4001) if first.sampled(user_id)]
+    assert sampled == [user_id for user_id in range(1, 4001) if second.sampled(user_id)]
+    assert 900 < len(sampled) < 1100
+    assert 200 < sum(user_id <= 1000 for user_id in sampled) < 300
+    first.close()
+    second.close()
+
+
+# Only the sampled users' requests are written, all of them.
+def test_only_sampled_users_are_recorded(recording_app, tmp_path):
+    app = recording_app(0.5)
+    recorder = app.extensions['request_recorder']
+    sampled = next(user_id for user_id in range(1, 100) if recorder.sampled(user_id))
+    unsampled = next(user_id for user_id in range(1, 100) if not recorder.sampled(user_id))
+    client = app.test_client()
+    for _ in range(3):
+        for user_id in (sampled, unsampled):
+            client.get(f"/users/{user_id}/state")
+    assert [entry['p'] for entry in recorded(app, tmp_path)] == [f"/users/{sampled}/state"] * 3
+
+
+# Metrics scrapes and admin requests are never written, even with every request sampled.
+def test_metrics_and_admin_requests_are_not_recorded(recording_app, tmp_path):
+    app = recording_app(1.0)
+    client = app.test_client()
+    headers = {'X-Admin-Token': 'secret'}
+    assert client.get('/metrics', headers=headers).status_code == 200
+    assert client.get('/admin/cancelled_queries', headers=headers).status_code == 200
+    assert client.get('/admin/export/adventures', headers=headers).status_code == 200
+    assert client.get('/users/1/state').status_code == 404
+    assert [entry['e'] for entry in recorded(app, tmp_path)] == ['main.get_user_state']
+
+
+# A written line reads back through replay.py's loader with everything needed to re-issue
+# the request: method, path with query string, JSON body, Accept header and status.
+def test_recorded_lines_round_trip_through_replay(recording_app, tmp_path):
+    app = recording_app(1.0)
+    with app.app_context():
+        db.session.add(User(id=1, username='player', email='player@example.com', NFTno=1, password='secret'))
+        db.session.commit()
+    client = app.test_client()
+    body = {'user_id': 1}
+    assert client.post('/adventure', json=body).status_code == 201
+    assert client.get('/users/1/state?limit=5').status_code == 200
+    # The user is not eligible again for a day, so the event stream is closed unread.
+    stream = client.get('/users/1/eligibility', headers={'Accept': 'text/event-stream'})
+    assert stream.status_code == 200
+    stream.close()
+
+    adventure, state, eligibility = recorded(app, tmp_path)
+    assert adventure['t'] <= state['t'] <= eligibility['t']
+    assert (adventure['e'], adventure['m'], adventure['p'], adventure['s']) == ('main.adventure_endpoint', 'POST', '/adventure', 201)
+    assert json.loads(adventure['b']) == body
+    assert 'a' not in adventure and adventure['d'] >= 0
+    assert (state['m'], state['p'], state['s']) == ('GET', '/users/1/state?limit=5', 200)
+    assert 'b' not in state
+    assert eligibility['a'] == 'text/event-stream'
@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+import pytest
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.game_logic import AdventureManager
+from app.metrics import metrics
+from app.models import Adventure, User
+from app.retry import run_transaction
+
+# Retry quickly, and let SQLite wait only briefly for a lock before reporting it.
+FAST_RETRIES = {
+    'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 0.02}},
+    'WRITE_RETRY_BASE_SECONDS': 0.01,
+    'WRITE_RETRY_MAX_SECONDS': 0.05,
+}
+
+
+def counters(name):
+    snapshot = metrics.snapshot()
+    return {event: snapshot.get(f"retry.{name}.{event}", 0) for event in ('retried', 'succeeded_after_retry', 'gave_up')}
+
+
+def moved(before, after):
+    return {event: after[event] - before[event] for event in before}
+
+
+def driver_error(message):
+    return OperationalError("UPDATE something", {}, sqlite3.OperationalError(message))
+
+
+def add_user(app):
+    with app.app_context():
+        db.session.add(User(id=1, username='player', email='player@example.com', NFTno=1, password='secret'))
+        db.session.commit()
+
+
+# Hold the write lock of the database from another connection, like a concurrent writer.
+def hold_write_lock(tmp_path):
+    blocker = sqlite3.connect(tmp_path / 'site.db', isolation_level=None, check_same_thread=False)
+    blocker.execute("BEGIN IMMEDIATE")
+    return blocker
+
+
+# An adventure blocked by another writer is retried until the lock is released, then commits exactly once.
+def test_adventure_commits_once_after_lock_is_released(make_app, tmp_path):
+    app = make_app(WRITE_RETRY_ATTEMPTS=100, **FAST_RETRIES)
+    add_user(app)
+    before = counters('adventure')
+
+    blocker = hold_write_lock(tmp_path)
+    release = threading.Timer(0.3, blocker.rollback)
+    release.start()
+    try:
+        response = app.test_client().post('/adventure', json={'user_id': 1})
+    finally:
+        release.join()
+        blocker.close()
+
+    assert response.status_code == 201
+    with app.app_context():
+        assert Adventure.query.count() == 1
+    change = moved(before, counters('adventure'))
+    assert change['retried'] > 0
+    assert change['succeeded_after_retry'] == 1
+    assert change['gave_up'] == 0
+
+
+# A lock that is never released fails the write after WRITE_RETRY_ATTEMPTS attempts, leaving nothing behind.
+def test_adventure_gives_up_after_configured_attempts(make_app, tmp_path):
+    app = make_app(WRITE_RETRY_ATTEMPTS=3, **FAST_RETRIES)
+    add_user(app)
+    before = counters('adventure')
+
+    blocker = hold_write_lock(tmp_path)
+    try:
+        with app.app_context():
+            with pytest.raises(OperationalError, match='database is locked'):
+                AdventureManager(db.session.get(User, 1)).create()
+    finally:
+        blocker.close()
+
+    with app.app_context():
+        assert Adventure.query.count() == 0
+    assert moved(before, counters('adventure')) == {'retried': 2, 'succeeded_after_retry': 0, 'gave_up': 1}
+
+
+# Each attempt starts from a rolled-back session, so it re-runs from its first read.
+def test_lock_error_rolls_back_before_rerunning(app):
+    attempts = []
+
+    def unit():
+        attempts.append(list(db.session.new))
+        db.session.add(User(id=len(attempts), username=f"user{len(attempts)}", email=f"user{len(attempts)}@example.com",
+                            NFTno=1, password='secret'))
+        if len(attempts) < 3:
+            raise driver_error('database is locked')
+        return 'done'
+
+    with app.app_context():
+        app.config.update(WRITE_RETRY_BASE_SECONDS=0, WRITE_RETRY_MAX_SECONDS=0)
+        before = counters('probe')
+        assert run_transaction('probe', unit) == 'done'
+        db.session.rollback()
+    assert attempts == [[], [], []]
+    assert moved(before, counters('probe')) == {'retried': 2, 'succeeded_after_retry': 1, 'gave_up': 0}
+
+
+# Operational errors other than lock conflicts are raised at once.
+def test_other_operational_errors_are_not_retried(app):
+    calls = []
+
+    def unit():
+        calls.append(1)
+        raise driver_error('no such table: adventure')
+
+    with app.app_context():
+        before = counters('probe')
+        with pytest.raises(OperationalError, match='no such table'):
+            run_transaction('probe', unit)
+    assert len(calls) == 1
+    assert moved(before, counters('probe')) == {'retried': 0, 'succeeded_after_retry': 0, 'gave_up': 0}
@@ -0,0 +1,133 @@
+import random
+import runpy
+from datetime import datetime, timedelta
+import pytest
+from flask import g
+from sqlalchemy import func, select
+from app import db
+from app.archive import archive_adventures
+from app.models import Adventure, DropRollup, PrizeType, User
+from app.rollups import _floor, drop_counts, record_drop
+from app.sharding import shard_count, use_shard
+from app.synthetic import RARITIES, generate
+
+NAMES = ('Common', 'Rare', 'Legendary')
+START = datetime(2024, 3, 1)
+
+
+# Record drops at random times over five days on random shards, and return them.
+def record_random_drops(rng, count):
+    drops = []
+    for _ in range(count):
+        timestamp = START + timedelta(seconds=rng.randrange(5 * 86400), microseconds=rng.randrange(10 ** 6))
+        name = rng.choice(NAMES)
+        g.shard = rng.randrange(shard_count())
+        record_drop('material', name, timestamp)
+        db.session.commit()
+        drops.append((timestamp, name))
+    return drops
+
+
+# Drops per name in the whole minutes from since's to until's, counted one by one.
+def brute_force_counts(drops, since, until):
+    counts = {}
+    for timestamp, name in drops:
+        if _floor(since, 60) <= timestamp < _floor(until, 60):
+            counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+# Random windows, and windows starting late on one day and ending early on another, so both
+# edges are made of hours and minutes around whole days.
+def windows(rng):
+    for _ in range(200):
+        since = START - timedelta(hours=6) + timedelta(seconds=rng.randrange(6 * 86400))
+        yield since, since + timedelta(seconds=rng.randrange(3 * 86400))
+    for days in range(4):
+        since = START + timedelta(hours=23, minutes=rng.randrange(60), seconds=rng.randrange(60))
+        yield since, since + timedelta(days=days, hours=1, minutes=rng.randrange(60), seconds=rng.randrange(60))
+
+
+# The bucket ranges tile the window exactly, each aligned to its resolution, and the counts
+# read from them match counting the drops themselves.
+@pytest.mark.parametrize('shards', [1, 2])
+def test_drop_counts_match_brute_force(make_app, shards):
+    rng = random.Random(5)
+    app = make_app(SHARD_COUNT=shards)
+    seconds = {'day': 86400, 'hour': 3600, 'minute': 60}
+    with app.app_context():
+        drops = record_random_drops(rng, 400)
+        for since, until in windows(rng):
+            counts, ranges = drop_counts('material', since, until)
+            assert counts == brute_force_counts(drops, since, until)
+            assert len(ranges) <= 5
+            position = _floor(since, 60)
+            for resolution, start, end in ranges:
+                assert start == position and start < end
+                assert _floor(start, seconds[resolution]) == start and _floor(end, seconds[resolution]) == end
+                position = end
+            assert position == max(_floor(until, 60), _floor(since, 60)) or not ranges
+
+    # The endpoint counts the minute `until` falls in as well.
+    since, until = START + timedelta(hours=22, minutes=5), START + timedelta(days=2, hours=3, minutes=7, seconds=30)
+    body = app.test_client().get('/analytics/drops', query_string={
+        'since': since.isoformat(), 'until': until.isoformat()}).get_json()
+    expected = brute_force_counts(drops, since, until + timedelta(minutes=1))
+    assert body['counts'] == expected and body['total'] == sum(expected.values())
+
+
+# (user_id, adventure id) of five unused materials of one user.
+def unused_materials():
+    for shard in range(shard_count()):
+        g.shard = shard
+        for (user_id,) in db.session.execute(
+                select(Adventure.user_id).where(Adventure.status == 'Unused Material')
+                .group_by(Adventure.user_id).having(func.count() >= 5)):
+            return [(user_id, adventure.id) for adventure in Adventure.query.filter_by(
+                user_id=user_id, status='Unused Material').limit(5)]
+
+
+def rollup_rows():
+    rows = []
+    for shard in range(shard_count()):
+        g.shard = shard
+        rows += [(shard,) + tuple(row) for row in db.session.execute(
+            select(DropRollup.resolution, DropRollup.bucket, DropRollup.kind, DropRollup.name, DropRollup.count))]
+    return sorted(rows)
+
+
+# rebuild_rollups.py recounts from history exactly the buckets kept up to date as drops
+# happened: synthetic history, adventures and forges made through the API, and adventures
+# archived since.
+@pytest.mark.parametrize('shards', [1, 2])
+def test_rebuild_reproduces_maintained_rollups(make_app, monkeypatch, shards):
+    app = make_app(SHARD_COUNT=shards, ARCHIVE_PAUSE_SECONDS=0)
+    with app.app_context():
+        for rarity in RARITIES:
+            db.session.add(PrizeType(name=rarity, rarity=rarity, quanity=1000))
+        db.session.commit()
+        generate(30, 20, forge_rate=0, seed=3)
+        for user_id in range(31, 37):
+            use_shard(user_id)
+            db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                                NFTno=user_id, password='secret'))
+            db.session.commit()
+
+    client = app.test_client()
+    for user_id in range(31, 37):
+        assert client.post('/adventure', json={'user_id': user_id}).status_code == 201
+    with app.app_context():
+        material_ids = unused_materials()
+    user_id = material_ids[0][0]
+    material_ids = [adventure_id for _, adventure_id in material_ids]
+    assert client.post('/forge_lootbox', json={'user_id': user_id, 'material_ids': material_ids}).status_code == 201
+
+    with app.app_context():
+        assert archive_adventures(retention_days=10) > 0
+        maintained = rollup_rows()
+    assert maintained
+
+    monkeypatch.setattr('app.create_app', lambda: app)
+    runpy.run_path('rebuild_rollups.py')
+    with app.app_context():
+        assert rollup_rows() == maintained
@@ -0,0 +1,57 @@
+import random
+from collections import Counter
+from app import db
+from app.models import PrizeType
+from app.sampling import AliasTable
+
+# Upper 0.1% points of the chi-square distribution by degrees of freedom.
+CHI_SQUARE_CRITICAL = {1: 10.828, 3: 16.266, 4: 18.467}
+
+
+# Pearson's chi-square statistic of observed counts against weights.
+def chi_square(counts, weights, draws):
+    total = sum(weights.values())
+    return sum((counts[item] - draws * weight / total) ** 2 / (draws * weight / total) for item, weight in weights.items())
+
+
+def test_alias_table_draws_in_proportion_to_weights():
+    random.seed(29)
+    weights = {'a': 1, 'b': 2.5, 'c': 10, 'd': 0.25, 'e': 6}
+    table = AliasTable(list(weights), list(weights.values()))
+    draws = 200000
+    counts = Counter(table.sample() for _ in range(draws))
+    assert set(counts) == set(weights)
+    assert chi_square(counts, weights, draws) < CHI_SQUARE_CRITICAL[4]
+
+
+def test_prize_types_are_drawn_by_weight(app):
+    random.seed(2900)
+    weights = {1: 1.0, 2: 2.0, 3: 3.0, 4: 4.0}
+    with app.app_context():
+        for prize_type_id, weight in weights.items():
+            db.session.add(PrizeType(id=prize_type_id, name=f"Prize {prize_type_id}", rarity='Rare', quanity=1000, weight=weight))
+        # Another rarity's prize types are never drawn.
+        db.session.add(PrizeType(id=5, name='Other', rarity='Common', quanity=1000, weight=100.0))
+        db.session.commit()
+        table = app.extensions['prize_leases']._table('Rare')
+
+    draws = 100000
+    counts = Counter(table.sample() for _ in range(draws))
+    assert set(counts) == set(weights)
+    assert chi_square(counts, weights, draws) < CHI_SQUARE_CRITICAL[3]
+
+
+# Without a configured weight, prize types are drawn by their remaining stock.
+def test_unweighted_prize_types_are_drawn_by_remaining_stock(app):
+    random.seed(2901)
+    with app.app_context():
+        db.session.add(PrizeType(id=1, name='Plenty', rarity='Rare', quanity=900, number_claimed=100))
+        db.session.add(PrizeType(id=2, name='Scarce', rarity='Rare', quanity=300, number_claimed=100))
+        db.session.add(PrizeType(id=3, name='Gone', rarity='Rare', quanity=50, number_claimed=50))
+        db.session.commit()
+        table = app.extensions['prize_leases']._table('Rare')
+
+    draws = 50000
+    counts = Counter(table.sample() for _ in range(draws))
+    assert 3 not in counts
+    assert chi_square(counts, {1: 800, 2: 200}, draws) < CHI_SQUARE_CRITICAL[1]
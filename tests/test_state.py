@@ -0,0 +1,21 @@
+from datetime import datetime, timedelta
+from app import db
+from app.models import Adventure, User
+
+
+# Eligibility follows the latest adventure by timestamp, as POST /adventure does, whatever the ids.
+def test_state_eligibility_matches_adventure_endpoint(app):
+    now = datetime.utcnow()
+    with app.app_context():
+        db.session.add(User(id=1, username='player', email='player@example.com', NFTno=1, password='secret'))
+        db.session.add(Adventure(id=1, user_id=1, timestamp=now - timedelta(hours=2), rng_score=300,
+                                 material='None', status='No Material'))
+        db.session.add(Adventure(id=2, user_id=1, timestamp=now - timedelta(days=3), rng_score=300,
+                                 material='None', status='No Material'))
+        db.session.commit()
+
+    client = app.test_client()
+    state = client.get('/users/1/state').get_json()
+    assert state['eligible'] is False
+    assert state['next_eligible_at'] == (now - timedelta(hours=2) + timedelta(days=1)).isoformat()
+    assert client.post('/adventure', json={'user_id': 1}).status_code == 403
@@ -0,0 +1,161 @@
+import base64
+import json
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import insert, select
+from app import db
+from app.archive import ARCHIVED_COLUMNS, archive_adventures
+from app.invalidation import bump_version
+from app.models import Adventure, ArchivedAdventure, ChangeCounter, PrizeType, User
+from app.sharding import use_shard
+from app.synthetic import RARITIES
+
+
+def add_user(app, user_id):
+    with app.app_context():
+        use_shard(user_id)
+        db.session.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                            NFTno=user_id, password='secret'))
+        db.session.commit()
+
+
+# Give a user unused materials, each stamped with a change sequence as a write would, and
+# return their ids.
+def add_materials(app, user_id, count, timestamp=None):
+    with app.app_context():
+        use_shard(user_id)
+        adventures = []
+        for _ in range(count):
+            adventure = Adventure(user_id=user_id, timestamp=timestamp or datetime.utcnow(), rng_score=10,
+                                  material='Common', status='Unused Material', change_seq=bump_version('adventure'))
+            db.session.add(adventure)
+            adventures.append(adventure)
+        db.session.commit()
+        return [adventure.id for adventure in adventures]
+
+
+def add_prize_types(app):
+    with app.app_context():
+        for rarity in RARITIES:
+            db.session.add(PrizeType(name=rarity, rarity=rarity, quanity=10))
+        db.session.commit()
+
+
+def sync(client, user_id, token=None, limit=None):
+    params = {key: value for key, value in (('token', token), ('limit', limit)) if value is not None}
+    response = client.get(f"/users/{user_id}/sync", query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def ids(body, name):
+    return [row['id'] for row in body[name]]
+
+
+# The first sync, without a token, returns all of the user's rows and none of anyone else's;
+# the next one returns only what changed since.
+@pytest.mark.parametrize('shards', [1, 2])
+def test_sync_returns_changes_since_token(make_app, shards):
+    app = make_app(SHARD_COUNT=shards)
+    add_user(app, 1)
+    add_user(app, 2)
+    first = add_materials(app, 1, 3)
+    add_materials(app, 2, 2)
+    client = app.test_client()
+
+    body = sync(client, 1)
+    assert ids(body, 'adventures') == first
+    assert body['lootboxes'] == [] and body['prizes'] == []
+    assert body['has_more'] is False
+
+    later = add_materials(app, 1, 2)
+    add_materials(app, 2, 1)
+    again = sync(client, 1, body['token'])
+    assert ids(again, 'adventures') == later
+    assert again['has_more'] is False
+
+    # Nothing changed since, so nothing comes back and the token stays put.
+    unchanged = sync(client, 1, again['token'])
+    assert unchanged['adventures'] == [] and unchanged['token'] == again['token']
+
+
+# A forge stamps the materials it used with its own change sequence, so a client synced
+# before the forge sees them again as used, along with the new lootbox and prize.
+def test_forged_materials_come_back_with_the_forge(app):
+    add_user(app, 1)
+    add_prize_types(app)
+    material_ids = add_materials(app, 1, 5)
+    client = app.test_client()
+    token = sync(client, 1)['token']
+
+    assert client.post('/forge_lootbox', json={'user_id': 1, 'material_ids': material_ids}).status_code == 201
+    body = sync(client, 1, token)
+    assert ids(body, 'adventures') == material_ids
+    assert {row['status'] for row in body['adventures']} == {'Used Material'}
+    assert len(body['lootboxes']) == 1 and len(body['prizes']) == 1
+
+    with app.app_context():
+        use_shard(1)
+        forge_seq = db.session.get(ChangeCounter, 'adventure').version
+        assert {adventure.change_seq for adventure in Adventure.query.all()} == {forge_seq}
+
+
+# Changes are paged `limit` rows at a time, has_more staying true until the last page, and
+# every row comes back exactly once.
+def test_sync_pages_through_changes(app):
+    add_user(app, 1)
+    material_ids = add_materials(app, 1, 5)
+    client = app.test_client()
+
+    pages, token, has_more = [], None, True
+    while has_more:
+        body = sync(client, 1, token, limit=2)
+        pages.append(ids(body, 'adventures'))
+        token, has_more = body['token'], body['has_more']
+    assert pages == [material_ids[:2], material_ids[2:4], material_ids[4:]]
+
+
+# An adventure changed after the token and archived before the next sync is still returned,
+# once, even when the archiver's copy and the hot row are both seen.
+def test_adventure_archived_after_token_is_returned_once(make_app):
+    app = make_app(ARCHIVE_PAUSE_SECONDS=0)
+    add_user(app, 1)
+    add_prize_types(app)
+    material_ids = add_materials(app, 1, 10, timestamp=datetime.utcnow() - timedelta(days=60))
+    client = app.test_client()
+    token = sync(client, 1)['token']
+
+    forged, kept = material_ids[:5], material_ids[5:]
+    assert client.post('/forge_lootbox', json={'user_id': 1, 'material_ids': forged}).status_code == 201
+    with app.app_context():
+        assert archive_adventures(retention_days=30) == 5
+        # Mid-move, a row can be in both tables.
+        use_shard(1)
+        columns = [getattr(Adventure, name) for name in ARCHIVED_COLUMNS]
+        changed = add_materials(app, 1, 1)
+        use_shard(1)
+        db.session.execute(insert(ArchivedAdventure).from_select(
+            ARCHIVED_COLUMNS, select(*columns).where(Adventure.id.in_(changed))))
+        db.session.commit()
+
+    body = sync(client, 1, token)
+    assert ids(body, 'adventures') == forged + changed
+    assert {row['status'] for row in body['adventures'][:5]} == {'Used Material'}
+    assert not set(kept) & set(ids(body, 'adventures'))
+
+
+def encode(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+@pytest.mark.parametrize('token', [
+    'not a token',
+    encode([[-1, 0], [-1, 0], [-1, 0]]),
+    encode({'adventure': [-1, 0], 'loot_box': [-1, 0]}),
+    encode({'adventure': [-1, 0], 'loot_box': [-1, 0], 'prize': [-1]}),
+    encode({'adventure': [-1, 0], 'loot_box': [-1, 0], 'prize': ['-1', 0]}),
+])
+def test_malformed_token_is_refused(app, token):
+    add_user(app, 1)
+    response = app.test_client().get('/users/1/sync', query_string={'token': token})
+    assert response.status_code == 400
@@ -0,0 +1,57 @@
+import random
+import pytest
+from flask import g
+from sqlalchemy import func, select
+from app import db
+from app.models import Prize, PrizeType
+from app.sharding import shard_count
+from app.synthetic import RARITIES, generate
+
+
+def prize_counts():
+    counts = {}
+    for shard in range(shard_count()):
+        g.shard = shard
+        for prize_type_id, count in db.session.execute(select(Prize.prize_type_id, func.count()).group_by(Prize.prize_type_id)):
+            counts[prize_type_id] = counts.get(prize_type_id, 0) + count
+    return counts
+
+
+# Prizes are drawn only from stock that is left: every prize type ends with number_claimed
+# equal to its prizes and never past its quanity, and sold-out rarities give no prizes.
+@pytest.mark.parametrize('shards', [1, 2])
+def test_generate_respects_prize_stock(make_app, shards):
+    app = make_app(SHARD_COUNT=shards)
+    with app.app_context():
+        for rarity in RARITIES:
+            db.session.add(PrizeType(name=f"{rarity} a", rarity=rarity, quanity=5, number_claimed=2))
+            db.session.add(PrizeType(name=f"{rarity} b", rarity=rarity, quanity=4, number_claimed=0, weight=1.0))
+            db.session.add(PrizeType(name=f"{rarity} gone", rarity=rarity, quanity=3, number_claimed=3))
+        db.session.commit()
+
+        inserted = generate(200, 60, seed=1)
+        assert inserted['loot_box'] > inserted['prize']
+
+        counts = prize_counts()
+        for prize_type in PrizeType.query.all():
+            assert prize_type.number_claimed <= prize_type.quanity
+            already_claimed = 2 if prize_type.name.endswith(' a') else 0 if prize_type.name.endswith(' b') else 3
+            assert counts.get(prize_type.id, 0) == prize_type.number_claimed - already_claimed
+        # Common lootboxes outnumber the seven Common units left, which all went.
+        common = PrizeType.query.filter_by(rarity='Common').all()
+        assert all(prize_type.number_claimed == prize_type.quanity for prize_type in common)
+
+
+# The load draws from a generator of its own: the same seed gives the same rows, and the
+# random module's state, which live requests draw from, is left as it was.
+def test_generate_leaves_global_random_alone(make_app, tmp_path):
+    state = random.getstate()
+    rows = []
+    for directory in ('first', 'second'):
+        (tmp_path / directory).mkdir()
+        app = make_app(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / directory}/site.db")
+        with app.app_context():
+            generate(20, 30, seed=7)
+            rows.append(db.session.execute(select(Prize.id, Prize.user_id, Prize.prize_type_id)).all())
+    assert rows[0] == rows[1] and rows[0]
+    assert random.getstate() == state
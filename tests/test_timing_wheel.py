@@ -0,0 +1,22 @@
+import time
+from app.timing_wheel import EligibilityNotifier
+
+
+# A subscription whose deadline has passed is set at once and leaves no waiters behind.
+def test_subscribe_past_deadline_keeps_no_waiters(app):
+    notifier = EligibilityNotifier(app)
+    event = notifier.subscribe(1, time.time() - 60)
+    assert event.is_set()
+    assert notifier._waiters == {}
+    notifier.forget(1, event)
+    assert notifier._waiters == {}
+
+
+# Waiters on a future deadline are all woken together once the wheel reaches it.
+def test_subscribers_wake_at_deadline(app):
+    notifier = EligibilityNotifier(app)
+    deadline = time.time() + notifier.wheel.tick
+    events = [notifier.subscribe(1, deadline) for _ in range(3)]
+    assert not any(event.is_set() for event in events)
+    assert all(event.wait(5 * notifier.wheel.tick + 1) for event in events)
+    assert notifier._waiters == {}